@@ -1,119 +1,251 @@
-import csv
 import numpy as np
-from scipy.interpolate import interp1d
 import argparse
-import os
-
-
-def interpolate_bounding_boxes(data):
-    # Extract necessary data columns from input data
-    frame_numbers = np.array([int(row['frame_nmr']) for row in data])
-    car_ids = np.array([int(float(row['car_id'])) for row in data])
-    car_bboxes = np.array([list(map(float, row['car_bbox'][1:-1].split())) for row in data])
-    license_plate_bboxes = np.array([list(map(float, row['license_plate_bbox'][1:-1].split())) for row in data])
-
-    interpolated_data = []
-    unique_car_ids = np.unique(car_ids)
-    for car_id in unique_car_ids:
-
-        frame_numbers_ = [p['frame_nmr'] for p in data if int(float(p['car_id'])) == int(float(car_id))]
-        print(f"Processing car ID {car_id} with {len(frame_numbers_)} detections")
-
-        # Filter data for a specific car ID
-        car_mask = car_ids == car_id
-        car_frame_numbers = frame_numbers[car_mask]
-        car_bboxes_interpolated = []
-        license_plate_bboxes_interpolated = []
-
-        first_frame_number = car_frame_numbers[0]
-        last_frame_number = car_frame_numbers[-1]
-
-        for i in range(len(car_bboxes[car_mask])):
-            frame_number = car_frame_numbers[i]
-            car_bbox = car_bboxes[car_mask][i]
-            license_plate_bbox = license_plate_bboxes[car_mask][i]
-
-            if i > 0:
-                prev_frame_number = car_frame_numbers[i-1]
-                prev_car_bbox = car_bboxes_interpolated[-1]
-                prev_license_plate_bbox = license_plate_bboxes_interpolated[-1]
-
-                if frame_number - prev_frame_number > 1:
-                    # Interpolate missing frames' bounding boxes
-                    frames_gap = frame_number - prev_frame_number
-                    x = np.array([prev_frame_number, frame_number])
-                    x_new = np.linspace(prev_frame_number, frame_number, num=frames_gap, endpoint=False)
-                    interp_func = interp1d(x, np.vstack((prev_car_bbox, car_bbox)), axis=0, kind='linear')
-                    interpolated_car_bboxes = interp_func(x_new)
-                    interp_func = interp1d(x, np.vstack((prev_license_plate_bbox, license_plate_bbox)), axis=0, kind='linear')
-                    interpolated_license_plate_bboxes = interp_func(x_new)
-
-                    car_bboxes_interpolated.extend(interpolated_car_bboxes[1:])
-                    license_plate_bboxes_interpolated.extend(interpolated_license_plate_bboxes[1:])
-
-            car_bboxes_interpolated.append(car_bbox)
-            license_plate_bboxes_interpolated.append(license_plate_bbox)
-
-        for i in range(len(car_bboxes_interpolated)):
-            frame_number = first_frame_number + i
-            row = {}
-            row['frame_nmr'] = str(frame_number)
-            row['car_id'] = str(car_id)
-            row['car_bbox'] = ' '.join(map(str, car_bboxes_interpolated[i]))
-            row['license_plate_bbox'] = ' '.join(map(str, license_plate_bboxes_interpolated[i]))
-
-            if str(frame_number) not in frame_numbers_:
-                # Imputed row, set the following fields to '0'
-                row['license_plate_bbox_score'] = '0'
-                row['license_number'] = '0'
-                row['license_number_score'] = '0'
-            else:
-                # Original row, retrieve values from the input data if available
-                original_row = [p for p in data if int(p['frame_nmr']) == frame_number and int(float(p['car_id'])) == int(float(car_id))][0]
-                row['license_plate_bbox_score'] = original_row['license_plate_bbox_score'] if 'license_plate_bbox_score' in original_row else '0'
-                row['license_number'] = original_row['license_number'] if 'license_number' in original_row else '0'
-                row['license_number_score'] = original_row['license_number_score'] if 'license_number_score' in original_row else '0'
-
-            interpolated_data.append(row)
-
-    return interpolated_data
-
-
-def process_csv(input_file, output_file):
-    """Process the CSV file and interpolate missing data"""
-    # Create output directory if it doesn't exist
-    output_dir = os.path.dirname(output_file)
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir, exist_ok=True)
-        
-    # Load the input CSV file
+
+from detection_log import (concat_columns, empty_columns, iter_detection_chunks, load_detections, log_format,
+                           make_columns, num_rows, save_detections)
+from results_writer import open_results_writer
+
+# Idle frames after which a car stops being tracked by the streaming interpolation
+DEFAULT_MAX_GAP = 1000
+
+
+def _interpolate_column(values, left, right, steps, gaps, is_original):
+    # np.interp's formula, slope * (x - x_left) + y_left, evaluated for every track at once
+    original = values[right]
+    slope = (original - values[left]) / np.maximum(gaps, 1)[:, None]
+    interpolated = slope * steps[:, None] + values[left]
+    return np.where(is_original[:, None], original, interpolated)
+
+
+def interpolate_bounding_boxes(detections):
+    """
+    Fill in the bounding boxes of the frames missing between detections of each car.
+
+    The rows are grouped by car with one stable sort and the missing frames of all cars
+    are interpolated in a few array operations, so the run time grows with the number of
+    output rows rather than with rows times cars.
+
+    Args:
+        detections (dict): Detection log columns, see detection_log.make_columns.
+
+    Returns:
+        dict: Detection log with one row per car per frame between its first and last
+            detection. Imputed rows have a license number and scores of 0.
+    """
+    if num_rows(detections) == 0:
+        return empty_columns()
+
+    # Rows of each car in input order, cars in increasing id order
+    car_ids = detections['car_id'].astype(int)
+    order = np.argsort(car_ids, kind='stable')
+    cars = car_ids[order]
+    frames = detections['frame_nmr'][order].astype(np.int64)
+    num_input = len(order)
+
+    track_start = np.ones(num_input, dtype=bool)
+    track_start[1:] = cars[1:] != cars[:-1]
+    track_index = np.cumsum(track_start) - 1
+
+    # Frames missing before each row, interpolated from the previous row of its car
+    gaps = np.zeros(num_input, dtype=np.int64)
+    gaps[1:] = frames[1:] - frames[:-1]
+    gaps[track_start] = 0
+    missing = np.where(gaps > 1, gaps - 1, 0)
+
+    # Every input row emits its missing frames followed by itself
+    counts = missing + 1
+    ends = np.cumsum(counts)
+    owner = np.repeat(np.arange(num_input), counts)
+    steps = np.arange(ends[-1]) - (ends - counts)[owner] + 1
+    is_original = steps == counts[owner]
+
+    right = order[owner]
+    left = order[np.maximum(owner - 1, 0)]
+    car_bbox = _interpolate_column(detections['car_bbox'], left, right, steps, gaps[owner], is_original)
+    license_plate_bbox = _interpolate_column(detections['license_plate_bbox'], left, right, steps, gaps[owner],
+                                             is_original)
+
+    # Output frames count up from the first detection of each car
+    track_first = np.flatnonzero(track_start)
+    output_track = track_index[owner]
+    output_first = (ends - counts)[track_first]
+    frame_nmr = frames[track_first][output_track] + np.arange(ends[-1]) - output_first[output_track]
+
+    # Scores and license number of the first input row of the car in each output frame, 0 if imputed
+    span = int(max(frame_nmr.max(), frames.max()) - frames.min()) + 1
+    input_keys = track_index * span + (frames - frames.min())
+    keys, first_rows = np.unique(input_keys, return_index=True)
+    output_keys = output_track * span + (frame_nmr - frames.min())
+    positions = np.minimum(np.searchsorted(keys, output_keys), len(keys) - 1)
+    found = keys[positions] == output_keys
+    source_rows = order[first_rows[positions]]
+
+    license_number = np.where(found, detections['license_number'][source_rows].astype(str), '0')
+    license_plate_bbox_score = np.where(found, detections['license_plate_bbox_score'][source_rows], 0)
+    license_number_score = np.where(found, detections['license_number_score'][source_rows], 0)
+
+    return make_columns(frame_nmr, cars[owner], car_bbox, license_plate_bbox, license_plate_bbox_score,
+                        license_number, license_number_score)
+
+
+class StreamingInterpolator:
+    """
+    Interpolate a detection log read chunk by chunk in frame order.
+
+    Only the last detection of each car still in view is kept between chunks. A car is
+    dropped once it has not been detected for more than max_gap frames, and a later
+    detection with its id starts a new track without filling the gap. Memory use is
+    therefore bounded by the chunk size and the number of cars in view at once, not by
+    the length of the video.
+
+    Every row of a chunk is emitted together with the missing frames before it, in frame
+    order. Apart from gaps longer than max_gap and the row order, the output matches
+    interpolate_bounding_boxes for logs with one row per car and frame.
+    """
+
+    def __init__(self, max_gap=DEFAULT_MAX_GAP):
+        """
+        Args:
+            max_gap (int): Maximum number of consecutive missing frames filled in for a car.
+        """
+        self.max_gap = max_gap
+        # Last detection of every active car
+        self._tracks = empty_columns()
+        self._last_frame = None
+
+    @property
+    def active_tracks(self):
+        return num_rows(self._tracks)
+
+    def add(self, chunk):
+        """
+        Interpolate the next chunk of the log.
+
+        Args:
+            chunk (dict): Detection log columns, see detection_log.make_columns, continuing
+                the previous chunk in frame order.
+
+        Returns:
+            dict: The rows of the chunk and the frames missing before them.
+
+        Raises:
+            ValueError: If the rows are not in frame order.
+        """
+        if num_rows(chunk) == 0:
+            return empty_columns()
+        frames_in = chunk['frame_nmr'].astype(np.int64)
+        if np.any(frames_in[1:] < frames_in[:-1]) or (self._last_frame is not None and frames_in[0] < self._last_frame):
+            raise ValueError("Detection log is not in frame order, interpolate it without streaming")
+        self._last_frame = int(frames_in[-1])
+
+        # The last detections of the active cars go first, so each is the previous row of its car
+        num_tracks = num_rows(self._tracks)
+        combined = concat_columns([self._tracks, make_columns(**chunk)])
+        car_ids = combined['car_id'].astype(int)
+        order = np.argsort(car_ids, kind='stable')
+        cars = car_ids[order]
+        frames = combined['frame_nmr'][order]
+
+        track_start = np.ones(len(order), dtype=bool)
+        track_start[1:] = cars[1:] != cars[:-1]
+        gaps = np.zeros(len(order), dtype=np.int64)
+        gaps[1:] = frames[1:] - frames[:-1]
+        gaps[track_start] = 0
+        missing = np.where((gaps > 1) & (gaps - 1 <= self.max_gap), gaps - 1, 0)
+
+        # Rows of the chunk emit their missing frames followed by themselves, kept tracks nothing
+        counts = np.where(order >= num_tracks, missing + 1, 0)
+        ends = np.cumsum(counts)
+        owner = np.repeat(np.arange(len(order)), counts)
+        steps = np.arange(ends[-1]) - (ends - counts)[owner] + 1
+        is_original = steps == counts[owner]
+
+        right = order[owner]
+        left = order[np.maximum(owner - 1, 0)]
+        car_bbox = _interpolate_column(combined['car_bbox'], left, right, steps, gaps[owner], is_original)
+        license_plate_bbox = _interpolate_column(combined['license_plate_bbox'], left, right, steps, gaps[owner],
+                                                 is_original)
+        frame_nmr = frames[owner] - counts[owner] + steps
+
+        output = make_columns(
+            frame_nmr, cars[owner], car_bbox, license_plate_bbox,
+            np.where(is_original, combined['license_plate_bbox_score'][right], 0),
+            np.where(is_original, combined['license_number'][right], '0'),
+            np.where(is_original, combined['license_number_score'][right], 0))
+
+        # Keep the last detection of each car that can still be continued
+        track_end = np.ones(len(order), dtype=bool)
+        track_end[:-1] = cars[1:] != cars[:-1]
+        keep = order[track_end & (frames >= self._last_frame - self.max_gap - 1)]
+        self._tracks = {column: values[keep] for column, values in combined.items()}
+
+        frame_order = np.argsort(output['frame_nmr'], kind='stable')
+        return {column: values[frame_order] for column, values in output.items()}
+
+
+def output_format(output_file):
+    """Return the format of an interpolated log, keeping the interpolated CSV text for .csv files."""
+    file_format = log_format(output_file)
+    return 'interpolated_csv' if file_format == 'csv' else file_format
+
+
+def process_csv(input_file, output_file, stream=False, max_gap=DEFAULT_MAX_GAP, chunk_rows=100000):
+    """
+    Interpolate missing data in a detection log
+
+    The input and output can be CSV, JSONL, NPZ or Parquet files, chosen by file extension
+    (see detection_log.py); NPZ is the fastest to load. CSV output keeps the text format
+    of earlier versions: integer car ids, boxes without brackets and imputed scores of 0.
+
+    Args:
+        input_file (str): Detection log written by main.py
+        output_file (str): Interpolated detection log
+        stream (bool): Read the log in chunks and append the interpolated rows to the output
+            as they are produced; the log must be in frame order (default: False)
+        max_gap (int): Streaming only, maximum number of missing frames filled in for a car
+        chunk_rows (int): Streaming only, rows read at a time
+    """
+    if stream:
+        print(f"Streaming data from: {input_file}")
+        input_rows = 0
+        interpolator = StreamingInterpolator(max_gap)
+        # NPZ and Parquet outputs are still written when the last chunk is done
+        with open_results_writer(output_file, output_format(output_file), flush_rows=chunk_rows) as results_writer:
+            for chunk in iter_detection_chunks(input_file, chunk_rows):
+                input_rows += num_rows(chunk)
+                results_writer.write_detections(interpolator.add(chunk))
+        print(f"Found {input_rows} detection records")
+        print(f"Interpolation complete. Output saved to: {output_file}")
+        print(f"Generated {results_writer.rows_written} interpolated records")
+        return
+
+    # Load the input detection log
     print(f"Reading data from: {input_file}")
-    with open(input_file, 'r') as file:
-        reader = csv.DictReader(file)
-        data = list(reader)
+    detections = load_detections(input_file)
     
-    print(f"Found {len(data)} detection records")
+    print(f"Found {num_rows(detections)} detection records")
     
     # Interpolate missing data
-    interpolated_data = interpolate_bounding_boxes(data)
+    interpolated = interpolate_bounding_boxes(detections)
     
-    # Write updated data to output CSV file
-    header = ['frame_nmr', 'car_id', 'car_bbox', 'license_plate_bbox', 'license_plate_bbox_score', 'license_number', 'license_number_score']
-    with open(output_file, 'w', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=header)
-        writer.writeheader()
-        writer.writerows(interpolated_data)
+    # Write updated data to the output file, creating its directory if needed
+    save_detections(interpolated, output_file, output_format(output_file))
     
     print(f"Interpolation complete. Output saved to: {output_file}")
-    print(f"Generated {len(interpolated_data)} interpolated records")
+    print(f"Generated {num_rows(interpolated)} interpolated records")
 
 
 if __name__ == "__main__":
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='Interpolate missing data in license plate detection CSV')
-    parser.add_argument('--input', type=str, default='./test.csv', help='Path to input CSV file')
-    parser.add_argument('--output', type=str, default='./output/test_interpolated.csv', help='Path to output CSV file')
+    parser.add_argument('--input', type=str, default='./test.csv', help='Path to input detection log (.csv, .jsonl, .npz or .parquet)')
+    parser.add_argument('--output', type=str, default='./output/test_interpolated.csv', help='Path to output detection log (.csv, .jsonl, .npz or .parquet)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read the log in chunks and write the output incrementally, in bounded memory (log must be in frame order)')
+    parser.add_argument('--max-gap', type=int, default=DEFAULT_MAX_GAP,
+                        help=f'With --stream, stop tracking a car after this many frames without a detection (default: {DEFAULT_MAX_GAP})')
+    parser.add_argument('--chunk-rows', type=int, default=100000, help='With --stream, rows read at a time (default: 100000)')
     args = parser.parse_args()
     
     # Process the CSV file
-    process_csv(args.input, args.output)
+    process_csv(args.input, args.output, stream=args.stream, max_gap=args.max_gap, chunk_rows=args.chunk_rows)
@@ -0,0 +1,381 @@
+import argparse
+import ast
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import util
+from detection_log import load_detections, make_columns, save_detections
+
+
+def load_plate_crops_from_dir(crops_dir, limit=None):
+    """Load license plate crop images from a directory and threshold them like main.py does."""
+    crops = []
+    for filename in sorted(os.listdir(crops_dir)):
+        if limit is not None and len(crops) >= limit:
+            break
+        image = cv2.imread(os.path.join(crops_dir, filename))
+        if image is not None:
+            crops.append(util.threshold_license_plate_crop(image))
+    return crops
+
+
+def load_plate_crops_from_video(video_path, csv_path, limit=None):
+    """Cut the license plate crops listed in a detection log out of the video, in one forward pass."""
+    detections = load_detections(csv_path)
+    plate_bboxes = {}
+    for frame_nmr, bbox in zip(detections['frame_nmr'].tolist(), detections['license_plate_bbox'].tolist()):
+        plate_bboxes.setdefault(frame_nmr, []).append(bbox)
+
+    crops = []
+    cap = cv2.VideoCapture(video_path)
+    frame_nmr = -1
+    last_frame_nmr = max(plate_bboxes) if plate_bboxes else -1
+    while frame_nmr < last_frame_nmr and (limit is None or len(crops) < limit):
+        ret, frame = cap.read()
+        frame_nmr += 1
+        if not ret:
+            break
+        for x1, y1, x2, y2 in plate_bboxes.get(frame_nmr, []):
+            crop = frame[int(y1):int(y2), int(x1):int(x2), :]
+            if crop.size:
+                crops.append(util.threshold_license_plate_crop(crop))
+    cap.release()
+    return crops[:limit]
+
+
+def benchmark_ocr(crops, batch_size=8):
+    """
+    Compare OCR throughput and read rate of the readtext and recognizer-only paths.
+
+    Args:
+        crops (list): Thresholded license plate crops.
+        batch_size (int): Crops per OCR call for the batched modes.
+
+    Returns:
+        list: One dictionary per mode with throughput, read rate and agreement with readtext.
+    """
+    modes = [
+        ('readtext', 1, False),
+        ('readtext batched', batch_size, False),
+        ('recognize only', 1, True),
+        ('recognize only batched', batch_size, True)
+    ]
+
+    # Warm up the reader so model loading is not timed
+    util.read_license_plates(crops[:1], 1, False)
+
+    rows = []
+    reference = None
+    for name, mode_batch_size, recognize_only in modes:
+        start = time.perf_counter()
+        plates = util.read_license_plates(crops, mode_batch_size, recognize_only)
+        elapsed = time.perf_counter() - start
+
+        texts = [text for text, _ in plates]
+        if reference is None:
+            reference = texts
+        rows.append({
+            'mode': name,
+            'seconds': elapsed,
+            'crops_per_second': len(crops) / elapsed if elapsed > 0 else 0.0,
+            'read_rate': sum(text is not None for text in texts) / len(crops),
+            'agreement': sum(text == ref for text, ref in zip(texts, reference)) / len(crops)
+        })
+    return rows
+
+
+# Entry point modules and the call that first touches their heavy resources
+STARTUP_ENTRY_POINTS = [
+    ('util', 'util.get_reader()'),
+    ('database_utils', "database_utils.check_license_plate_in_database('NA13NRU')"),
+    ('main', 'main.get_engine()'),
+    ('manage_vehicles', None),
+    ('add_missing_data', None),
+    ('visualize', None),
+    ('reset_database', None)
+]
+
+_STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+first_call = None
+if {first_call!r} is not None:
+    eval({first_call!r})
+    first_call = time.perf_counter() - imported
+print('STARTUP ' + json.dumps({{'import': imported - start, 'first_call': first_call}}))
+"""
+
+
+def benchmark_startup(entry_points=STARTUP_ENTRY_POINTS, first_calls=True):
+    """
+    Measure import time and first-call latency of each entry point in a fresh interpreter.
+
+    Args:
+        entry_points (list): (module, first_call) pairs; first_call is an expression or None.
+        first_calls (bool): Also time the first call that loads each module's heavy resources.
+
+    Returns:
+        list: One dictionary per entry point with import and first-call seconds.
+    """
+    rows = []
+    for module, first_call in entry_points:
+        script = _STARTUP_SCRIPT.format(module=module, first_call=first_call if first_calls else None)
+        process = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True,
+                                 cwd=os.path.dirname(os.path.abspath(__file__)))
+        timings = None
+        for line in process.stdout.splitlines():
+            if line.startswith('STARTUP '):
+                timings = json.loads(line[len('STARTUP '):])
+
+        if timings is None:
+            error = (process.stderr.strip().splitlines() or ['no output'])[-1]
+            rows.append({'entry_point': module, 'import_s': float('nan'), 'first_call_s': float('nan'),
+                         'error': error[:60]})
+        else:
+            rows.append({'entry_point': module, 'import_s': timings['import'],
+                         'first_call_s': timings['first_call'] if timings['first_call'] is not None else float('nan'),
+                         'error': ''})
+    return rows
+
+
+def synthetic_detections(num_rows, visible_cars=20, track_length=300, detection_rate=0.75, seed=0):
+    """
+    Generate a detection log of cars crossing the view one after another, in frame order.
+
+    Args:
+        num_rows (int): Approximate number of rows.
+        visible_cars (int): Number of cars in view at any time.
+        track_length (int): Frames each car stays in view.
+        detection_rate (float): Fraction of a car's frames in which its plate is read; the
+            others are the gaps filled by interpolation.
+        seed (int): Random seed.
+
+    Returns:
+        dict: Detection log columns, see detection_log.make_columns.
+    """
+    rng = np.random.default_rng(seed)
+    num_tracks = max(1, int(np.ceil(num_rows / (track_length * detection_rate))))
+    starts = np.arange(num_tracks) * track_length // visible_cars
+    car_ids = np.repeat(np.arange(1, num_tracks + 1), track_length)
+    frame_nmrs = np.repeat(starts, track_length) + np.tile(np.arange(track_length), num_tracks)
+
+    # Keep the first and last frame of every track so its frame range does not depend on the gaps
+    offsets = np.tile(np.arange(track_length), num_tracks)
+    keep = (rng.random(len(car_ids)) < detection_rate) | (offsets == 0) | (offsets == track_length - 1)
+    car_ids, frame_nmrs = car_ids[keep], frame_nmrs[keep]
+    order = np.argsort(frame_nmrs, kind='stable')
+    car_ids, frame_nmrs = car_ids[order], frame_nmrs[order]
+
+    n = len(car_ids)
+    car_bboxes = np.column_stack([frame_nmrs % 1000, car_ids % 500, frame_nmrs % 1000 + 200, car_ids % 500 + 150])
+    plate_bboxes = car_bboxes[:, :2].repeat(2, axis=1) + [60, 100, 140, 120]
+    return make_columns(frame_nmrs, car_ids, car_bboxes, plate_bboxes, rng.random(n),
+                        np.full(n, 'AB12CDE'), rng.random(n))
+
+
+def benchmark_interpolation(sizes=(10_000, 100_000, 1_000_000, 10_000_000), visible_cars=20):
+    """
+    Time add_missing_data.interpolate_bounding_boxes on synthetic logs of growing size.
+
+    Args:
+        sizes (iterable): Approximate input row counts.
+        visible_cars (int): Number of cars in view at any time.
+
+    Returns:
+        list: One dictionary per size with input and output rows, seconds and rows per second.
+    """
+    from add_missing_data import interpolate_bounding_boxes
+
+    rows = []
+    for size in sizes:
+        detections = synthetic_detections(size, visible_cars)
+        start = time.perf_counter()
+        interpolated = interpolate_bounding_boxes(detections)
+        elapsed = time.perf_counter() - start
+        input_rows = len(detections['frame_nmr'])
+        rows.append({
+            'input_rows': input_rows,
+            'output_rows': len(interpolated['frame_nmr']),
+            'cars': len(np.unique(detections['car_id'])),
+            'seconds': elapsed,
+            'input_rows_per_second': input_rows / elapsed if elapsed > 0 else 0.0
+        })
+    return rows
+
+
+def _parse_bbox_literal(text):
+    # The box parsing of the original visualize.py
+    return ast.literal_eval(text.replace('[ ', '[').replace('   ', ' ').replace('  ', ' ').replace(' ', ','))
+
+
+def draw_overlays_pandas(frame, results, frame_nmr, license_plate):
+    """
+    Draw the overlays of one frame the way the original visualize.py did.
+
+    The rows of the frame are found by filtering the whole DataFrame and every box is
+    parsed from its text with ast.literal_eval, for every frame.
+    """
+    from visualize import FONT_SCALE, FONT_THICKNESS, TEXT_BACKGROUND_HEIGHT, VERTICAL_PADDING, draw_border
+
+    df_ = results[results['frame_nmr'] == frame_nmr]
+    for row_indx in range(len(df_)):
+        car_id = int(float(df_.iloc[row_indx]['car_id']))
+        car_x1, car_y1, car_x2, car_y2 = _parse_bbox_literal(df_.iloc[row_indx]['car_bbox'])
+        draw_border(frame, (int(car_x1), int(car_y1)), (int(car_x2), int(car_y2)), (0, 255, 0), 10,
+                    line_length_x=200, line_length_y=200)
+        x1, y1, x2, y2 = _parse_bbox_literal(df_.iloc[row_indx]['license_plate_bbox'])
+        cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 0, 255), 12)
+
+        license_crop = license_plate[car_id]['license_crop']
+        H, W, _ = license_crop.shape
+        try:
+            frame[int(car_y1) - H - VERTICAL_PADDING:int(car_y1) - VERTICAL_PADDING,
+                  int((car_x2 + car_x1 - W) / 2):int((car_x2 + car_x1 + W) / 2), :] = license_crop
+            frame[int(car_y1) - H - VERTICAL_PADDING - TEXT_BACKGROUND_HEIGHT:int(car_y1) - H - VERTICAL_PADDING,
+                  int((car_x2 + car_x1 - W) / 2):int((car_x2 + car_x1 + W) / 2), :] = (255, 255, 255)
+            (text_width, text_height), _ = cv2.getTextSize(license_plate[car_id]['license_plate_number'],
+                                                           cv2.FONT_HERSHEY_SIMPLEX, FONT_SCALE, FONT_THICKNESS)
+            text_y_position = int(car_y1) - H - VERTICAL_PADDING - TEXT_BACKGROUND_HEIGHT // 2 + text_height // 2
+            cv2.putText(frame, license_plate[car_id]['license_plate_number'],
+                        (int((car_x2 + car_x1 - text_width) / 2), text_y_position),
+                        cv2.FONT_HERSHEY_SIMPLEX, FONT_SCALE, (0, 0, 0), FONT_THICKNESS)
+        except Exception:
+            pass
+    return frame
+
+
+def benchmark_overlays(num_rows=100_000, max_frames=500, frame_size=(1920, 1080), visible_cars=20):
+    """
+    Compare the overlay rendering of the original visualize.py with the current frame index.
+
+    The synthetic log is written as a CSV file and loaded by each path: the original one
+    reads it with pandas, filters the DataFrame for every frame and parses the boxes with
+    ast.literal_eval; the current one loads it with detection_log and builds a
+    FrameOverlays index. Overlays are drawn on blank frames, so decoding and encoding are
+    not timed.
+
+    Args:
+        num_rows (int): Approximate number of rows of the synthetic log.
+        max_frames (int): Number of frames rendered, spread over the log.
+        frame_size (tuple): (width, height) of the frames.
+        visible_cars (int): Number of cars in view at any time.
+
+    Returns:
+        list: One dictionary per path with its load time, the frames rendered and frames per second.
+    """
+    import pandas as pd
+
+    from visualize import FrameOverlays, draw_overlays
+
+    detections = synthetic_detections(num_rows, visible_cars)
+    thumbnail = np.full((200, 400, 3), 128, dtype=np.uint8)
+    license_plate = {car_id: {'license_crop': thumbnail, 'license_plate_number': 'AB12CDE'}
+                     for car_id in np.unique(detections['car_id'].astype(int)).tolist()}
+    frame_nmrs = np.linspace(detections['frame_nmr'].min(), detections['frame_nmr'].max(),
+                             max_frames).astype(int).tolist()
+    blank = np.zeros((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+
+    def load_pandas(path):
+        return pd.read_csv(path)
+
+    def draw_pandas(results, frame_nmr):
+        draw_overlays_pandas(blank.copy(), results, frame_nmr, license_plate)
+
+    def load_index(path):
+        return FrameOverlays(load_detections(path), license_plate)
+
+    def draw_index(overlays, frame_nmr):
+        draw_overlays(blank.copy(), overlays, overlays.rows(frame_nmr), license_plate, {})
+
+    paths = [
+        ('pandas filter (original)', load_pandas, draw_pandas),
+        ('frame index', load_index, draw_index)
+    ]
+    rows = []
+    with tempfile.TemporaryDirectory() as log_dir:
+        log_path = os.path.join(log_dir, 'detections.csv')
+        save_detections(detections, log_path)
+        for name, load, draw in paths:
+            start = time.perf_counter()
+            log = load(log_path)
+            load_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for frame_nmr in frame_nmrs:
+                draw(log, frame_nmr)
+            elapsed = time.perf_counter() - start
+            rows.append({
+                'path': name,
+                'log_rows': len(detections['frame_nmr']),
+                'load_seconds': load_seconds,
+                'frames': len(frame_nmrs),
+                'seconds': elapsed,
+                'frames_per_second': len(frame_nmrs) / elapsed if elapsed > 0 else 0.0
+            })
+    return rows
+
+
+def print_rows(rows):
+    columns = list(rows[0].keys())
+    print('  '.join('{:>22}'.format(column) for column in columns))
+    for row in rows:
+        print('  '.join('{:>22.3f}'.format(value) if isinstance(value, float) else '{:>22}'.format(value)
+                        for value in row.values()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ANPR performance benchmarks')
+    subparsers = parser.add_subparsers(dest='command', help='Benchmark to run')
+
+    # OCR benchmark
+    ocr_parser = subparsers.add_parser('ocr', help='Compare readtext and recognizer-only OCR on plate crops')
+    ocr_parser.add_argument('--crops-dir', type=str, help='Directory of license plate crop images')
+    ocr_parser.add_argument('--video', type=str, default='./sample2.mp4', help='Video to cut plate crops from')
+    ocr_parser.add_argument('--csv', type=str, default='./test.csv', help='Detection log with plate boxes for --video')
+    ocr_parser.add_argument('--limit', type=int, default=500, help='Maximum number of crops')
+    ocr_parser.add_argument('--batch-size', type=int, default=8, help='Crops per OCR call in the batched modes')
+
+    # Startup benchmark
+    startup_parser = subparsers.add_parser('startup', help='Measure import time and first-call latency of entry points')
+    startup_parser.add_argument('--imports-only', action='store_true', help='Only measure import time')
+
+    # Interpolation benchmark
+    interpolate_parser = subparsers.add_parser('interpolate', help='Measure how add_missing_data scales with log size')
+    interpolate_parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000, 10_000_000],
+                                    help='Approximate input row counts (default: 10k to 10M)')
+    interpolate_parser.add_argument('--visible-cars', type=int, default=20, help='Cars in view at any time (default: 20)')
+
+    # Overlay rendering benchmark
+    overlays_parser = subparsers.add_parser('overlays', help='Compare the original pandas overlay rendering with the frame index')
+    overlays_parser.add_argument('--rows', type=int, default=100_000, help='Rows of the synthetic log (default: 100000)')
+    overlays_parser.add_argument('--frames', type=int, default=500, help='Frames rendered (default: 500)')
+
+    args = parser.parse_args()
+
+    if args.command == 'ocr':
+        if args.crops_dir:
+            crops = load_plate_crops_from_dir(args.crops_dir, args.limit)
+        else:
+            crops = load_plate_crops_from_video(args.video, args.csv, args.limit)
+        if not crops:
+            print("No license plate crops found.")
+        else:
+            print(f"Benchmarking OCR on {len(crops)} license plate crops")
+            print_rows(benchmark_ocr(crops, args.batch_size))
+    elif args.command == 'startup':
+        print_rows(benchmark_startup(first_calls=not args.imports_only))
+    elif args.command == 'interpolate':
+        print_rows(benchmark_interpolation(args.sizes, args.visible_cars))
+    elif args.command == 'overlays':
+        print_rows(benchmark_overlays(args.rows, args.frames))
+    else:
+        parser.print_help()
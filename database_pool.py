@@ -0,0 +1,148 @@
+import contextlib
+import os
+import sqlite3
+import threading
+
+# Milliseconds a connection waits for another writer's lock before failing with "database is locked"
+BUSY_TIMEOUT_MS = 5000
+
+# Prepared statements kept per connection, keyed by their SQL text
+CACHED_STATEMENTS = 256
+
+_local = threading.local()
+
+
+def _file_id(db_file):
+    try:
+        stat = os.stat(db_file)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+def open_connection(db_file, check_same_thread=True):
+    """
+    Open a new SQLite connection configured for concurrent use.
+
+    The connection is in autocommit mode (use transaction() to group statements), the
+    database is switched to WAL journaling so readers never block the writer, and
+    statements wait up to BUSY_TIMEOUT_MS for a lock instead of failing immediately.
+
+    Args:
+        db_file (str): Database file.
+        check_same_thread (bool): Restrict the connection to the thread that opened it.
+
+    Returns:
+        sqlite3.Connection: The connection.
+    """
+    conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None,
+                           check_same_thread=check_same_thread, cached_statements=CACHED_STATEMENTS)
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA journal_mode = WAL')
+    # With WAL, NORMAL only syncs at checkpoints and stays durable across application crashes
+    conn.execute('PRAGMA synchronous = NORMAL')
+    return conn
+
+
+def get_connection(db_file):
+    """
+    Return the calling thread's connection to a database, opening it on first use.
+
+    Connections are kept per thread and database file, so their prepared statements are
+    reused across calls. A connection is reopened when the database file was deleted or
+    replaced (e.g. by reset_database.py).
+
+    Args:
+        db_file (str): Database file.
+
+    Returns:
+        sqlite3.Connection: Connection in autocommit mode, see open_connection.
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+    file_id = _file_id(db_file)
+    entry = connections.get(db_file)
+    if entry is not None:
+        conn, conn_file_id = entry
+        if file_id is not None and file_id == conn_file_id:
+            return conn
+        conn.close()
+    conn = open_connection(db_file)
+    connections[db_file] = (conn, _file_id(db_file))
+    return conn
+
+
+def close_connections(db_file=None):
+    """
+    Close the calling thread's connections.
+
+    Args:
+        db_file (str, optional): Only close the connection to this database.
+    """
+    connections = getattr(_local, 'connections', {})
+    for name in [db_file] if db_file is not None else list(connections):
+        entry = connections.pop(name, None)
+        if entry is not None:
+            entry[0].close()
+
+
+@contextlib.contextmanager
+def transaction(db_file, immediate=True):
+    """
+    Run statements on the calling thread's connection in one transaction.
+
+    The transaction commits when the block exits and rolls back on an exception. Nested
+    blocks join the outer transaction.
+
+    Args:
+        db_file (str): Database file.
+        immediate (bool): Take the write lock at the start of the transaction, so a
+            writer waits for the busy timeout once instead of failing when it upgrades
+            a read transaction (default: True)
+
+    Yields:
+        sqlite3.Connection: The connection.
+    """
+    conn = get_connection(db_file)
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+    try:
+        yield conn
+        conn.execute('COMMIT')
+    except BaseException:
+        # Never leave the pooled connection inside a failed transaction
+        if conn.in_transaction:
+            conn.execute('ROLLBACK')
+        raise
+
+
+def remove_database(db_file):
+    """
+    Delete a database file together with its WAL and shared-memory files.
+
+    The calling thread's connection is closed first; a stale WAL file left next to a new
+    database would otherwise be replayed into it.
+
+    Args:
+        db_file (str): Database file.
+
+    Returns:
+        bool: Whether the database file existed.
+    """
+    close_connections(db_file)
+    existed = os.path.exists(db_file)
+    for path in (db_file, db_file + '-wal', db_file + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+    return existed
+
+
+def is_lock_error(error):
+    """Whether a database error is a transient lock conflict that can be retried."""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
@@ -1,64 +1,204 @@
-import sqlite3
 import os
 import csv
+import threading
+import time
 from datetime import datetime
 
+from database_pool import get_connection, open_connection, transaction
+from fuzzy_match import FuzzyPlateIndex, match_score
+
 # Database file path
 DB_FILE = 'stolen_vehicles.db'
 
-def initialize_database():
-    """Initialize the database with required tables if they don't exist."""
-    conn = None
+# Set once the schema has been checked in this process, see ensure_database
+_database_ready = False
+_database_lock = threading.Lock()
+
+# Columns of a stolen vehicle record, in the order stored by the hotlist index
+VEHICLE_COLUMNS = ['id', 'license_plate', 'make', 'model', 'year', 'color', 'description', 'date_reported', 'status']
+
+# Rows kept in the stolen_vehicle_changes log; a hotlist index further behind reloads in full
+CHANGE_LOG_ROWS = 100000
+
+# The change log is pruned back to CHANGE_LOG_ROWS every this many logged changes
+CHANGE_LOG_PRUNE_INTERVAL = 1000
+
+# Hotlist index shared by check_license_plate_in_database calls, see get_hotlist
+_hotlist = None
+_hotlist_lock = threading.Lock()
+
+# Columns of a detection event, in insert order (see record_detection_events)
+DETECTION_EVENT_COLUMNS = ['license_plate', 'vehicle_id', 'frame_number', 'timestamp', 'confidence',
+                           'video_path', 'image_path', 'job_id', 'user_id', 'match_score']
+
+INSERT_DETECTION_SQL = f'''
+INSERT INTO detections ({', '.join(DETECTION_EVENT_COLUMNS)})
+VALUES ({', '.join('?' * len(DETECTION_EVENT_COLUMNS))})
+'''
+
+# Rows of a CSV import written per transaction, see import_vehicles_from_csv
+IMPORT_CHUNK_SIZE = 50000
+
+# Page cache used during a CSV import, in KiB (negative cache_size), so the plate index stays cached
+IMPORT_CACHE_SIZE = -262144
+
+# Columns of a stolen vehicle record read from a CSV import, in file order, followed by an optional status
+IMPORT_COLUMNS = ['license_plate', 'make', 'model', 'year', 'color', 'description', 'date_reported']
+
+# Status of an imported plate: the one given in the file, else ACTIVE for a new plate or one a
+# sync marked REMOVED, else the current one (RECOVERED and INVALID plates keep their status)
+_IMPORT_STATUS = f"COALESCE(?{len(IMPORT_COLUMNS) + 1}, CASE WHEN status = 'REMOVED' THEN 'ACTIVE' ELSE status END)"
+
+# Upsert keeping the id of known plates; unchanged rows are not rewritten, so they do not reach the change log
+UPSERT_VEHICLE_SQL = f'''
+INSERT INTO stolen_vehicles ({', '.join(IMPORT_COLUMNS)}, status)
+VALUES ({', '.join(f'?{i}' for i in range(1, len(IMPORT_COLUMNS) + 1))}, COALESCE(?{len(IMPORT_COLUMNS) + 1}, 'ACTIVE'))
+ON CONFLICT (license_plate) DO UPDATE SET
+    {', '.join(f'{column} = excluded.{column}' for column in IMPORT_COLUMNS[1:])},
+    status = {_IMPORT_STATUS}
+WHERE {' OR '.join(f'{column} IS NOT excluded.{column}' for column in IMPORT_COLUMNS[1:])}
+   OR status IS NOT {_IMPORT_STATUS}
+'''
+
+# Statuses a CSV import may set explicitly
+IMPORT_STATUSES = ['ACTIVE', 'RECOVERED', 'INVALID', 'REMOVED']
+
+# Columns of a detection history row returned by query_detections
+DETECTION_QUERY_COLUMNS = ['id', 'license_plate', 'make', 'model', 'frame_number', 'timestamp', 'confidence',
+                           'match_score', 'video_path', 'image_path', 'job_id', 'user_id']
+
+def initialize_database(add_samples=True):
+    """
+    Initialize the database with required tables if they don't exist.
+    
+    Args:
+        add_samples (bool): Add the sample stolen vehicles if the table is empty
+    """
     try:
-        # Create database connection
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        # Create stolen_vehicles table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS stolen_vehicles (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            license_plate TEXT UNIQUE,
-            make TEXT,
-            model TEXT,
-            year TEXT,
-            color TEXT,
-            description TEXT,
-            date_reported TEXT,
-            status TEXT DEFAULT 'ACTIVE'
-        )
-        ''')
-        
-        # Create detections table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS detections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            license_plate TEXT,
-            vehicle_id INTEGER,
-            frame_number INTEGER,
-            timestamp TEXT,
-            confidence REAL,
-            video_path TEXT,
-            image_path TEXT,
-            job_id TEXT,
-            user_id TEXT,
-            FOREIGN KEY (vehicle_id) REFERENCES stolen_vehicles (id)
-        )
-        ''')
-        
-        conn.commit()
+        with transaction(DB_FILE) as conn:
+            _create_tables(conn)
         print("Database initialized successfully")
         
         # If the database was just created, add sample data
-        cursor.execute("SELECT COUNT(*) FROM stolen_vehicles")
-        if cursor.fetchone()[0] == 0:
+        count = get_connection(DB_FILE).execute("SELECT COUNT(*) FROM stolen_vehicles").fetchone()[0]
+        if add_samples and count == 0:
             add_sample_vehicles()
             
     except Exception as e:
         print(f"Error initializing database: {e}")
-    finally:
-        if conn:
-            conn.close()
+
+def _create_tables(conn):
+    """Create the tables, migrations and triggers of the schema on a connection."""
+    cursor = conn.cursor()
+    
+    # Create stolen_vehicles table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stolen_vehicles (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        license_plate TEXT UNIQUE,
+        make TEXT,
+        model TEXT,
+        year TEXT,
+        color TEXT,
+        description TEXT,
+        date_reported TEXT,
+        status TEXT DEFAULT 'ACTIVE'
+    )
+    ''')
+    
+    # Create detections table
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS detections (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        license_plate TEXT,
+        vehicle_id INTEGER,
+        frame_number INTEGER,
+        timestamp TEXT,
+        confidence REAL,
+        video_path TEXT,
+        image_path TEXT,
+        job_id TEXT,
+        user_id TEXT,
+        FOREIGN KEY (vehicle_id) REFERENCES stolen_vehicles (id)
+    )
+    ''')
+    
+    # Similarity of the plate read to the matched hotlist plate, added to older databases
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(detections)")]
+    if 'match_score' not in columns:
+        cursor.execute("ALTER TABLE detections ADD COLUMN match_score REAL")
+    
+    # Log of changed plates, filled by triggers so that every writer (including other
+    # processes and the sqlite3 shell) is seen by the in-memory hotlist index
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stolen_vehicle_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        license_plate TEXT
+    )
+    ''')
+    _create_trigger(cursor, 'stolen_vehicles_insert', '''AFTER INSERT ON stolen_vehicles
+    BEGIN
+        INSERT INTO stolen_vehicle_changes (license_plate) VALUES (NEW.license_plate);
+    END''')
+    # The new plate is only logged when the plate itself changed
+    _create_trigger(cursor, 'stolen_vehicles_update', '''AFTER UPDATE ON stolen_vehicles
+    BEGIN
+        INSERT INTO stolen_vehicle_changes (license_plate) VALUES (OLD.license_plate);
+        INSERT INTO stolen_vehicle_changes (license_plate)
+        SELECT NEW.license_plate WHERE NEW.license_plate IS NOT OLD.license_plate;
+    END''')
+    _create_trigger(cursor, 'stolen_vehicles_delete', '''AFTER DELETE ON stolen_vehicles
+    BEGIN
+        INSERT INTO stolen_vehicle_changes (license_plate) VALUES (OLD.license_plate);
+    END''')
+    # Keep the log bounded; AUTOINCREMENT never reuses a pruned seq, so readers can tell they missed changes
+    _create_trigger(cursor, 'stolen_vehicle_changes_prune', f'''AFTER INSERT ON stolen_vehicle_changes
+    WHEN NEW.seq % {CHANGE_LOG_PRUNE_INTERVAL} = 0
+    BEGIN
+        DELETE FROM stolen_vehicle_changes WHERE seq <= NEW.seq - {CHANGE_LOG_ROWS};
+    END''')
+    
+    # Detection history indexes, each ending in timestamp so a filtered query is read in
+    # timestamp order without sorting (the rowid id is implicitly the last index column)
+    cursor.execute("CREATE INDEX IF NOT EXISTS detections_timestamp ON detections (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS detections_license_plate ON detections (license_plate, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS detections_video_path ON detections (video_path, timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS detections_job_id ON detections (job_id, timestamp)")
+
+def _create_trigger(cursor, name, definition):
+    """Create a trigger, replacing a trigger of the same name with a different definition."""
+    sql = f"CREATE TRIGGER {name} {definition}"
+    row = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (name,)).fetchone()
+    if row is not None and row[0] == sql:
+        return
+    if row is not None:
+        cursor.execute(f"DROP TRIGGER {name}")
+    cursor.execute(sql)
+
+def ensure_database(add_samples=True):
+    """
+    Initialize the database on first use, once per process.
+    
+    Args:
+        add_samples (bool): Add the sample stolen vehicles if the table is empty
+    """
+    global _database_ready
+    if _database_ready:
+        return
+    with _database_lock:
+        if not _database_ready:
+            initialize_database(add_samples)
+            _database_ready = True
+
+def mark_database_ready():
+    """
+    Skip the initialization of ensure_database in this process.
+    
+    For worker processes whose parent already called ensure_database, so that they do not
+    all race to create the schema and sample data of a new database.
+    """
+    global _database_ready
+    _database_ready = True
 
 def add_sample_vehicles():
     """Add sample stolen vehicles to the database."""
@@ -70,105 +210,343 @@ def add_sample_vehicles():
         ('LM90NOP', 'Audi', 'A4', '2021', 'White', 'Reported stolen in Glasgow', '2023-09-18')
     ]
     
-    conn = None
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        cursor.executemany('''
-        INSERT INTO stolen_vehicles (license_plate, make, model, year, color, description, date_reported)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', sample_vehicles)
-        
-        conn.commit()
+        with transaction(DB_FILE) as conn:
+            conn.executemany('''
+            INSERT INTO stolen_vehicles (license_plate, make, model, year, color, description, date_reported)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', sample_vehicles)
         print(f"Added {len(sample_vehicles)} sample stolen vehicles to database")
     except Exception as e:
         print(f"Error adding sample vehicles: {e}")
-    finally:
-        if conn:
-            conn.close()
 
-def import_vehicles_from_csv(csv_file):
-    """Import stolen vehicles from a CSV file."""
+def _iter_csv_chunks(csv_file, chunk_size):
+    with open(csv_file, 'r', newline='') as file:
+        csv_reader = csv.reader(file)
+        next(csv_reader, None)  # Skip header row
+        
+        chunk = []
+        for row in csv_reader:
+            if len(row) >= 7:
+                # An empty or missing eighth column leaves the status to the import, see _IMPORT_STATUS
+                status = row[7].strip().upper() if len(row) > 7 and row[7].strip() else None
+                if status is not None and status not in IMPORT_STATUSES:
+                    raise ValueError(f"Unknown status {row[7]!r} for plate {row[0]}")
+                chunk.append(tuple(row[:7]) + (status,))
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        if chunk:
+            yield chunk
+
+def import_vehicles_from_csv(csv_file, sync=False, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Import stolen vehicles from a CSV file, streaming it in chunks.
+    
+    Plates already in the database are updated in place, so their id (referenced by
+    detections.vehicle_id) is kept; rows whose columns did not change are not written.
+    An optional eighth column sets the status. Without it, new plates are ACTIVE, a plate
+    left REMOVED by an earlier sync is made ACTIVE again and other plates keep their
+    status, so RECOVERED and INVALID plates are not reactivated. Each chunk is committed
+    in its own transaction, so other writers only wait for one chunk.
+    
+    Args:
+        csv_file (str): CSV file with the columns license_plate, make, model, year, color,
+            description, date_reported and optionally status, after a header row
+        sync (bool): Treat the file as the complete hotlist and mark the ACTIVE plates of
+            the database missing from it as REMOVED
+        chunk_size (int): Rows read and written per transaction
+        
+    Returns:
+        dict: Counts of 'added', 'changed', 'unchanged' and 'removed' plates, None if the
+            import failed (the chunks committed before the failure are kept)
+    """
     if not os.path.exists(csv_file):
         print(f"CSV file not found: {csv_file}")
-        return False
+        return None
     
-    conn = None
+    ensure_database(add_samples=False)
+    conn = get_connection(DB_FILE)
+    cache_size = conn.execute('PRAGMA cache_size').fetchone()[0]
+    start_time = time.perf_counter()
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        conn.execute(f'PRAGMA cache_size = {IMPORT_CACHE_SIZE}')
+        if sync:
+            # Plates of the file, to find the removed ones once it has been read
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS import_plates (license_plate TEXT PRIMARY KEY)')
+            conn.execute('DELETE FROM temp.import_plates')
         
-        with open(csv_file, 'r') as file:
-            csv_reader = csv.reader(file)
-            next(csv_reader)  # Skip header row
-            
-            vehicles = []
-            for row in csv_reader:
-                if len(row) >= 7:
-                    license_plate, make, model, year, color, description, date_reported = row[:7]
-                    vehicles.append((license_plate, make, model, year, color, description, date_reported))
-        
-        cursor.executemany('''
-        INSERT OR REPLACE INTO stolen_vehicles (license_plate, make, model, year, color, description, date_reported)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', vehicles)
-        
-        conn.commit()
-        print(f"Imported {len(vehicles)} vehicles from {csv_file}")
-        return True
+        rows = 0
+        added = 0
+        written = 0
+        for chunk in _iter_csv_chunks(csv_file, chunk_size):
+            with transaction(DB_FILE) as conn:
+                # New plates get ids above the current maximum (AUTOINCREMENT), so counting
+                # them only reads the rows added by this chunk
+                last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM stolen_vehicles').fetchone()[0]
+                # rowcount leaves out the change log rows inserted by the triggers
+                written += conn.executemany(UPSERT_VEHICLE_SQL, chunk).rowcount
+                added += conn.execute('SELECT COUNT(*) FROM stolen_vehicles WHERE id > ?', (last_id,)).fetchone()[0]
+                if sync:
+                    conn.executemany('INSERT OR IGNORE INTO temp.import_plates VALUES (?)',
+                                     ((row[0],) for row in chunk))
+            rows += len(chunk)
+        
+        removed = 0
+        if sync:
+            with transaction(DB_FILE) as conn:
+                removed = conn.execute('''
+                UPDATE stolen_vehicles SET status = 'REMOVED'
+                WHERE status = 'ACTIVE'
+                  AND license_plate NOT IN (SELECT license_plate FROM temp.import_plates)
+                ''').rowcount
+        
+        elapsed = time.perf_counter() - start_time
+        counts = {'added': added, 'changed': written - added, 'unchanged': rows - written, 'removed': removed}
+        print(f"Imported {rows} vehicles from {csv_file} in {elapsed:.1f}s "
+              f"({rows / max(elapsed, 1e-9):.0f} rows/s): {counts['added']} added, {counts['changed']} changed, "
+              f"{counts['unchanged']} unchanged, {counts['removed']} removed")
+        return counts
     except Exception as e:
         print(f"Error importing vehicles from CSV: {e}")
-        return False
+        return None
     finally:
-        if conn:
-            conn.close()
+        if sync:
+            conn.execute('DROP TABLE IF EXISTS temp.import_plates')
+        conn.execute(f'PRAGMA cache_size = {cache_size}')
+
+class HotlistIndex:
+    """
+    In-memory index of the ACTIVE stolen vehicles, keyed by license plate.
+    
+    The index is loaded once and lookups are dictionary reads without any I/O. At most
+    every refresh_interval seconds a lookup checks PRAGMA data_version, which only
+    changes when another connection commits; if it did, the plates logged in
+    stolen_vehicle_changes since the last refresh are re-read. The log only keeps the
+    last CHANGE_LOG_ROWS changes, so an index that fell further behind, a replaced
+    database file or a changed schema (e.g. after reset_database.py) triggers a full
+    reload.
+    
+    Approximate matches of OCR misreads go through a FuzzyPlateIndex, built on the first
+    fuzzy lookup and kept up to date with the same changes.
+    """
+    
+    def __init__(self, db_file=None, refresh_interval=1.0, full_reload_changes=CHANGE_LOG_ROWS):
+        """
+        Args:
+            db_file (str, optional): Database file (default: DB_FILE)
+            refresh_interval (float): Minimum seconds between checks for database changes
+            full_reload_changes (int): Number of logged changes above which the whole
+                hotlist is reloaded instead of the changed plates
+        """
+        self.db_file = db_file or DB_FILE
+        self.refresh_interval = refresh_interval
+        self.full_reload_changes = full_reload_changes
+        self.vehicles = {}
+        self._fuzzy = None
+        
+        self._conn = None
+        self._file_id = None
+        self._data_version = None
+        self._schema_version = None
+        self._last_seq = 0
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.vehicles)
+    
+    def lookup(self, license_plate):
+        """
+        Return the ACTIVE stolen vehicle with this license plate.
+        
+        Returns:
+            dict: Vehicle information if found, None otherwise
+        """
+        if time.monotonic() - self._last_check >= self.refresh_interval:
+            self.refresh()
+        row = self.vehicles.get(license_plate)
+        return dict(zip(VEHICLE_COLUMNS, row)) if row else None
+    
+    def match(self, license_plate, max_distance=1.0):
+        """
+        Return the ACTIVE stolen vehicle closest to a plate read, allowing for OCR errors.
+        
+        Args:
+            license_plate (str): Plate read by OCR
+            max_distance (float): Maximum OCR-confusion-weighted edit distance, see
+                fuzzy_match.FuzzyPlateIndex (0 for exact matches only)
+        
+        Returns:
+            dict: Vehicle information with its 'match_score' (1.0 for an exact match),
+                or None if no plate is close enough
+        """
+        vehicle = self.lookup(license_plate)
+        if vehicle is not None:
+            vehicle['match_score'] = 1.0
+            return vehicle
+        if max_distance <= 0:
+            return None
+        
+        with self._lock:
+            if self._fuzzy is None:
+                self._fuzzy = FuzzyPlateIndex(self.vehicles)
+            matches = self._fuzzy.match(license_plate, max_distance)
+        for plate, distance in matches:
+            vehicle = self.lookup(plate)
+            if vehicle is not None:
+                vehicle['match_score'] = match_score(license_plate, plate, distance)
+                return vehicle
+        return None
+    
+    def refresh(self, force=False):
+        """
+        Bring the index up to date with the database.
+        
+        Args:
+            force (bool): Reload the whole hotlist
+        """
+        with self._lock:
+            self._last_check = time.monotonic()
+            try:
+                ensure_database()
+                stat = os.stat(self.db_file)
+                file_id = (stat.st_dev, stat.st_ino)
+                if self._conn is None or file_id != self._file_id:
+                    self._connect(file_id)
+                    force = True
+                
+                data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+                if data_version == self._data_version and not force:
+                    return
+                self._data_version = data_version
+                
+                schema_version = self._conn.execute('PRAGMA schema_version').fetchone()[0]
+                if force or schema_version != self._schema_version:
+                    self._schema_version = schema_version
+                    self._load_all()
+                else:
+                    self._load_changes()
+            except Exception as e:
+                print(f"Error refreshing stolen vehicle hotlist: {e}")
+    
+    def _connect(self, file_id):
+        if self._conn is not None:
+            self._conn.close()
+        if self._file_id is not None:
+            # The database file was replaced, make sure it has the change log and its triggers
+            initialize_database(add_samples=False)
+        # A dedicated connection: PRAGMA data_version only reports commits of other connections.
+        # It is in autocommit mode, so each refresh reads a consistent snapshot in its own transaction
+        self._conn = open_connection(self.db_file, check_same_thread=False)
+        self._file_id = file_id
+    
+    def _load_all(self):
+        conn = self._conn
+        conn.execute('BEGIN')
+        try:
+            last_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM stolen_vehicle_changes').fetchone()[0]
+            cursor = conn.execute(f'''
+            SELECT {', '.join(VEHICLE_COLUMNS)}
+            FROM stolen_vehicles
+            WHERE status = 'ACTIVE'
+            ''')
+            self.vehicles = {row[1]: row for row in cursor}
+            # Rebuilt on the next fuzzy lookup
+            self._fuzzy = None
+            self._last_seq = last_seq
+        finally:
+            conn.execute('COMMIT')
+    
+    def _load_changes(self):
+        conn = self._conn
+        conn.execute('BEGIN')
+        try:
+            # Separate queries, so each is a single lookup at one end of the primary key
+            first_seq = conn.execute('SELECT COALESCE(MIN(seq), 0) FROM stolen_vehicle_changes').fetchone()[0]
+            last_seq = conn.execute('SELECT COALESCE(MAX(seq), 0) FROM stolen_vehicle_changes').fetchone()[0]
+            if last_seq == self._last_seq:
+                return
+            # Changes after _last_seq were pruned from the log, or too many to re-read one by one
+            if (last_seq < self._last_seq or first_seq > self._last_seq + 1
+                    or last_seq - self._last_seq > self.full_reload_changes):
+                conn.execute('COMMIT')
+                self._load_all()
+                return
+            
+            plates = [row[0] for row in conn.execute('''
+            SELECT DISTINCT license_plate FROM stolen_vehicle_changes WHERE seq > ? AND seq <= ?
+            ''', (self._last_seq, last_seq))]
+            
+            rows = []
+            # Stay below SQLite's limit on query parameters
+            for start in range(0, len(plates), 500):
+                chunk = plates[start:start + 500]
+                rows.extend(conn.execute(f'''
+                SELECT {', '.join(VEHICLE_COLUMNS)}
+                FROM stolen_vehicles
+                WHERE license_plate IN ({', '.join('?' * len(chunk))}) AND status = 'ACTIVE'
+                ''', chunk))
+            
+            # Each plate is replaced or removed in one step, so concurrent lookups never miss an unchanged record
+            active = {row[1]: row for row in rows}
+            for license_plate in plates:
+                if license_plate in active:
+                    self.vehicles[license_plate] = active[license_plate]
+                    if self._fuzzy is not None:
+                        self._fuzzy.add(license_plate)
+                else:
+                    self.vehicles.pop(license_plate, None)
+                    if self._fuzzy is not None:
+                        self._fuzzy.remove(license_plate)
+            self._last_seq = last_seq
+        finally:
+            if conn.in_transaction:
+                conn.execute('COMMIT')
+
+def get_hotlist():
+    """
+    Return the hotlist index shared by check_license_plate_in_database calls, loading it on first use.
+    
+    Returns:
+        HotlistIndex: Shared hotlist index
+    """
+    global _hotlist
+    if _hotlist is None:
+        with _hotlist_lock:
+            if _hotlist is None:
+                hotlist = HotlistIndex()
+                hotlist.refresh(force=True)
+                _hotlist = hotlist
+    return _hotlist
 
-def check_license_plate_in_database(license_plate):
+def check_license_plate_in_database(license_plate, max_distance=0.0):
     """
     Check if a license plate exists in the stolen vehicles database.
     
+    Lookups go through the in-memory hotlist index (see HotlistIndex), which picks up
+    database changes within a second.
+    
     Args:
         license_plate (str): The license plate to check
+        max_distance (float): Also match stolen plates within this OCR-confusion-weighted
+            edit distance of the read (default: 0, exact matches only)
         
     Returns:
-        dict: Vehicle information if found, None otherwise
+        dict: Vehicle information if found, with the 'match_score' of the read, None otherwise
     """
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT id, license_plate, make, model, year, color, description, date_reported, status
-        FROM stolen_vehicles
-        WHERE license_plate = ? AND status = 'ACTIVE'
-        ''', (license_plate,))
-        
-        row = cursor.fetchone()
-        if row:
-            vehicle = {
-                'id': row[0],
-                'license_plate': row[1],
-                'make': row[2],
-                'model': row[3],
-                'year': row[4],
-                'color': row[5],
-                'description': row[6],
-                'date_reported': row[7],
-                'status': row[8]
-            }
-            return vehicle
-        return None
-    except Exception as e:
-        print(f"Error checking license plate: {e}")
-        return None
-    finally:
-        if conn:
-            conn.close()
+    return get_hotlist().match(license_plate, max_distance)
+
+def _timestamp_str(timestamp):
+    return timestamp.strftime('%Y-%m-%d %H:%M:%S') if isinstance(timestamp, datetime) else timestamp
+
+def _detection_event_row(license_plate, vehicle_id, frame_number, timestamp, confidence, video_path,
+                         image_path=None, job_id=None, user_id=None, match_score=None):
+    return (license_plate, vehicle_id, frame_number, _timestamp_str(timestamp), confidence,
+            video_path, image_path, job_id, user_id, match_score)
 
 def record_detection_event(license_plate, vehicle_id, frame_number, timestamp, confidence, 
-                         video_path, image_path=None, job_id=None, user_id=None):
+                         video_path, image_path=None, job_id=None, user_id=None, match_score=None):
     """
     Record a stolen vehicle detection event in the database.
     
@@ -182,55 +560,160 @@ def record_detection_event(license_plate, vehicle_id, frame_number, timestamp, c
         image_path (str, optional): Path to the saved frame image
         job_id (str, optional): Job identifier
         user_id (str, optional): User identifier
+        match_score (float, optional): Similarity of the plate read to the stolen plate (1.0 if exact)
         
     Returns:
         int: ID of the recorded detection
     """
-    conn = None
+    ensure_database()
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        timestamp_str = timestamp.strftime('%Y-%m-%d %H:%M:%S') if isinstance(timestamp, datetime) else timestamp
-        
-        cursor.execute('''
-        INSERT INTO detections 
-        (license_plate, vehicle_id, frame_number, timestamp, confidence, video_path, image_path, job_id, user_id)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (license_plate, vehicle_id, frame_number, timestamp_str, confidence, 
-              video_path, image_path, job_id, user_id))
-        
-        conn.commit()
+        row = _detection_event_row(license_plate, vehicle_id, frame_number, timestamp, confidence,
+                                   video_path, image_path, job_id, user_id, match_score)
+        with transaction(DB_FILE) as conn:
+            cursor = conn.execute(INSERT_DETECTION_SQL, row)
         return cursor.lastrowid
     except Exception as e:
         print(f"Error recording detection: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
+
+def write_detection_events(rows):
+    """
+    Insert many stolen vehicle detection events in one transaction, raising database errors.
+    
+    Args:
+        rows (iterable): Events as dicts with the arguments of record_detection_event
+            (see DETECTION_EVENT_COLUMNS; the optional ones may be left out)
+        
+    Returns:
+        int: Number of inserted detections
+    
+    Raises:
+        sqlite3.Error: If the transaction failed; nothing is inserted then
+    """
+    ensure_database()
+    values = [_detection_event_row(**row) for row in rows]
+    if values:
+        with transaction(DB_FILE) as conn:
+            conn.executemany(INSERT_DETECTION_SQL, values)
+    return len(values)
+
+def record_detection_events(rows):
+    """
+    Record many stolen vehicle detection events in one transaction.
+    
+    Args:
+        rows (iterable): Events as dicts with the arguments of record_detection_event
+            (see DETECTION_EVENT_COLUMNS; the optional ones may be left out)
+        
+    Returns:
+        int: Number of recorded detections, None if the transaction failed (nothing is recorded then)
+    """
+    try:
+        return write_detection_events(rows)
+    except Exception as e:
+        print(f"Error recording detections: {e}")
+        return None
+
+def query_detections(license_plate=None, start=None, end=None, job_id=None, video_path=None,
+                     page_size=100, after=None):
+    """
+    Return one page of detection events, newest first.
+    
+    Pages are keyset-paginated: the next page starts after the (timestamp, id) of the last
+    row of the previous one, so every page is an index range scan however deep it is.
+    
+    Args:
+        license_plate (str, optional): Only detections of this plate read
+        start (datetime or str, optional): Only detections at or after this time
+        end (datetime or str, optional): Only detections before this time
+        job_id (str, optional): Only detections of this job
+        video_path (str, optional): Only detections in this video
+        page_size (int): Maximum number of rows returned
+        after (tuple, optional): Cursor returned with the previous page
+        
+    Returns:
+        tuple: (rows, cursor) with the rows as dicts of DETECTION_QUERY_COLUMNS and the
+            cursor of the next page, None after the last page
+    """
+    ensure_database(add_samples=False)
+    conditions = []
+    params = []
+    for column, value in (('license_plate', license_plate), ('job_id', job_id), ('video_path', video_path)):
+        if value is not None:
+            conditions.append(f"d.{column} = ?")
+            params.append(value)
+    if start is not None:
+        conditions.append("d.timestamp >= ?")
+        params.append(_timestamp_str(start))
+    if end is not None:
+        conditions.append("d.timestamp < ?")
+        params.append(_timestamp_str(end))
+    if after is not None:
+        conditions.append("(d.timestamp, d.id) < (?, ?)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    # Detections of vehicles removed from the hotlist are kept
+    cursor = get_connection(DB_FILE).execute(f'''
+    SELECT d.id, d.license_plate, v.make, v.model, d.frame_number, d.timestamp, d.confidence,
+           d.match_score, d.video_path, d.image_path, d.job_id, d.user_id
+    FROM detections d
+    LEFT JOIN stolen_vehicles v ON d.vehicle_id = v.id
+    {where}
+    ORDER BY d.timestamp DESC, d.id DESC
+    LIMIT ?
+    ''', params + [page_size])
+    rows = [dict(zip(DETECTION_QUERY_COLUMNS, row)) for row in cursor]
+    
+    next_cursor = None
+    if len(rows) == page_size:
+        next_cursor = (rows[-1]['timestamp'], rows[-1]['id'])
+    return rows, next_cursor
+
+def iter_detection_pages(page_size=100, **filters):
+    """
+    Iterate over the pages of detection events matching the filters of query_detections, newest first.
+    
+    Args:
+        page_size (int): Maximum number of rows per page
+        **filters: license_plate, start, end, job_id and video_path, see query_detections
+        
+    Yields:
+        list: Rows of one page as dicts of DETECTION_QUERY_COLUMNS
+    """
+    after = None
+    while True:
+        rows, after = query_detections(page_size=page_size, after=after, **filters)
+        if rows:
+            yield rows
+        if after is None:
+            return
 
 # Fallback functions for direct access when not in Flask context
-def fallback_check_license_plate(license_plate):
+def fallback_check_license_plate(license_plate, max_distance=0.0):
     """Fallback function to check license plate directly."""
-    return check_license_plate_in_database(license_plate)
+    return check_license_plate_in_database(license_plate, max_distance)
 
 def fallback_record_detection(license_plate, vehicle_id, frame_number, timestamp, confidence, 
-                            video_path, image_path=None, job_id=None, user_id=None):
+                            video_path, image_path=None, job_id=None, user_id=None, match_score=None):
     """Fallback function to record detection directly."""
     return record_detection_event(license_plate, vehicle_id, frame_number, timestamp, 
-                                confidence, video_path, image_path, job_id, user_id)
-
-# Initialize the database when the module is imported
-initialize_database()
+                                confidence, video_path, image_path, job_id, user_id, match_score)
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description='Initialize the stolen vehicles database and import vehicles from a CSV file')
+    parser.add_argument('csv_file', nargs='?', help='CSV file of stolen vehicles to import')
+    parser.add_argument('--sync', action='store_true',
+                        help='Treat the CSV file as the complete hotlist and mark plates missing from it as REMOVED')
+    parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE,
+                        help=f'Rows written per transaction (default: {IMPORT_CHUNK_SIZE})')
+    args = parser.parse_args()
+    
     # This allows the script to be run directly to initialize the database
     print("Initializing stolen vehicles database...")
-    initialize_database()
-    
-    # Example command to import from CSV if provided as argument
-    import sys
-    if len(sys.argv) > 1:
-        csv_file = sys.argv[1]
-        print(f"Importing vehicles from {csv_file}...")
-        import_vehicles_from_csv(csv_file) 
\ No newline at end of file
+    initialize_database(add_samples=args.csv_file is None)
+    
+    if args.csv_file:
+        print(f"Importing vehicles from {args.csv_file}...")
+        import_vehicles_from_csv(args.csv_file, sync=args.sync, chunk_size=args.chunk_size)
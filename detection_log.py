@@ -0,0 +1,291 @@
+import csv
+import itertools
+import json
+import os
+
+import numpy as np
+
+# Columns of a detection log, in output order
+DETECTION_COLUMNS = ['frame_nmr', 'car_id', 'car_bbox', 'license_plate_bbox', 'license_plate_bbox_score',
+                     'license_number', 'license_number_score']
+
+# Bounding box columns, stored as (N, 4) float arrays
+BBOX_COLUMNS = ['car_bbox', 'license_plate_bbox']
+
+# Detection log formats by file extension (anything else is CSV)
+LOG_FORMATS = {
+    '.npz': 'npz',
+    '.parquet': 'parquet',
+    '.jsonl': 'jsonl',
+    '.csv': 'csv'
+}
+
+
+def log_format(path):
+    """Return the detection log format of a path from its extension (CSV if unknown)."""
+    return LOG_FORMATS.get(os.path.splitext(path)[1].lower(), 'csv')
+
+
+def make_columns(frame_nmr, car_id, car_bbox, license_plate_bbox, license_plate_bbox_score, license_number,
+                 license_number_score):
+    """
+    Build a detection log from its column values.
+
+    Returns:
+        dict: Column name -> numpy array. frame_nmr is int64, bounding boxes are (N, 4)
+            float64 arrays, license_number is a unicode array and the rest are float64.
+    """
+    license_number = np.asarray(license_number, dtype=str)
+    return {
+        'frame_nmr': np.asarray(frame_nmr, dtype=np.int64).reshape(-1),
+        'car_id': np.asarray(car_id, dtype=np.float64).reshape(-1),
+        'car_bbox': np.asarray(car_bbox, dtype=np.float64).reshape(-1, 4),
+        'license_plate_bbox': np.asarray(license_plate_bbox, dtype=np.float64).reshape(-1, 4),
+        'license_plate_bbox_score': np.asarray(license_plate_bbox_score, dtype=np.float64).reshape(-1),
+        'license_number': license_number.reshape(-1) if license_number.size else np.array([], dtype='<U1'),
+        'license_number_score': np.asarray(license_number_score, dtype=np.float64).reshape(-1)
+    }
+
+
+def empty_columns():
+    return make_columns([], [], [], [], [], [], [])
+
+
+def concat_columns(chunks):
+    """Concatenate detection logs column by column."""
+    if not chunks:
+        return empty_columns()
+    return {column: np.concatenate([chunk[column] for chunk in chunks]) for column in DETECTION_COLUMNS}
+
+
+def num_rows(detections):
+    return len(detections['frame_nmr'])
+
+
+def _parse_bbox(text):
+    # Boxes are written as '[x1 y1 x2 y2]'; older interpolated files have no brackets
+    return text.strip().strip('[]').split()
+
+
+def _parse_score(text):
+    # Scores are written as numbers, or as 0 for rows imputed by add_missing_data.py
+    try:
+        return float(text)
+    except ValueError:
+        return 0.0
+
+
+def _csv_columns(rows):
+    return make_columns(
+        [int(float(row['frame_nmr'])) for row in rows],
+        [float(row['car_id']) for row in rows],
+        np.array([_parse_bbox(row['car_bbox']) for row in rows], dtype=np.float64),
+        np.array([_parse_bbox(row['license_plate_bbox']) for row in rows], dtype=np.float64),
+        [_parse_score(row.get('license_plate_bbox_score', '0')) for row in rows],
+        [row.get('license_number', '0') for row in rows],
+        [_parse_score(row.get('license_number_score', '0')) for row in rows])
+
+
+def _load_csv(path):
+    with open(path, 'r', newline='') as file:
+        return _csv_columns(list(csv.DictReader(file)))
+
+
+def _jsonl_columns(rows):
+    return make_columns(*([row[column] for row in rows] for column in DETECTION_COLUMNS))
+
+
+def _load_jsonl(path):
+    with open(path, 'r') as file:
+        return _jsonl_columns([json.loads(line) for line in file if line.strip()])
+
+
+def _load_npz(path):
+    with np.load(path, allow_pickle=False) as data:
+        return {column: data[column] for column in DETECTION_COLUMNS}
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Parquet detection logs need pyarrow (pip install pyarrow)")
+    return pyarrow
+
+
+def _parquet_columns(table):
+    detections = {}
+    for column in DETECTION_COLUMNS:
+        values = table.column(column).combine_chunks()
+        if column in BBOX_COLUMNS:
+            detections[column] = values.flatten().to_numpy().reshape(-1, 4)
+        else:
+            detections[column] = values.to_numpy(zero_copy_only=False)
+    detections['license_number'] = detections['license_number'].astype(str)
+    return detections
+
+
+def _load_parquet(path):
+    pyarrow = _import_pyarrow()
+    return _parquet_columns(pyarrow.parquet.read_table(path))
+
+
+def _save_parquet(detections, path):
+    pyarrow = _import_pyarrow()
+    arrays = {}
+    for column in DETECTION_COLUMNS:
+        if column in BBOX_COLUMNS:
+            arrays[column] = pyarrow.FixedSizeListArray.from_arrays(pyarrow.array(detections[column].ravel()), 4)
+        else:
+            arrays[column] = pyarrow.array(detections[column])
+    pyarrow.parquet.write_table(pyarrow.table(arrays), path)
+
+
+def format_csv_row(frame_nmr, car_id, car_bbox, license_plate_bbox, license_plate_bbox_score, license_number,
+                   license_number_score):
+    """Format one detection as a CSV line in the format written by main.py."""
+    return '{},{},{},{},{},{},{}\n'.format(frame_nmr,
+                                           car_id,
+                                           '[{} {} {} {}]'.format(*car_bbox[:4]),
+                                           '[{} {} {} {}]'.format(*license_plate_bbox[:4]),
+                                           license_plate_bbox_score,
+                                           license_number,
+                                           license_number_score)
+
+
+def _format_interpolated_score(value):
+    # Imputed rows have always been written with scores of 0, not 0.0
+    return '0' if value == 0 else value
+
+
+def format_interpolated_csv_row(frame_nmr, car_id, car_bbox, license_plate_bbox, license_plate_bbox_score,
+                                license_number, license_number_score):
+    """
+    Format one detection as a CSV line in the format written by add_missing_data.py.
+
+    Lines end in CRLF like the csv module's, so the file must be opened with newline=''.
+    """
+    return '{},{},{},{},{},{},{}\r\n'.format(int(frame_nmr),
+                                             int(car_id),
+                                             ' '.join(map(str, car_bbox[:4])),
+                                             ' '.join(map(str, license_plate_bbox[:4])),
+                                             _format_interpolated_score(license_plate_bbox_score),
+                                             license_number,
+                                             _format_interpolated_score(license_number_score))
+
+
+def format_jsonl_row(frame_nmr, car_id, car_bbox, license_plate_bbox, license_plate_bbox_score, license_number,
+                     license_number_score):
+    """Format one detection as a JSON line with numeric bounding boxes."""
+    return json.dumps({
+        'frame_nmr': int(frame_nmr),
+        'car_id': float(car_id),
+        'car_bbox': [float(value) for value in car_bbox[:4]],
+        'license_plate_bbox': [float(value) for value in license_plate_bbox[:4]],
+        'license_plate_bbox_score': float(license_plate_bbox_score),
+        'license_number': str(license_number),
+        'license_number_score': float(license_number_score)
+    }) + '\n'
+
+
+def detection_rows(detections):
+    # Python values, so that numbers are formatted the same way as in main.py's output
+    return zip(*(detections[column].tolist() for column in DETECTION_COLUMNS))
+
+
+def load_detections(path):
+    """
+    Load a detection log written by main.py or add_missing_data.py.
+
+    NPZ and Parquet logs are read column by column without any text parsing; CSV and
+    JSONL logs are parsed row by row.
+
+    Args:
+        path (str): Path to a .npz, .parquet, .jsonl or .csv detection log.
+
+    Returns:
+        dict: Column name -> numpy array, see make_columns.
+    """
+    loaders = {'npz': _load_npz, 'parquet': _load_parquet, 'jsonl': _load_jsonl, 'csv': _load_csv}
+    return loaders[log_format(path)](path)
+
+
+def iter_detection_chunks(path, chunk_rows=100000):
+    """
+    Read a detection log in chunks of rows, in file order.
+
+    CSV, JSONL and Parquet logs are read incrementally, so memory use depends on the chunk
+    size and not on the size of the log. NPZ logs are loaded whole and then sliced.
+
+    Args:
+        path (str): Path to a .npz, .parquet, .jsonl or .csv detection log.
+        chunk_rows (int): Maximum number of rows per chunk.
+
+    Yields:
+        dict: Column name -> numpy array for each chunk, see make_columns.
+    """
+    file_format = log_format(path)
+    if file_format == 'npz':
+        detections = _load_npz(path)
+        for start in range(0, num_rows(detections), chunk_rows):
+            yield {column: values[start:start + chunk_rows] for column, values in detections.items()}
+    elif file_format == 'parquet':
+        pyarrow = _import_pyarrow()
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=DETECTION_COLUMNS):
+            yield _parquet_columns(pyarrow.Table.from_batches([batch]))
+    elif file_format == 'jsonl':
+        with open(path, 'r') as file:
+            rows = (json.loads(line) for line in file if line.strip())
+            while True:
+                chunk = list(itertools.islice(rows, chunk_rows))
+                if not chunk:
+                    break
+                yield _jsonl_columns(chunk)
+    else:
+        with open(path, 'r', newline='') as file:
+            rows = csv.DictReader(file)
+            while True:
+                chunk = list(itertools.islice(rows, chunk_rows))
+                if not chunk:
+                    break
+                yield _csv_columns(chunk)
+
+
+def save_detections(detections, path, output_format=None):
+    """
+    Write a detection log, in the format given by the file extension.
+
+    NPZ is the compact columnar format (uncompressed, so it loads with one read per
+    column); CSV and JSONL are row formats kept for export and compatibility.
+
+    Args:
+        detections (dict): Column name -> numpy array, see make_columns.
+        path (str): Path to a .npz, .parquet, .jsonl or .csv file.
+        output_format (str, optional): 'npz', 'parquet', 'jsonl', 'csv' or 'interpolated_csv' (default:
+            from the extension). 'interpolated_csv' is the CSV text written by add_missing_data.py:
+            integer car ids, boxes without brackets and imputed scores written as 0.
+    """
+    output_dir = os.path.dirname(path)
+    if output_dir and not os.path.exists(output_dir):
+        os.makedirs(output_dir, exist_ok=True)
+
+    if output_format is None:
+        output_format = log_format(path)
+    if output_format == 'npz':
+        # Write through a file object so numpy does not append .npz to other extensions
+        with open(path, 'wb') as file:
+            np.savez(file, **{column: detections[column] for column in DETECTION_COLUMNS})
+    elif output_format == 'parquet':
+        _save_parquet(detections, path)
+    elif output_format == 'jsonl':
+        with open(path, 'w') as file:
+            file.writelines(format_jsonl_row(*row) for row in detection_rows(detections))
+    elif output_format == 'interpolated_csv':
+        with open(path, 'w', newline='') as file:
+            file.write(','.join(DETECTION_COLUMNS) + '\r\n')
+            file.writelines(format_interpolated_csv_row(*row) for row in detection_rows(detections))
+    else:
+        with open(path, 'w') as file:
+            file.write(','.join(DETECTION_COLUMNS) + '\n')
+            file.writelines(format_csv_row(*row) for row in detection_rows(detections))
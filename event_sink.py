@@ -0,0 +1,115 @@
+import queue
+import threading
+import time
+
+from database_pool import is_lock_error
+
+# Marker put on the queue by close()
+_END = object()
+
+
+class DetectionEventSink:
+    """
+    Record detection events in the database from a background thread.
+
+    submit() only puts the event on a queue, so the video processing loop never waits
+    on SQLite. The writer thread group-commits the queued events, one transaction per
+    batch_size events or per flush_interval seconds after the first event of a batch,
+    whichever comes first. A batch failing on a lock conflict is retried with backoff;
+    other errors, or a batch still failing after max_retries retries, are printed and
+    the batch is dropped. close() drains the queue before returning.
+    """
+
+    def __init__(self, write_events=None, batch_size=100, flush_interval=0.2, max_retries=5, retry_delay=0.05):
+        """
+        Args:
+            write_events (callable, optional): Inserts a list of event dicts in one transaction
+                and raises on failure (default: database_utils.write_detection_events).
+            batch_size (int): Maximum number of events per transaction.
+            flush_interval (float): Seconds an event waits for more events before its batch is committed.
+            max_retries (int): Retries of a batch failing on a lock conflict.
+            retry_delay (float): Seconds before the first retry, doubled for each further retry.
+        """
+        if write_events is None:
+            from database_utils import write_detection_events
+            write_events = write_detection_events
+        self.write_events = write_events
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self.events_written = 0
+        self.events_failed = 0
+        self.batches = 0
+        self.retries = 0
+
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='detection-events', daemon=True)
+        self._thread.start()
+
+    def submit(self, event):
+        """
+        Queue one detection event.
+
+        Args:
+            event (dict): Arguments of database_utils.record_detection_event.
+        """
+        if self._closed:
+            raise ValueError("Detection event sink is closed")
+        self._queue.put(event)
+
+    def close(self):
+        """Commit the queued events and stop the writer thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_END)
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self):
+        done = False
+        while not done:
+            event = self._queue.get()
+            if event is _END:
+                break
+            batch = [event]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    event = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if event is _END:
+                    done = True
+                    break
+                batch.append(event)
+            self._write(batch)
+
+    def _write(self, batch):
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.write_events(batch)
+                self.events_written += len(batch)
+                self.batches += 1
+                return
+            except Exception as e:
+                if is_lock_error(e) and attempt < self.max_retries:
+                    self.retries += 1
+                    time.sleep(delay)
+                    delay *= 2
+                    continue
+                print(f"Error recording {len(batch)} detections: {e}")
+                self.events_failed += len(batch)
+                return
@@ -0,0 +1,191 @@
+import os
+import re
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cv2
+
+# What an evidence image shows: the annotated full frame, the vehicle with some context
+# around it, or the plate only
+EVIDENCE_MODES = ['frame', 'vehicle', 'plate']
+
+# Characters kept from a plate read in an evidence file name
+_UNSAFE_CHARS = re.compile(r'[^A-Za-z0-9_-]')
+
+
+def new_run_id(job_id=None):
+    """
+    Return an identifier for the evidence images of one processing run.
+
+    It is made of the job id (if any), the start time and a random part, so re-running
+    a video or processing two videos with the same file name never reuses an image name.
+    """
+    run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+    return f"job{_UNSAFE_CHARS.sub('_', str(job_id))}_{run_id}" if job_id is not None else run_id
+
+
+def evidence_path(output_dir, video_path, license_plate, frame_nmr, mode='frame', run_id=None):
+    """
+    Return the path of the evidence image of a detection.
+
+    The path only depends on its arguments, so the detection event can record it
+    before the image is written.
+
+    Args:
+        output_dir (str): Directory of the evidence images.
+        video_path (str): Source video (None for frames not read from a file).
+        license_plate (str): Plate read of the detection.
+        frame_nmr (int): Frame number of the detection.
+        mode (str): Evidence mode, one of EVIDENCE_MODES.
+        run_id (str, optional): Processing run, see new_run_id.
+
+    Returns:
+        str: Path of the JPEG image.
+    """
+    video_name = os.path.splitext(os.path.basename(video_path))[0] if video_path else 'stream'
+    plate = _UNSAFE_CHARS.sub('_', license_plate)
+    run = f'_{run_id}' if run_id else ''
+    suffix = '' if mode == 'frame' else f'_{mode}'
+    return os.path.join(output_dir,
+                        f"stolen_{plate}_{_UNSAFE_CHARS.sub('_', video_name)}_frame_{frame_nmr}{run}{suffix}.jpg")
+
+
+def _clip_box(bbox, width, height, margin=0.0):
+    x1, y1, x2, y2 = bbox
+    dx, dy = (x2 - x1) * margin, (y2 - y1) * margin
+    return (max(0, int(x1 - dx)), max(0, int(y1 - dy)),
+            min(width, int(x2 + dx)), min(height, int(y2 + dy)))
+
+
+class EvidenceWriter:
+    """
+    Save the evidence images of stolen vehicle detections on a pool of worker threads.
+
+    submit() returns the image path at once. In 'frame' mode the worker copies and
+    annotates the frame; in the crop modes only the crop is copied in the calling
+    thread, so the full frame is never duplicated. Annotation, downscaling and JPEG
+    encoding run on the workers. At most max_pending images wait to be written; further
+    submits block, which bounds the memory held by queued frames. close() waits for the
+    queued images.
+    """
+
+    def __init__(self, output_dir, mode='frame', jpeg_quality=95, max_size=None, context=0.25, workers=2,
+                 max_pending=16, run_id=None):
+        """
+        Args:
+            output_dir (str): Directory of the evidence images, created if missing.
+            mode (str): 'frame' for the annotated full frame, 'vehicle' for the vehicle box
+                widened by context, 'plate' for the plate box only.
+            jpeg_quality (int): JPEG quality from 0 to 100.
+            max_size (int, optional): Downscale images whose longest side is larger than this many pixels.
+            context (float): Margin added around the vehicle box on each side in 'vehicle' mode,
+                as a fraction of the box size.
+            workers (int): Number of writer threads.
+            max_pending (int): Maximum number of images waiting to be written.
+            run_id (str, optional): Processing run included in the image names (default: a new
+                one, see new_run_id).
+        """
+        if mode not in EVIDENCE_MODES:
+            raise ValueError(f"Unknown evidence mode: {mode} (expected one of {', '.join(EVIDENCE_MODES)})")
+        self.output_dir = output_dir
+        self.mode = mode
+        self.jpeg_quality = jpeg_quality
+        self.max_size = max_size
+        self.context = context
+        self.run_id = run_id or new_run_id()
+
+        self.images_written = 0
+        self.images_failed = 0
+
+        os.makedirs(output_dir, exist_ok=True)
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._counter_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='evidence')
+        self._closed = False
+
+    def submit(self, frame, car_bbox, plate_bbox, license_plate, frame_nmr, video_path=None):
+        """
+        Queue the evidence image of one detection.
+
+        Args:
+            frame (numpy.ndarray): BGR video frame; it is not modified.
+            car_bbox (list): Vehicle box [x1, y1, x2, y2].
+            plate_bbox (list): Plate box [x1, y1, x2, y2].
+            license_plate (str): Plate read, drawn on the image and used in its name.
+            frame_nmr (int): Frame number.
+            video_path (str, optional): Source video, used in the image name.
+
+        Returns:
+            str: Path the image is written to, see evidence_path.
+        """
+        if self._closed:
+            raise ValueError("Evidence writer is closed")
+        path = evidence_path(self.output_dir, video_path, license_plate, frame_nmr, self.mode, self.run_id)
+
+        height, width = frame.shape[:2]
+        if self.mode == 'frame':
+            # The worker draws on its own copy
+            image, origin = frame, (0, 0)
+        else:
+            x1, y1, x2, y2 = _clip_box(car_bbox if self.mode == 'vehicle' else plate_bbox, width, height,
+                                       self.context if self.mode == 'vehicle' else 0.0)
+            image, origin = frame[y1:y2, x1:x2].copy(), (x1, y1)
+
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(self._write, path, image, origin, car_bbox, plate_bbox, license_plate)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        return path
+
+    def close(self):
+        """Write the queued images and stop the worker threads."""
+        if self._closed:
+            return
+        self._closed = True
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write(self, path, image, origin, car_bbox, plate_bbox, license_plate):
+        try:
+            if self.mode == 'frame':
+                image = image.copy()
+            if self.mode != 'plate':
+                self._annotate(image, origin, car_bbox, plate_bbox, license_plate)
+
+            height, width = image.shape[:2]
+            if self.max_size and max(height, width) > self.max_size:
+                scale = self.max_size / max(height, width)
+                image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                                   interpolation=cv2.INTER_AREA)
+
+            if not cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, int(self.jpeg_quality)]):
+                raise IOError("cv2.imwrite failed")
+            with self._counter_lock:
+                self.images_written += 1
+        except Exception as e:
+            print(f"Error saving evidence image {path}: {e}")
+            with self._counter_lock:
+                self.images_failed += 1
+
+    @staticmethod
+    def _annotate(image, origin, car_bbox, plate_bbox, license_plate):
+        ox, oy = origin
+        xcar1, ycar1, xcar2, ycar2 = car_bbox
+        x1, y1, x2, y2 = plate_bbox
+        # Draw car bbox in red
+        cv2.rectangle(image, (int(xcar1) - ox, int(ycar1) - oy), (int(xcar2) - ox, int(ycar2) - oy), (0, 0, 255), 3)
+        # Draw license plate bbox in yellow
+        cv2.rectangle(image, (int(x1) - ox, int(y1) - oy), (int(x2) - ox, int(y2) - oy), (0, 255, 255), 2)
+        # Add text
+        cv2.putText(image, f"STOLEN: {license_plate}", (int(xcar1) - ox, max(20, int(ycar1) - oy - 10)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
@@ -0,0 +1,175 @@
+from plate_formats import dict_char_to_int
+
+# Character pairs OCR confuses on license plates: the pairs corrected by plate formatting
+# plus common look-alikes (including the M/N misread of the sample video)
+CONFUSION_PAIRS = sorted(dict_char_to_int.items()) + [
+    ('B', '8'), ('D', '0'), ('Q', '0'), ('Z', '2'), ('T', '7'), ('L', '1'),
+    ('M', 'N'), ('U', 'V'), ('C', 'G'), ('E', 'F'), ('K', 'X'), ('P', 'R')
+]
+
+# Cost of substituting a character by one it is confused with (other edits cost 1)
+CONFUSION_COST = 0.5
+
+# Edits other than confusions found by FuzzyPlateIndex: it indexes single-character deletions
+MAX_INDEXED_EDITS = 1
+
+
+def check_match_distance(max_distance):
+    """
+    Raise ValueError for a match distance FuzzyPlateIndex cannot serve completely.
+
+    A distance of MAX_INDEXED_EDITS + 1 or more allows plates that need that many edits
+    besides confusions, which the deletion neighbourhood does not find.
+    """
+    if max_distance >= MAX_INDEXED_EDITS + 1:
+        raise ValueError(f"Match distance {max_distance} is not supported: fuzzy plate matching finds any number "
+                         f"of OCR confusions plus at most {MAX_INDEXED_EDITS} other edit, so the distance must be "
+                         f"below {MAX_INDEXED_EDITS + 1}")
+
+
+def _confusion_classes(pairs):
+    # Union-find over the confused pairs; every class is named by its smallest character
+    parent = {}
+
+    def find(char):
+        parent.setdefault(char, char)
+        while parent[char] != char:
+            char = parent[char]
+        return char
+
+    for a, b in pairs:
+        root_a, root_b = find(a), find(b)
+        if root_a != root_b:
+            parent[max(root_a, root_b)] = min(root_a, root_b)
+    return {char: find(char) for char in parent}
+
+
+class FuzzyPlateIndex:
+    """
+    Index of license plates for approximate matching of OCR reads.
+
+    Characters OCR confuses with each other are mapped to one canonical character, so
+    plates that only differ by confusions share the same canonical form. The index maps
+    every canonical form and each of its single-character deletions to the plates that
+    produce it (a deletion neighbourhood), so a lookup only hashes a handful of keys and
+    finds every plate within any number of confusions plus one other edit. Candidates
+    are then ranked with a confusion-weighted edit distance.
+
+    Memory is about len(plate) + 1 keys per plate.
+    """
+
+    def __init__(self, plates=(), confusion_pairs=CONFUSION_PAIRS, confusion_cost=CONFUSION_COST):
+        """
+        Args:
+            plates (iterable): Initial plates.
+            confusion_pairs (list): Pairs of characters OCR confuses with each other.
+            confusion_cost (float): Substitution cost between confused characters.
+        """
+        self.confusion_cost = confusion_cost
+        self._classes = _confusion_classes(confusion_pairs)
+        self._canonical_table = str.maketrans(self._classes)
+        self._keys = {}
+        self._size = 0
+        for plate in plates:
+            self.add(plate)
+
+    def __len__(self):
+        return self._size
+
+    def canonical(self, plate):
+        return plate.translate(self._canonical_table)
+
+    def _neighbourhood(self, plate):
+        canonical = self.canonical(plate)
+        keys = {canonical}
+        keys.update(canonical[:i] + canonical[i + 1:] for i in range(len(canonical)))
+        return keys
+
+    def add(self, plate):
+        added = False
+        for key in self._neighbourhood(plate):
+            plates = self._keys.get(key)
+            if plates is None:
+                # Most keys have a single plate, which is stored without a container
+                self._keys[key] = plate
+                added = True
+            elif isinstance(plates, str):
+                if plates != plate:
+                    self._keys[key] = [plates, plate]
+                    added = True
+            elif plate not in plates:
+                plates.append(plate)
+                added = True
+        if added:
+            self._size += 1
+
+    def remove(self, plate):
+        removed = False
+        for key in self._neighbourhood(plate):
+            plates = self._keys.get(key)
+            if plates == plate:
+                del self._keys[key]
+                removed = True
+            elif isinstance(plates, list) and plate in plates:
+                plates.remove(plate)
+                if len(plates) == 1:
+                    self._keys[key] = plates[0]
+                removed = True
+        if removed:
+            self._size -= 1
+
+    def distance(self, a, b):
+        """Edit distance where substituting confused characters costs confusion_cost."""
+        classes = self._classes
+        previous = [float(j) for j in range(len(b) + 1)]
+        for i, char_a in enumerate(a, 1):
+            current = [float(i)]
+            class_a = classes.get(char_a, char_a)
+            for j, char_b in enumerate(b, 1):
+                if char_a == char_b:
+                    substitution = 0.0
+                elif class_a == classes.get(char_b, char_b):
+                    substitution = self.confusion_cost
+                else:
+                    substitution = 1.0
+                current.append(min(previous[j] + 1.0, current[j - 1] + 1.0, previous[j - 1] + substitution))
+            previous = current
+        return previous[-1]
+
+    def match(self, text, max_distance=1.0):
+        """
+        Find the indexed plates close to an OCR read.
+
+        Args:
+            text (str): OCR read of a plate.
+            max_distance (float): Maximum weighted edit distance, below MAX_INDEXED_EDITS + 1.
+
+        Returns:
+            list: (plate, distance) pairs within max_distance, closest first.
+
+        Raises:
+            ValueError: If max_distance is too large for the index, see check_match_distance.
+        """
+        check_match_distance(max_distance)
+        candidates = set()
+        for key in self._neighbourhood(text):
+            plates = self._keys.get(key)
+            if plates is None:
+                continue
+            if isinstance(plates, str):
+                candidates.add(plates)
+            else:
+                candidates.update(plates)
+
+        matches = []
+        for plate in candidates:
+            distance = self.distance(text, plate)
+            if distance <= max_distance:
+                matches.append((plate, distance))
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches
+
+
+def match_score(text, plate, distance):
+    """Similarity between 0 and 1 of an OCR read and the plate it matched (1 for an exact match)."""
+    return max(0.0, 1.0 - distance / max(len(text), len(plate), 1))
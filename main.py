@@ -1,54 +1,501 @@
-import torch
-from ultralytics import YOLO
 import cv2
 import os
 import argparse
 import numpy as np
 from datetime import datetime
+import threading
 import traceback
 
 import util
-from sort.sort import *
-from util import get_car, read_license_plate, write_csv
-
-# Add YOLO classes to the safe globals list to allow loading the models
-# Commented out because this function is not available in older PyTorch versions
-# torch.serialization.add_safe_globals(['ultralytics.nn.tasks.DetectionModel'])
+from util import assign_plates_to_cars, bbox_iou, read_license_plates, threshold_license_plate_crop
+from pipeline import Pipeline, format_stats
+from track_ocr import TrackOCRCache
+from results_writer import open_results_writer
+from plate_formats import DEFAULT_PLATE_FORMAT, PLATE_FORMATS
+from event_sink import DetectionEventSink
+from evidence_writer import EVIDENCE_MODES, EvidenceWriter, new_run_id
+from fuzzy_match import check_match_distance
 
 # Try importing database utilities - will work in Flask context but can still function without it
 try:
-    from database_utils import check_license_plate_in_database, record_detection_event, fallback_check_license_plate, fallback_record_detection
+    from database_utils import (check_license_plate_in_database, record_detection_event, record_detection_events,
+                                fallback_check_license_plate, fallback_record_detection)
     HAVE_DB_UTILS = True
 except ImportError:
     print("Warning: database_utils not available, running without database functionality")
     HAVE_DB_UTILS = False
 
-def process_video(video_path, output_path='./test.csv', user_id=None, job_id=None, save_detections=True, 
-                  alert_on_match=False, save_frames=True, frames_output_dir='./output/frames'):
+# Vehicle classes in COCO dataset: car(2), motorcycle(3), bus(5), truck(7)
+VEHICLE_CLASSES = [2, 3, 5, 7]
+
+def iter_frames(cap, max_frames=None):
     """
-    Process a video file, detect license plates, and check against stolen vehicle database
+    Read frames from a video capture until the end of the video
     
     Args:
-        video_path (str): Path to the video file
-        output_path (str): Path to save the output CSV
-        user_id (int, optional): ID of the user processing the video
-        job_id (int, optional): ID of the job processing the video
-        save_detections (bool): Whether to save detection data to CSV
-        alert_on_match (bool): Whether to print alerts when stolen vehicles are found (default: False)
-        save_frames (bool): Whether to save frames with detected stolen vehicles
-        frames_output_dir (str): Directory to save detection frames
+        cap (cv2.VideoCapture): Opened video capture
+        max_frames (int, optional): Stop after this many frames (default: read to the end)
+    
+    Yields:
+        numpy.ndarray: Decoded frames
+    """
+    frames_read = 0
+    while max_frames is None or frames_read < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames_read += 1
+        yield frame
+
+def batch_frames(frames, batch_size=1, start_frame=0):
+    """
+    Group an iterable of frames into batches of consecutive frames
+    
+    Args:
+        frames (iterable): Frames in decode order
+        batch_size (int): Maximum number of frames per batch
+        start_frame (int): Frame number of the first frame
+    
+    Yields:
+        tuple: (frame_nmr, frames) with the number of the first frame of the batch and up to
+            batch_size frames in decode order (the last batch may be shorter)
+    """
+    frame_nmr = start_frame
+    batch = []
+    for frame in frames:
+        batch.append(frame)
+        if len(batch) >= batch_size:
+            yield frame_nmr, batch
+            frame_nmr += len(batch)
+            batch = []
+    if batch:
+        yield frame_nmr, batch
+
+def read_frame_batches(cap, batch_size=1, start_frame=0, max_frames=None):
+    """
+    Read consecutive frames from a video capture in batches
+    
+    Args:
+        cap (cv2.VideoCapture): Opened video capture, positioned at start_frame
+        batch_size (int): Maximum number of frames per batch
+        start_frame (int): Frame number of the first frame read from cap
+        max_frames (int, optional): Stop after this many frames (default: read to the end)
     
     Returns:
-        list: List of detection dictionaries for stolen vehicles
+        generator: (frame_nmr, frames) batches, see batch_frames
+    """
+    return batch_frames(iter_frames(cap, max_frames), batch_size, start_frame)
+
+def detect_plates_in_vehicles(license_plate_detector, frames, track_ids_batch):
+    """
+    Detect license plates on crops of the tracked vehicles instead of full frames
+    
+    All vehicle crops of the batch go through the plate detector in a single call and
+    the plate boxes are mapped back to frame coordinates. Frames without tracked
+    vehicles are skipped entirely.
+    
+    Args:
+        license_plate_detector (YOLO): License plate detection model
+        frames (list): Frames of the batch
+        track_ids_batch (list): Tracker output (x1, y1, x2, y2, car_id) for each frame
+    
+    Returns:
+        list: For each frame, a list of [x1, y1, x2, y2, score, class_id] detections
+    """
+    crops = []
+    origins = []
+    for frame_indx, (frame, track_ids) in enumerate(zip(frames, track_ids_batch)):
+        height, width = frame.shape[:2]
+        for xcar1, ycar1, xcar2, ycar2, car_id in track_ids:
+            x0, y0 = max(0, int(xcar1)), max(0, int(ycar1))
+            x1, y1 = min(width, int(np.ceil(xcar2))), min(height, int(np.ceil(ycar2)))
+            if x1 - x0 < 2 or y1 - y0 < 2:
+                continue
+            crops.append(frame[y0:y1, x0:x1, :])
+            origins.append((frame_indx, x0, y0))
+    
+    license_plates_batch = [[] for _ in frames]
+    if not crops:
+        return license_plates_batch
+    
+    for (frame_indx, x0, y0), license_plates in zip(origins, license_plate_detector(crops)):
+        for x1, y1, x2, y2, score, class_id in license_plates.boxes.data.tolist():
+            license_plates_batch[frame_indx].append([x1 + x0, y1 + y0, x2 + x0, y2 + y0, score, class_id])
+    
+    # Overlapping vehicle crops can contain the same plate more than once
+    return [suppress_duplicate_plates(license_plates) for license_plates in license_plates_batch]
+
+def suppress_duplicate_plates(license_plates, iou_threshold=0.5):
+    """
+    Drop plate detections that overlap a higher-scoring detection of the same frame
+    
+    Args:
+        license_plates (list): [x1, y1, x2, y2, score, class_id] detections
+        iou_threshold (float): Overlap above which two detections are the same plate
+    
+    Returns:
+        list: Remaining detections, highest score first
+    """
+    kept = []
+    for license_plate in sorted(license_plates, key=lambda p: p[4], reverse=True):
+        if all(bbox_iou(license_plate[:4], other[:4]) <= iou_threshold for other in kept):
+            kept.append(license_plate)
+    return kept
+
+def detect_and_track_batch(frames, coco_model, license_plate_detector, mot_tracker, cascade=False):
+    """
+    Detect vehicles and license plates on a batch of frames and track the vehicles
+    
+    Both YOLO models run once for the whole batch; the per-frame results are then
+    fed to the tracker in frame order, so the output matches frame-by-frame inference.
+    
+    Args:
+        frames (list): Consecutive frames
+        coco_model (YOLO): Vehicle detection model
+        license_plate_detector (YOLO): License plate detection model
+        mot_tracker (Sort): Vehicle tracker
+        cascade (bool): Run the plate detector on tracked vehicle crops instead of full frames
+    
+    Returns:
+        list: (track_ids, license_plates) for each frame, where license_plates is a list
+            of [x1, y1, x2, y2, score, class_id] detections
+    """
+    track_ids_batch = []
+    for detections in coco_model(frames):
+        detections_ = []
+        for detection in detections.boxes.data.tolist():
+            x1, y1, x2, y2, score, class_id = detection
+            if int(class_id) in VEHICLE_CLASSES:
+                detections_.append([x1, y1, x2, y2, score])
+        
+        # track vehicles
+        track_ids_batch.append(mot_tracker.update(np.asarray(detections_)))
+    
+    # detect license plates
+    if cascade:
+        license_plates_batch = detect_plates_in_vehicles(license_plate_detector, frames, track_ids_batch)
+    else:
+        license_plates_batch = [license_plates.boxes.data.tolist()
+                                for license_plates in license_plate_detector(frames)]
+    
+    return list(zip(track_ids_batch, license_plates_batch))
+
+def detect_and_track(cap, coco_model, license_plate_detector, mot_tracker, batch_size=1, cascade=False,
+                     start_frame=0, max_frames=None):
+    """
+    Detect and track vehicles and license plates on every frame of a video capture
+    
+    Args:
+        cap (cv2.VideoCapture): Opened video capture
+        coco_model (YOLO): Vehicle detection model
+        license_plate_detector (YOLO): License plate detection model
+        mot_tracker (Sort): Vehicle tracker
+        batch_size (int): Number of frames passed to each model call
+        cascade (bool): Run the plate detector on tracked vehicle crops instead of full frames
+        start_frame (int): Frame number of the first frame read from cap
+        max_frames (int, optional): Stop after this many frames (default: read to the end)
+    
+    Yields:
+        tuple: (frame_nmr, frame, track_ids, license_plates) for each frame in order
+    """
+    for first_frame_nmr, frames in read_frame_batches(cap, batch_size, start_frame, max_frames):
+        tracked = detect_and_track_batch(frames, coco_model, license_plate_detector, mot_tracker, cascade)
+        for frame_nmr, (frame, (track_ids, license_plates)) in enumerate(zip(frames, tracked), first_frame_nmr):
+            yield frame_nmr, frame, track_ids, license_plates
+
+def read_plates_batch(tracked_frames, ocr_cache=None, ocr_batch_size=1, ocr_recognize_only=False, plate_format=None):
     """
-    results = {}
-    detection_results = []
+    Assign license plates to tracked vehicles and read their text for a window of frames
     
-    # Create directories if they don't exist
-    if save_frames and not os.path.exists(frames_output_dir):
-        os.makedirs(frames_output_dir, exist_ok=True)
+    The plate crops of all frames in the window are recognized together, ocr_batch_size
+    crops per OCR call, and the reads are mapped back to their (frame_nmr, car_id).
     
-    mot_tracker = Sort()
+    Args:
+        tracked_frames (list): (frame_nmr, frame, track_ids, license_plates) tuples in frame order,
+            where license_plates is a list of [x1, y1, x2, y2, score, class_id] detections
+        ocr_cache (TrackOCRCache, optional): Per-track recognition state; plates of locked
+            tracks are filled from the track consensus instead of running OCR
+        ocr_batch_size (int): Maximum number of plate crops per OCR call (1 reads each crop separately)
+        ocr_recognize_only (bool): Run only the OCR recognizer on the plate crops, see util.read_license_plate
+        plate_format (str or PlateFormat, optional): Regional plate format, see plate_formats.py (default: UK)
+    
+    Returns:
+        list: (frame_nmr, frame, plate_reads) for each frame, where plate_reads holds (car_id, result)
+            pairs in detection order for every plate that was read, and result holds the 'car' and
+            'license_plate' entries stored in the results dictionary
+    """
+    frame_slots = []
+    pending = []
+    for frame_nmr, frame, track_ids, license_plates in tracked_frames:
+        if ocr_cache is not None:
+            ocr_cache.forget_inactive(frame_nmr)
+        
+        # assign license plates to cars, at most one plate per car
+        cars = assign_plates_to_cars(license_plates, track_ids)
+        
+        slots = []
+        for license_plate, car in zip(license_plates, cars):
+            x1, y1, x2, y2, score, class_id = license_plate
+            xcar1, ycar1, xcar2, ycar2, car_id = car
+
+            if car_id == -1:
+                continue
+            
+            # slot: car_id, car bbox, plate detection, text, text score
+            slot = [car_id, [xcar1, ycar1, xcar2, ycar2], license_plate, None, None]
+            slots.append(slot)
+            if ocr_cache is not None and not ocr_cache.should_read(car_id, frame_nmr, license_plate):
+                slot[3], slot[4] = ocr_cache.consensus(car_id)
+                continue
+
+            # crop license plate
+            license_plate_crop = frame[int(y1):int(y2), int(x1): int(x2), :]
+
+            # process license plate
+            pending.append((frame_nmr, slot, threshold_license_plate_crop(license_plate_crop)))
+        frame_slots.append((frame_nmr, frame, slots))
+    
+    # read license plate numbers
+    plate_texts = read_license_plates([crop for _, _, crop in pending], ocr_batch_size, ocr_recognize_only,
+                                      plate_format)
+    for (frame_nmr, slot, _), (license_plate_text, license_plate_text_score) in zip(pending, plate_texts):
+        if ocr_cache is not None:
+            car_id, _, license_plate = slot[:3]
+            ocr_cache.add_read(car_id, frame_nmr, license_plate, license_plate_text, license_plate_text_score)
+            if ocr_cache.is_locked(car_id):
+                license_plate_text, license_plate_text_score = ocr_cache.consensus(car_id)
+        slot[3], slot[4] = license_plate_text, license_plate_text_score
+    
+    read_frames = []
+    for frame_nmr, frame, slots in frame_slots:
+        plate_reads = []
+        for car_id, car_bbox, license_plate, license_plate_text, license_plate_text_score in slots:
+            if license_plate_text is not None:
+                x1, y1, x2, y2, score, class_id = license_plate
+                plate_reads.append((car_id, {
+                    'car': {'bbox': car_bbox},
+                    'license_plate': {
+                        'bbox': [x1, y1, x2, y2],
+                        'text': license_plate_text,
+                        'bbox_score': score,
+                        'text_score': license_plate_text_score
+                    }
+                }))
+        read_frames.append((frame_nmr, frame, plate_reads))
+    return read_frames
+
+def read_plates(frame, track_ids, license_plates, frame_nmr=None, ocr_cache=None, ocr_batch_size=1,
+                ocr_recognize_only=False, plate_format=None):
+    """
+    Assign license plates to tracked vehicles of one frame and read their text
+    
+    Args:
+        frame (numpy.ndarray): Video frame
+        track_ids (numpy.ndarray): Tracker output (x1, y1, x2, y2, car_id) for the frame
+        license_plates (list): [x1, y1, x2, y2, score, class_id] plate detections
+        frame_nmr (int, optional): Frame number, required when ocr_cache is given
+        ocr_cache (TrackOCRCache, optional): Per-track recognition state, see read_plates_batch
+        ocr_batch_size (int): Maximum number of plate crops per OCR call
+        ocr_recognize_only (bool): Run only the OCR recognizer on the plate crops
+        plate_format (str or PlateFormat, optional): Regional plate format, see plate_formats.py
+    
+    Returns:
+        list: (car_id, result) pairs, see read_plates_batch
+    """
+    return read_plates_batch([(frame_nmr, frame, track_ids, license_plates)], ocr_cache, ocr_batch_size,
+                             ocr_recognize_only, plate_format)[0][2]
+
+class DetectionRecorder:
+    """
+    Collect the plate reads of each frame and handle stolen vehicle matches
+    
+    Stores every read in the per-frame results dictionary (or appends it to a results
+    writer as the frame finishes), checks the plate against the stolen vehicle database
+    and, for new matches, queues the evidence image and records the detection event.
+    """
+    
+    def __init__(self, video_path, fps, user_id=None, job_id=None, alert_on_match=False,
+                 evidence_writer=None, record_events=True, results_writer=None, match_distance=0.0,
+                 event_sink=None):
+        # Fail before the video is processed rather than on the first fuzzy lookup
+        check_match_distance(match_distance)
+        self.video_path = video_path
+        self.fps = fps
+        self.user_id = user_id
+        self.job_id = job_id
+        self.alert_on_match = alert_on_match
+        # Evidence images of new matches are saved by its worker threads; None saves none
+        self.evidence_writer = evidence_writer
+        # Sharded workers leave event recording to the parent, which merges their detections
+        self.record_events = record_events
+        # With a writer the reads are streamed to the output instead of kept in results
+        self.results_writer = results_writer
+        # Maximum OCR-confusion-weighted edit distance of a read to a stolen plate (0 = exact)
+        self.match_distance = match_distance
+        # With a sink the events are committed by its background thread instead of in the frame loop
+        self.event_sink = event_sink
+        
+        self.results = {}
+        self.detection_results = []
+        # Track unique stolen plates to avoid duplicate detections
+        self.detected_license_plates = set()
+    
+    def record_frame(self, frame_nmr, frame, plate_reads):
+        """
+        Record the plate reads of one frame
+        
+        Args:
+            frame_nmr (int): Frame number
+            frame (numpy.ndarray): Video frame, used for evidence images
+            plate_reads (list): (car_id, result) pairs returned by read_plates
+        """
+        frame_results = {}
+        for car_id, result in plate_reads:
+            # Store in results dictionary
+            frame_results[car_id] = result
+            self._check_stolen(frame_nmr, frame, car_id, result)
+        
+        if self.results_writer is not None:
+            self.results_writer.write_frame(frame_nmr, frame_results)
+        else:
+            self.results[frame_nmr] = frame_results
+    
+    def _check_stolen(self, frame_nmr, frame, car_id, result):
+        license_plate_text = result['license_plate']['text']
+        license_plate_text_score = result['license_plate']['text_score']
+        
+        # Calculate timestamp within the video
+        frame_timestamp = frame_nmr / self.fps if self.fps > 0 else 0
+        hours, remainder = divmod(frame_timestamp, 3600)
+        minutes, seconds = divmod(remainder, 60)
+        timecode = f"{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}"
+
+        # Calculate absolute timestamp based on current time
+        detection_time = datetime.now()
+
+        # Check if this is a stolen vehicle
+        stolen_vehicle = None
+        if HAVE_DB_UTILS:
+            try:
+                # Try with database_utils
+                stolen_vehicle = check_license_plate_in_database(license_plate_text, self.match_distance)
+            except Exception as e:
+                # Fallback to direct check if context error
+                print(f"Database context error, using fallback: {e}")
+                stolen_vehicle = fallback_check_license_plate(license_plate_text, self.match_distance)
+
+        if stolen_vehicle:
+            # Skip if we've already detected this stolen plate in this video (misreads of
+            # the same plate can match it too)
+            if stolen_vehicle['license_plate'] in self.detected_license_plates:
+                return
+
+            # Add to set of detected plates
+            self.detected_license_plates.add(stolen_vehicle['license_plate'])
+
+            # Print alert only if alert_on_match is True
+            if self.alert_on_match:
+                print(f"⚠️ STOLEN VEHICLE DETECTED ⚠️")
+                print(f"Frame #{frame_nmr}, Vehicle #{car_id}, Timecode: {timecode}")
+                print(f"License: {license_plate_text} (Confidence: {license_plate_text_score:.2f})")
+                if stolen_vehicle['license_plate'] != license_plate_text:
+                    print(f"Matched stolen plate: {stolen_vehicle['license_plate']} " +
+                          f"(Match score: {stolen_vehicle['match_score']:.2f})")
+                print(f"Vehicle Info: {stolen_vehicle.get('year', 'N/A')} " +
+                     f"{stolen_vehicle.get('make', 'N/A')} " +
+                     f"{stolen_vehicle.get('model', 'N/A')} " +
+                     f"({stolen_vehicle.get('color', 'N/A')})")
+                print(f"Description: {stolen_vehicle.get('description', 'N/A')}")
+                print("-" * 50)
+
+            # Queue the evidence image, written in the background
+            frame_filename = None
+            if self.evidence_writer is not None:
+                frame_filename = self.evidence_writer.submit(frame, result['car']['bbox'], result['license_plate']['bbox'],
+                                                             license_plate_text, frame_nmr, self.video_path)
+
+            detection = {
+                'license_plate': license_plate_text,
+                'confidence': license_plate_text_score,
+                'match_score': stolen_vehicle.get('match_score', 1.0),
+                'frame': frame_nmr,
+                'timecode': timecode,
+                'timestamp': detection_time,
+                'vehicle': stolen_vehicle,
+                'image_path': frame_filename
+            }
+            
+            # Record the detection event in the database
+            if self.record_events:
+                self.record_event(detection)
+            
+            # Add to detection results
+            self.detection_results.append(detection)
+    
+    def record_event(self, detection):
+        """
+        Record a stolen vehicle detection in the database
+        
+        Args:
+            detection (dict): Detection dictionary as stored in detection_results
+        """
+        if not HAVE_DB_UTILS:
+            return
+        event = self._event_row(detection)
+        if self.event_sink is not None:
+            self.event_sink.submit(event)
+            return
+        try:
+            record_detection_event(**event)
+        except Exception as e:
+            # Fallback to direct recording if context error
+            print(f"Database context error in recording, using fallback: {e}")
+            fallback_record_detection(**event)
+    
+    def record_event_batch(self, detections):
+        """
+        Record many stolen vehicle detections in one database transaction
+        
+        Args:
+            detections (list): Detection dictionaries as stored in detection_results
+        """
+        if not HAVE_DB_UTILS or not detections:
+            return
+        try:
+            record_detection_events([self._event_row(detection) for detection in detections])
+        except Exception as e:
+            print(f"Database context error in recording, using fallback: {e}")
+            for detection in detections:
+                fallback_record_detection(**self._event_row(detection))
+    
+    def _event_row(self, detection):
+        return {
+            'license_plate': detection['license_plate'],
+            'vehicle_id': detection['vehicle'].get('id'),
+            'frame_number': detection['frame'],
+            'timestamp': detection['timestamp'],
+            'confidence': detection['confidence'],
+            'video_path': self.video_path,
+            'image_path': detection['image_path'],
+            'job_id': self.job_id,
+            'user_id': self.user_id,
+            'match_score': detection.get('match_score')
+        }
+
+def load_models():
+    """
+    Load the vehicle and license plate detection models, downloading YOLOv8n if needed
+    
+    Returns:
+        tuple: (coco_model, license_plate_detector), or None if the models could not be loaded
+    """
+    # torch and ultralytics are imported here so that importing main stays cheap
+    import torch
+    from ultralytics import YOLO
+    
+    # Add YOLO classes to the safe globals list to allow loading the models
+    # Commented out because this function is not available in older PyTorch versions
+    # torch.serialization.add_safe_globals(['ultralytics.nn.tasks.DetectionModel'])
     
     # Download models if they don't exist
     if not os.path.exists('yolov8n.pt'):
@@ -59,7 +506,7 @@ def process_video(video_path, output_path='./test.csv', user_id=None, job_id=Non
     if not os.path.exists('./models/license_plate_detector.pt'):
         print("Error: License plate detector model not found.")
         print("Please make sure the model exists at ./models/license_plate_detector.pt")
-        return []
+        return None
     
     # load models
     try:
@@ -68,204 +515,363 @@ def process_video(video_path, output_path='./test.csv', user_id=None, job_id=Non
     except Exception as e:
         print(f"Error loading models: {e}")
         traceback.print_exc()
-        return []
+        return None
     
-    # load video
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Could not open video file: {video_path}")
-        return []
+    return coco_model, license_plate_detector
+
+class ANPREngine:
+    """
+    Long-lived ANPR engine that keeps the detection models loaded between videos
     
-    # Get video properties for timestamp calculation
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    The models are loaded and warmed up once. Every call to process or process_frames
+    gets its own tracker, OCR state and results, so one engine can serve any number of
+    videos or clips in a worker process. Calls are serialized with a lock because the
+    YOLO predictors and the tracker id counter are not thread-safe.
+    """
     
-    # Vehicle classes in COCO dataset: car(2), motorcycle(3), bus(5), truck(7)
-    vehicles = [2, 3, 5, 7]
+    def __init__(self, warmup=True):
+        """
+        Args:
+            warmup (bool): Run a dummy inference through every model after loading
+        
+        Raises:
+            RuntimeError: If the models could not be loaded
+        """
+        models = load_models()
+        if models is None:
+            raise RuntimeError("Could not load detection models")
+        self.coco_model, self.license_plate_detector = models
+        self._lock = threading.Lock()
+        
+        if warmup:
+            self.warmup()
     
-    # Track unique license plates to avoid duplicate detections
-    detected_license_plates = set()
+    def warmup(self, size=640):
+        """Run a dummy inference through both YOLO models and the OCR reader."""
+        dummy_frame = np.zeros((size, size, 3), dtype=np.uint8)
+        with self._lock:
+            self.coco_model(dummy_frame)
+            self.license_plate_detector(dummy_frame)
+            util.get_reader().readtext(np.zeros((32, 128), dtype=np.uint8))
     
-    # read frames
-    frame_nmr = -1
-    ret = True
-    while ret:
-        frame_nmr += 1
-        ret, frame = cap.read()
-        if ret:
-            results[frame_nmr] = {}
-            # detect vehicles
-            detections = coco_model(frame)[0]
-            detections_ = []
-            for detection in detections.boxes.data.tolist():
-                x1, y1, x2, y2, score, class_id = detection
-                if int(class_id) in vehicles:
-                    detections_.append([x1, y1, x2, y2, score])
-    
-            # track vehicles
-            track_ids = mot_tracker.update(np.asarray(detections_))
-    
-            # detect license plates
-            license_plates = license_plate_detector(frame)[0]
-            for license_plate in license_plates.boxes.data.tolist():
-                x1, y1, x2, y2, score, class_id = license_plate
+    def process(self, video_path, output_path='./test.csv', user_id=None, job_id=None, save_detections=True,
+                alert_on_match=False, save_frames=True, frames_output_dir='./output/frames', batch_size=1,
+                cascade=False, pipelined=False, queue_size=8, ocr_lock=False, ocr_recheck_interval=30,
+                ocr_batch_size=1, ocr_recognize_only=False, output_format=None, flush_rows=500,
+                flush_interval=5.0, plate_format=None, match_distance=0.0, event_batch_size=100,
+                event_flush_interval=0.2, evidence_mode='frame', evidence_quality=95, evidence_max_size=None,
+                evidence_workers=2):
+        """
+        Process a video file, see process_video for the arguments
+        
+        Returns:
+            list: List of detection dictionaries for stolen vehicles
+        """
+        # load video
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            print(f"Could not open video file: {video_path}")
+            return []
+        
+        # Get video properties for timestamp calculation
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        
+        # Results are appended to the output as frames finish, so a crashed run leaves a usable partial file
+        results_writer = None
+        if save_detections:
+            results_writer = open_results_writer(output_path, output_format, flush_rows, flush_interval)
+        
+        try:
+            _, detection_results = self.process_frames(
+                iter_frames(cap), video_path=video_path, fps=fps, user_id=user_id, job_id=job_id,
+                alert_on_match=alert_on_match, save_frames=save_frames, frames_output_dir=frames_output_dir,
+                batch_size=batch_size, cascade=cascade, pipelined=pipelined, queue_size=queue_size,
+                ocr_lock=ocr_lock, ocr_recheck_interval=ocr_recheck_interval, ocr_batch_size=ocr_batch_size,
+                ocr_recognize_only=ocr_recognize_only, results_writer=results_writer, plate_format=plate_format,
+                match_distance=match_distance, event_batch_size=event_batch_size,
+                event_flush_interval=event_flush_interval, evidence_mode=evidence_mode,
+                evidence_quality=evidence_quality, evidence_max_size=evidence_max_size,
+                evidence_workers=evidence_workers)
+        finally:
+            # Release video capture
+            cap.release()
+            if results_writer is not None:
+                results_writer.close()
+        
+        return detection_results
     
-                # assign license plate to car
-                xcar1, ycar1, xcar2, ycar2, car_id = get_car(license_plate, track_ids)
-    
-                if car_id != -1:
-                    # crop license plate
-                    license_plate_crop = frame[int(y1):int(y2), int(x1): int(x2), :]
-    
-                    # process license plate
-                    license_plate_crop_gray = cv2.cvtColor(license_plate_crop, cv2.COLOR_BGR2GRAY)
-                    _, license_plate_crop_thresh = cv2.threshold(license_plate_crop_gray, 64, 255, cv2.THRESH_BINARY_INV)
-    
-                    # read license plate number
-                    license_plate_text, license_plate_text_score = read_license_plate(license_plate_crop_thresh)
-    
-                    if license_plate_text is not None:
-                        # Store in results dictionary
-                        results[frame_nmr][car_id] = {
-                            'car': {'bbox': [xcar1, ycar1, xcar2, ycar2]},
-                            'license_plate': {
-                                'bbox': [x1, y1, x2, y2],
-                                'text': license_plate_text,
-                                'bbox_score': score,
-                                'text_score': license_plate_text_score
-                            }
-                        }
-                        
-                        # Calculate timestamp within the video
-                        frame_timestamp = frame_nmr / fps if fps > 0 else 0
-                        hours, remainder = divmod(frame_timestamp, 3600)
-                        minutes, seconds = divmod(remainder, 60)
-                        timecode = f"{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}"
-                        
-                        # Calculate absolute timestamp based on current time
-                        detection_time = datetime.now()
-                        
-                        # Check if this is a stolen vehicle
-                        stolen_vehicle = None
-                        if HAVE_DB_UTILS:
-                            try:
-                                # Try with database_utils
-                                stolen_vehicle = check_license_plate_in_database(license_plate_text)
-                            except Exception as e:
-                                # Fallback to direct check if context error
-                                print(f"Database context error, using fallback: {e}")
-                                stolen_vehicle = fallback_check_license_plate(license_plate_text)
-                        
-                        if stolen_vehicle:
-                            # Skip if we've already detected this license plate in this video
-                            if license_plate_text in detected_license_plates:
-                                continue
-                            
-                            # Add to set of detected plates
-                            detected_license_plates.add(license_plate_text)
-                            
-                            # Print alert only if alert_on_match is True
-                            if alert_on_match:
-                                print(f"⚠️ STOLEN VEHICLE DETECTED ⚠️")
-                                print(f"Frame #{frame_nmr}, Vehicle #{car_id}, Timecode: {timecode}")
-                                print(f"License: {license_plate_text} (Confidence: {license_plate_text_score:.2f})")
-                                print(f"Vehicle Info: {stolen_vehicle.get('year', 'N/A')} " +
-                                     f"{stolen_vehicle.get('make', 'N/A')} " +
-                                     f"{stolen_vehicle.get('model', 'N/A')} " +
-                                     f"({stolen_vehicle.get('color', 'N/A')})")
-                                print(f"Description: {stolen_vehicle.get('description', 'N/A')}")
-                                print("-" * 50)
-                            
-                            # Save the frame
-                            frame_filename = None
-                            if save_frames:
-                                timestamp_str = detection_time.strftime("%Y%m%d_%H%M%S")
-                                frame_filename = f"{frames_output_dir}/stolen_{license_plate_text}_frame_{frame_nmr}_{timestamp_str}.jpg"
-                                
-                                # Draw bounding boxes on the frame
-                                frame_copy = frame.copy()
-                                # Draw car bbox in red
-                                cv2.rectangle(frame_copy, 
-                                            (int(xcar1), int(ycar1)), 
-                                            (int(xcar2), int(ycar2)), 
-                                            (0, 0, 255), 3)
-                                # Draw license plate bbox in yellow
-                                cv2.rectangle(frame_copy, 
-                                            (int(x1), int(y1)), 
-                                            (int(x2), int(y2)), 
-                                            (0, 255, 255), 2)
-                                # Add text
-                                cv2.putText(frame_copy, 
-                                          f"STOLEN: {license_plate_text}", 
-                                          (int(xcar1), int(ycar1) - 10), 
-                                          cv2.FONT_HERSHEY_SIMPLEX, 0.9, 
-                                          (0, 0, 255), 2)
-                                
-                                # Save the annotated frame
-                                cv2.imwrite(frame_filename, frame_copy)
-                            
-                            # Record the detection event in the database
-                            if HAVE_DB_UTILS:
-                                try:
-                                    detection_id = record_detection_event(
-                                        license_plate=license_plate_text,
-                                        vehicle_id=stolen_vehicle.get('id'),
-                                        frame_number=frame_nmr,
-                                        timestamp=detection_time,
-                                        confidence=license_plate_text_score,
-                                        video_path=video_path,
-                                        image_path=frame_filename if save_frames else None,
-                                        job_id=job_id,
-                                        user_id=user_id
-                                    )
-                                except Exception as e:
-                                    # Fallback to direct recording if context error
-                                    print(f"Database context error in recording, using fallback: {e}")
-                                    detection_id = fallback_record_detection(
-                                        license_plate=license_plate_text,
-                                        vehicle_id=stolen_vehicle.get('id'),
-                                        frame_number=frame_nmr,
-                                        timestamp=detection_time.strftime('%Y-%m-%d %H:%M:%S'),
-                                        confidence=license_plate_text_score,
-                                        video_path=video_path,
-                                        image_path=frame_filename
-                                    )
-                            
-                            # Add to detection results
-                            detection_results.append({
-                                'license_plate': license_plate_text,
-                                'confidence': license_plate_text_score,
-                                'frame': frame_nmr,
-                                'timecode': timecode,
-                                'timestamp': detection_time,
-                                'vehicle': stolen_vehicle,
-                                'image_path': frame_filename
-                            })
-    
-    # Release video capture
-    cap.release()
-    
-    # write results to CSV if requested
-    if save_detections:
-        write_csv(results, output_path)
-    
-    return detection_results
+    def process_frames(self, frames, video_path=None, fps=0, user_id=None, job_id=None, alert_on_match=False,
+                       save_frames=True, frames_output_dir='./output/frames', batch_size=1, cascade=False,
+                       pipelined=False, queue_size=8, ocr_lock=False, ocr_recheck_interval=30, ocr_batch_size=1,
+                       ocr_recognize_only=False, results_writer=None, plate_format=None, match_distance=0.0,
+                       event_batch_size=100, event_flush_interval=0.2, evidence_mode='frame', evidence_quality=95,
+                       evidence_max_size=None, evidence_workers=2):
+        """
+        Process an iterable of frames as one stream with a fresh tracker
+        
+        Args:
+            frames (iterable): BGR frames in stream order
+            video_path (str, optional): Source recorded with the detection events
+            fps (float): Frame rate used for timecodes (0 if unknown)
+            results_writer (ResultsWriter, optional): Writer the per-frame results are appended
+                to as frames finish; the caller closes it
+            See process_video for the remaining arguments
+        
+        Returns:
+            tuple: (results, detection_results) with the per-frame results dictionary (empty
+                when a results writer is given) and the list of detection dictionaries for
+                stolen vehicles
+        """
+        # Evidence images are encoded and written off the frame loop
+        evidence_writer = None
+        if save_frames:
+            evidence_writer = EvidenceWriter(frames_output_dir, mode=evidence_mode, jpeg_quality=evidence_quality,
+                                             max_size=evidence_max_size, workers=evidence_workers,
+                                             run_id=new_run_id(job_id))
+        
+        # Detection events are committed in the background so the frame loop never waits on SQLite
+        event_sink = None
+        if HAVE_DB_UTILS:
+            event_sink = DetectionEventSink(batch_size=event_batch_size, flush_interval=event_flush_interval)
+        recorder = DetectionRecorder(video_path, fps, user_id=user_id, job_id=job_id, alert_on_match=alert_on_match,
+                                     evidence_writer=evidence_writer, results_writer=results_writer,
+                                     match_distance=match_distance, event_sink=event_sink)
+        ocr_cache = TrackOCRCache(recheck_interval=ocr_recheck_interval) if ocr_lock else None
+        
+        from sort.sort import KalmanBoxTracker, Sort
+        
+        try:
+            with self._lock:
+                # Track ids start from 1 for every stream
+                KalmanBoxTracker.count = 0
+                mot_tracker = Sort()
+                frame_batches = batch_frames(frames, batch_size)
+            
+                if pipelined:
+                    self._run_pipelined(frame_batches, mot_tracker, recorder, ocr_cache, ocr_batch_size, ocr_recognize_only,
+                                        plate_format, cascade, queue_size)
+                else:
+                    # detect and track vehicles in batches of batch_size frames
+                    for first_frame_nmr, batch in frame_batches:
+                        tracked = detect_and_track_batch(batch, self.coco_model, self.license_plate_detector,
+                                                         mot_tracker, cascade)
+                        tracked_frames = [(frame_nmr, frame, track_ids, license_plates) for frame_nmr, (frame, (track_ids, license_plates))
+                                          in enumerate(zip(batch, tracked), first_frame_nmr)]
+                        for frame_nmr, frame, plate_reads in read_plates_batch(tracked_frames, ocr_cache, ocr_batch_size,
+                                                                               ocr_recognize_only, plate_format):
+                            recorder.record_frame(frame_nmr, frame, plate_reads)
+        finally:
+            # Wait for the queued images and events, so they are saved when the video is done
+            if evidence_writer is not None:
+                evidence_writer.close()
+            if event_sink is not None:
+                event_sink.close()
+        
+        if ocr_cache is not None:
+            print(f"OCR calls: {ocr_cache.ocr_calls}, skipped on locked tracks: {ocr_cache.skipped_calls}")
+        
+        return recorder.results, recorder.detection_results
+    
+    def _run_pipelined(self, frame_batches, mot_tracker, recorder, ocr_cache, ocr_batch_size, ocr_recognize_only,
+                       plate_format, cascade, queue_size):
+        # decode, detect + track, OCR and result writing each run on their own thread
+        def detect_stage(batch):
+            first_frame_nmr, frames = batch
+            tracked = detect_and_track_batch(frames, self.coco_model, self.license_plate_detector, mot_tracker, cascade)
+            return [(frame_nmr, frame, track_ids, license_plates) for frame_nmr, (frame, (track_ids, license_plates))
+                    in enumerate(zip(frames, tracked), first_frame_nmr)]
+        
+        def ocr_stage(tracked_frames):
+            return read_plates_batch(tracked_frames, ocr_cache, ocr_batch_size, ocr_recognize_only, plate_format)
+        
+        def sink_stage(read_frames):
+            for frame_nmr, frame, plate_reads in read_frames:
+                recorder.record_frame(frame_nmr, frame, plate_reads)
+        
+        pipeline = Pipeline(queue_size=queue_size)
+        pipeline.add_stage('detect', detect_stage).add_stage('ocr', ocr_stage).add_stage('sink', sink_stage)
+        stats = pipeline.run(frame_batches)
+        print(format_stats(stats))
+
+# Engine shared by process_video calls in this process
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """
+    Return the engine shared by process_video calls, loading the models on first use
+    
+    Returns:
+        ANPREngine: Shared engine, or None if the models could not be loaded
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            try:
+                _engine = ANPREngine()
+            except RuntimeError as e:
+                print(f"Error creating ANPR engine: {e}")
+                return None
+        return _engine
+
+def process_video(video_path, output_path='./test.csv', user_id=None, job_id=None, save_detections=True, 
+                  alert_on_match=False, save_frames=True, frames_output_dir='./output/frames', batch_size=1,
+                  cascade=False, pipelined=False, queue_size=8, shards=1, shard_overlap=8, ocr_lock=False,
+                  ocr_recheck_interval=30, ocr_batch_size=1, ocr_recognize_only=False, output_format=None,
+                  flush_rows=500, flush_interval=5.0, plate_format=None, match_distance=0.0, event_batch_size=100,
+                  event_flush_interval=0.2, evidence_mode='frame', evidence_quality=95, evidence_max_size=None,
+                  evidence_workers=2):
+    """
+    Process a video file, detect license plates, and check against stolen vehicle database
+    
+    The models are loaded once per process and reused by later calls (see ANPREngine).
+    
+    Args:
+        video_path (str): Path to the video file
+        output_path (str): Path to save the output CSV
+        user_id (int, optional): ID of the user processing the video
+        job_id (int, optional): ID of the job processing the video
+        save_detections (bool): Whether to save detection data to CSV
+        alert_on_match (bool): Whether to print alerts when stolen vehicles are found (default: False)
+        save_frames (bool): Whether to save frames with detected stolen vehicles
+        frames_output_dir (str): Directory to save detection frames
+        batch_size (int): Number of frames run through the YOLO models per call (default: 1)
+        cascade (bool): Detect plates only inside tracked vehicle boxes (default: False)
+        pipelined (bool): Run decode, detection, OCR and result writing as concurrent stages (default: False)
+        queue_size (int): Maximum number of batches waiting in front of each pipeline stage
+        shards (int): Number of worker processes processing separate frame ranges (default: 1)
+        shard_overlap (int): Number of frames shared by consecutive shards for track stitching
+        ocr_lock (bool): Stop running OCR on tracks whose plate reads agree, filling their rows
+            from the per-track consensus (default: False)
+        ocr_recheck_interval (int): Frames between OCR re-checks of a locked track
+        ocr_batch_size (int): Maximum number of plate crops of a frame batch recognized per OCR call
+            (default: 1, every crop is read separately)
+        ocr_recognize_only (bool): Skip EasyOCR text detection on plate crops and run the recognizer
+            directly, falling back to full OCR when the result is not a valid plate (default: False)
+        output_format (str, optional): Output format, 'csv', 'jsonl', 'npz' or 'parquet' (default:
+            from the output file extension, CSV if it is not one of these)
+        flush_rows (int): Rows buffered before they are appended to the output (default: 500)
+        flush_interval (float): Seconds after which buffered rows are appended to the output (default: 5)
+        plate_format (str, optional): Plate format of the camera's region, a name in
+            plate_formats.PLATE_FORMATS (default: 'uk')
+        match_distance (float): Also report stolen plates within this OCR-confusion-weighted edit
+            distance of a read, see fuzzy_match.py (default: 0, exact matches only)
+        event_batch_size (int): Maximum number of detection events committed per database
+            transaction (default: 100)
+        event_flush_interval (float): Seconds a detection event waits for others before it is
+            committed (default: 0.2)
+        evidence_mode (str): Evidence image of a stolen vehicle, 'frame' for the annotated full
+            frame, 'vehicle' for the vehicle with some context around it or 'plate' for the plate
+            only (default: 'frame')
+        evidence_quality (int): JPEG quality of the evidence images (default: 95)
+        evidence_max_size (int, optional): Downscale evidence images to at most this many pixels
+            on their longest side (default: full resolution)
+        evidence_workers (int): Threads writing evidence images (default: 2)
+    
+    Returns:
+        list: List of detection dictionaries for stolen vehicles
+    """
+    if batch_size < 1:
+        print(f"Invalid batch size: {batch_size} (must be at least 1)")
+        return []
+    
+    if shards > 1:
+        from sharding import process_video_sharded
+        return process_video_sharded(video_path, output_path, user_id=user_id, job_id=job_id,
+                                     save_detections=save_detections, alert_on_match=alert_on_match,
+                                     save_frames=save_frames, frames_output_dir=frames_output_dir,
+                                     batch_size=batch_size, cascade=cascade, shards=shards,
+                                     shard_overlap=shard_overlap, ocr_lock=ocr_lock,
+                                     ocr_recheck_interval=ocr_recheck_interval, ocr_batch_size=ocr_batch_size,
+                                     ocr_recognize_only=ocr_recognize_only, output_format=output_format,
+                                     plate_format=plate_format, match_distance=match_distance,
+                                     evidence_mode=evidence_mode, evidence_quality=evidence_quality,
+                                     evidence_max_size=evidence_max_size, evidence_workers=evidence_workers)
+    
+    engine = get_engine()
+    if engine is None:
+        return []
+    
+    return engine.process(video_path, output_path, user_id=user_id, job_id=job_id, save_detections=save_detections,
+                          alert_on_match=alert_on_match, save_frames=save_frames,
+                          frames_output_dir=frames_output_dir, batch_size=batch_size, cascade=cascade,
+                          pipelined=pipelined, queue_size=queue_size, ocr_lock=ocr_lock,
+                          ocr_recheck_interval=ocr_recheck_interval, ocr_batch_size=ocr_batch_size,
+                          ocr_recognize_only=ocr_recognize_only, output_format=output_format,
+                          flush_rows=flush_rows, flush_interval=flush_interval, plate_format=plate_format,
+                          match_distance=match_distance, event_batch_size=event_batch_size,
+                          event_flush_interval=event_flush_interval, evidence_mode=evidence_mode,
+                          evidence_quality=evidence_quality, evidence_max_size=evidence_max_size,
+                          evidence_workers=evidence_workers)
 
 if __name__ == "__main__":
     # Parse command line arguments
     parser = argparse.ArgumentParser(description='ANPR Stolen Vehicle Detection')
     parser.add_argument('--video', type=str, default='./sample2.mp4', help='Path to input video file')
     parser.add_argument('--output', type=str, default='./test.csv', help='Path to output CSV file')
+    parser.add_argument('--output-format', type=str, choices=['csv', 'jsonl', 'npz', 'parquet'],
+                        help='Output format (default: from the output file extension)')
+    parser.add_argument('--flush-rows', type=int, default=500, help='Rows buffered before writing to the output (default: 500)')
+    parser.add_argument('--flush-interval', type=float, default=5.0, help='Seconds between output flushes (default: 5)')
     parser.add_argument('--show-alerts', action='store_true', help='Show console alerts for stolen vehicles (default: hidden)')
     parser.add_argument('--no-frames', action='store_true', help='Disable saving frames of stolen vehicles')
+    parser.add_argument('--batch-size', type=int, default=1, help='Number of frames per YOLO inference call (default: 1)')
+    parser.add_argument('--cascade', action='store_true', help='Run the plate detector on tracked vehicle crops only')
+    parser.add_argument('--pipelined', action='store_true', help='Run decode, detection, OCR and writing as concurrent stages')
+    parser.add_argument('--queue-size', type=int, default=8, help='Batches buffered between pipeline stages (default: 8)')
+    parser.add_argument('--shards', type=int, default=1, help='Split the video into frame ranges processed by this many processes')
+    parser.add_argument('--ocr-lock', action='store_true', help='Skip OCR on tracks whose plate is already known')
+    parser.add_argument('--ocr-recheck', type=int, default=30, help='Frames between OCR re-checks of a locked track (default: 30)')
+    parser.add_argument('--ocr-batch-size', type=int, default=1, help='Plate crops recognized per OCR call (default: 1)')
+    parser.add_argument('--ocr-recognize-only', action='store_true', help='Skip OCR text detection on plate crops')
+    parser.add_argument('--plate-format', type=str, default=DEFAULT_PLATE_FORMAT, choices=sorted(PLATE_FORMATS),
+                        help=f'Plate format of the camera region (default: {DEFAULT_PLATE_FORMAT})')
+    parser.add_argument('--match-distance', type=float, default=0.0,
+                        help='Match stolen plates within this edit distance of a read, OCR confusions cost 0.5; '
+                             'must be below 2 (default: 0, exact)')
+    parser.add_argument('--event-batch-size', type=int, default=100,
+                        help='Detection events committed per database transaction (default: 100)')
+    parser.add_argument('--event-flush-interval', type=float, default=0.2,
+                        help='Seconds before queued detection events are committed (default: 0.2)')
+    parser.add_argument('--evidence-mode', type=str, default='frame', choices=EVIDENCE_MODES,
+                        help='Evidence image of stolen vehicles: annotated full frame, vehicle crop or plate crop (default: frame)')
+    parser.add_argument('--evidence-quality', type=int, default=95, help='JPEG quality of evidence images (default: 95)')
+    parser.add_argument('--evidence-max-size', type=int, help='Downscale evidence images to this many pixels on their longest side')
+    parser.add_argument('--evidence-workers', type=int, default=2, help='Threads writing evidence images (default: 2)')
+    parser.add_argument('--shard-overlap', type=int, default=8, help='Frames shared by consecutive shards for track stitching (default: 8)')
     args = parser.parse_args()
+    try:
+        check_match_distance(args.match_distance)
+    except ValueError as e:
+        parser.error(str(e))
     
     # Process the video
     detection_results = process_video(
         video_path=args.video,
         output_path=args.output,
         alert_on_match=args.show_alerts,
-        save_frames=not args.no_frames
+        save_frames=not args.no_frames,
+        batch_size=args.batch_size,
+        cascade=args.cascade,
+        pipelined=args.pipelined,
+        queue_size=args.queue_size,
+        shards=args.shards,
+        shard_overlap=args.shard_overlap,
+        ocr_lock=args.ocr_lock,
+        ocr_recheck_interval=args.ocr_recheck,
+        ocr_batch_size=args.ocr_batch_size,
+        ocr_recognize_only=args.ocr_recognize_only,
+        output_format=args.output_format,
+        flush_rows=args.flush_rows,
+        flush_interval=args.flush_interval,
+        plate_format=args.plate_format,
+        match_distance=args.match_distance,
+        event_batch_size=args.event_batch_size,
+        event_flush_interval=args.event_flush_interval,
+        evidence_mode=args.evidence_mode,
+        evidence_quality=args.evidence_quality,
+        evidence_max_size=args.evidence_max_size,
+        evidence_workers=args.evidence_workers
     )
     
     # Print summary
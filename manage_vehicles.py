@@ -1,15 +1,15 @@
-import sqlite3
 import argparse
 from tabulate import tabulate as tabulate_fn
 
+from database_pool import get_connection, transaction
+from database_utils import iter_detection_pages
+
 DB_FILE = 'stolen_vehicles.db'
 
 def list_all_vehicles():
     """List all stolen vehicles in the database."""
-    conn = None
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        cursor = get_connection(DB_FILE).cursor()
         
         cursor.execute('''
         SELECT id, license_plate, make, model, year, color, description, date_reported, status
@@ -28,70 +28,55 @@ def list_all_vehicles():
             
     except Exception as e:
         print(f"Error listing vehicles: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 def add_vehicle(license_plate, make, model, year, color, description, date_reported):
     """Add a new stolen vehicle to the database."""
-    conn = None
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        # Check if license plate already exists
-        cursor.execute("SELECT id FROM stolen_vehicles WHERE license_plate = ?", (license_plate,))
-        if cursor.fetchone():
-            print(f"Vehicle with license plate '{license_plate}' already exists in the database.")
-            return False
-        
-        cursor.execute('''
-        INSERT INTO stolen_vehicles (license_plate, make, model, year, color, description, date_reported)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (license_plate, make, model, year, color, description, date_reported))
+        with transaction(DB_FILE) as conn:
+            cursor = conn.cursor()
+            
+            # Check if license plate already exists
+            cursor.execute("SELECT id FROM stolen_vehicles WHERE license_plate = ?", (license_plate,))
+            if cursor.fetchone():
+                print(f"Vehicle with license plate '{license_plate}' already exists in the database.")
+                return False
+            
+            cursor.execute('''
+            INSERT INTO stolen_vehicles (license_plate, make, model, year, color, description, date_reported)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (license_plate, make, model, year, color, description, date_reported))
         
-        conn.commit()
         print(f"Added vehicle with license plate '{license_plate}' to the database.")
         return True
     except Exception as e:
         print(f"Error adding vehicle: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
 
 def update_vehicle_status(license_plate, status):
     """Update the status of a stolen vehicle."""
-    conn = None
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT id FROM stolen_vehicles WHERE license_plate = ?", (license_plate,))
-        if not cursor.fetchone():
-            print(f"No vehicle found with license plate '{license_plate}'.")
-            return False
-        
-        cursor.execute('''
-        UPDATE stolen_vehicles SET status = ? WHERE license_plate = ?
-        ''', (status, license_plate))
+        with transaction(DB_FILE) as conn:
+            cursor = conn.cursor()
+            
+            cursor.execute("SELECT id FROM stolen_vehicles WHERE license_plate = ?", (license_plate,))
+            if not cursor.fetchone():
+                print(f"No vehicle found with license plate '{license_plate}'.")
+                return False
+            
+            cursor.execute('''
+            UPDATE stolen_vehicles SET status = ? WHERE license_plate = ?
+            ''', (status, license_plate))
         
-        conn.commit()
         print(f"Updated status of vehicle '{license_plate}' to '{status}'.")
         return True
     except Exception as e:
         print(f"Error updating vehicle status: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
 
 def search_vehicles(search_term):
     """Search for vehicles matching the given term."""
-    conn = None
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        cursor = get_connection(DB_FILE).cursor()
         
         # Search across multiple fields
         cursor.execute('''
@@ -113,40 +98,32 @@ def search_vehicles(search_term):
             
     except Exception as e:
         print(f"Error searching vehicles: {e}")
-    finally:
-        if conn:
-            conn.close()
 
-def list_detections():
-    """List all detection events."""
-    conn = None
+def list_detections(license_plate=None, start=None, end=None, job_id=None, video_path=None, page_size=100,
+                    limit=None):
+    """List detection events, newest first, printing one page at a time."""
+    headers = ['ID', 'License Plate', 'Make', 'Model', 'Frame', 'Timestamp', 
+               'Confidence', 'Match Score', 'Video Path', 'Image Path']
+    columns = ['id', 'license_plate', 'make', 'model', 'frame_number', 'timestamp',
+               'confidence', 'match_score', 'video_path', 'image_path']
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-        SELECT d.id, d.license_plate, v.make, v.model, d.frame_number, 
-               d.timestamp, d.confidence, d.video_path, d.image_path
-        FROM detections d
-        JOIN stolen_vehicles v ON d.vehicle_id = v.id
-        ORDER BY d.timestamp DESC
-        ''')
+        total = 0
+        for page in iter_detection_pages(page_size=page_size, license_plate=license_plate, start=start, end=end,
+                                         job_id=job_id, video_path=video_path):
+            if limit is not None:
+                page = page[:limit - total]
+            print(tabulate_fn([[row[column] for column in columns] for row in page], headers=headers, tablefmt='grid'))
+            total += len(page)
+            if limit is not None and total >= limit:
+                break
         
-        rows = cursor.fetchall()
-        headers = ['ID', 'License Plate', 'Make', 'Model', 'Frame', 'Timestamp', 
-                   'Confidence', 'Video Path', 'Image Path']
-        
-        if rows:
-            print(tabulate_fn(rows, headers=headers, tablefmt='grid'))
-            print(f"Total: {len(rows)} detections")
+        if total:
+            print(f"Total: {total} detections")
         else:
             print("No detection events found in the database.")
             
     except Exception as e:
         print(f"Error listing detections: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Manage stolen vehicles database')
@@ -176,7 +153,14 @@ if __name__ == "__main__":
     search_parser.add_argument('term', help='Search term')
     
     # Detections command
-    detections_parser = subparsers.add_parser('detections', help='List all detection events')
+    detections_parser = subparsers.add_parser('detections', help='List detection events, newest first')
+    detections_parser.add_argument('--license', help='Only detections of this license plate')
+    detections_parser.add_argument('--since', help='Only detections at or after this time (YYYY-MM-DD[ HH:MM:SS])')
+    detections_parser.add_argument('--until', help='Only detections before this time (YYYY-MM-DD[ HH:MM:SS])')
+    detections_parser.add_argument('--job', help='Only detections of this job ID')
+    detections_parser.add_argument('--video', help='Only detections in this video file')
+    detections_parser.add_argument('--page-size', type=int, default=100, help='Detections printed per table (default: 100)')
+    detections_parser.add_argument('--limit', type=int, help='Stop after this many detections')
     
     args = parser.parse_args()
     
@@ -190,6 +174,6 @@ if __name__ == "__main__":
     elif args.command == 'search':
         search_vehicles(args.term)
     elif args.command == 'detections':
-        list_detections()
+        list_detections(args.license, args.since, args.until, args.job, args.video, args.page_size, args.limit)
     else:
         parser.print_help() 
\ No newline at end of file
@@ -0,0 +1,257 @@
+import queue
+import threading
+import time
+
+# Marker passed down the queues once the source is exhausted
+_END = object()
+
+
+class StageStats:
+    """Item, timing and input-queue-depth counters for one pipeline stage."""
+
+    def __init__(self, name, queue_size, workers=1):
+        self.name = name
+        self.queue_size = queue_size
+        self.workers = workers
+        self.items = 0
+        self.busy_time = 0.0
+        self.starved_time = 0.0
+        self.blocked_time = 0.0
+        self.max_depth = 0
+        self._depth_total = 0
+        self._depth_samples = 0
+
+    def sample_depth(self, depth):
+        self.max_depth = max(self.max_depth, depth)
+        self._depth_total += depth
+        self._depth_samples += 1
+
+    def merge(self, other):
+        """Add the counters of another worker of the same stage."""
+        self.items += other.items
+        self.busy_time += other.busy_time
+        self.starved_time += other.starved_time
+        self.blocked_time += other.blocked_time
+        self.max_depth = max(self.max_depth, other.max_depth)
+        self._depth_total += other._depth_total
+        self._depth_samples += other._depth_samples
+
+    @property
+    def mean_depth(self):
+        return self._depth_total / self._depth_samples if self._depth_samples else 0.0
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'items': self.items,
+            'queue_size': self.queue_size,
+            'workers': self.workers,
+            'mean_depth': self.mean_depth,
+            'max_depth': self.max_depth,
+            'busy_time': self.busy_time,
+            'starved_time': self.starved_time,
+            'blocked_time': self.blocked_time
+        }
+
+
+class Pipeline:
+    """
+    Run a chain of stages, each on its own worker thread, connected by bounded queues.
+
+    The source iterable is consumed on its own thread. A stage with one worker
+    processes its items in source order; a stage with several workers processes them
+    concurrently and may finish them in any order, and the next single-worker stage
+    puts them back in source order. A full queue blocks the upstream stage, and at
+    most queue_size + workers items are held between a multi-worker stage and the
+    stage that reorders its output, which keeps memory bounded.
+    """
+
+    def __init__(self, queue_size=8):
+        """
+        Args:
+            queue_size (int): Maximum number of items waiting in front of each stage.
+        """
+        self.queue_size = queue_size
+        self._stages = []
+
+    def add_stage(self, name, func, workers=1):
+        """
+        Append a stage to the pipeline.
+
+        Args:
+            name (str): Stage name used in the statistics.
+            func (callable): Called with each input item; its return value is passed to
+                the next stage (the return value of the last stage is discarded). With
+                several workers it is called from several threads at once.
+            workers (int): Number of threads running the stage (default: 1). The stage
+                before a multi-worker stage must have a single worker.
+
+        Returns:
+            Pipeline: The pipeline itself, to allow chaining.
+
+        Raises:
+            ValueError: If this stage and the previous one both have several workers.
+        """
+        workers = max(1, int(workers))
+        if workers > 1 and self._stages and self._stages[-1][2] > 1:
+            raise ValueError(f"Stage {name} follows another multi-worker stage, merge the two stages")
+        self._stages.append((name, func, workers))
+        return self
+
+    def run(self, source, source_name='decode'):
+        """
+        Feed every item of source through the stages and wait for them to finish.
+
+        Args:
+            source (iterable): Items for the first stage, produced on their own thread.
+            source_name (str): Name of the source stage in the statistics.
+
+        Returns:
+            list: StageStats for the source followed by each stage.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self._stages]
+        stats = [StageStats(source_name, 0)] + [StageStats(name, self.queue_size, workers)
+                                                for name, _, workers in self._stages]
+        # Items that entered a multi-worker stage and were not yet started by the next stage
+        slots = [threading.Semaphore(self.queue_size + workers) if workers > 1 else None
+                 for _, _, workers in self._stages]
+        stats_lock = threading.Lock()
+        remaining_workers = [workers for _, _, workers in self._stages]
+        stop = threading.Event()
+        errors = []
+
+        def put(out_queue, item, stage_stats, slot=None):
+            start = time.perf_counter()
+            while slot is not None and not stop.is_set():
+                if slot.acquire(timeout=0.1):
+                    break
+            while not stop.is_set():
+                try:
+                    out_queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            stage_stats.blocked_time += time.perf_counter() - start
+
+        def get(in_queue, stage_stats):
+            stage_stats.sample_depth(in_queue.qsize())
+            start = time.perf_counter()
+            item = _END
+            while not stop.is_set():
+                try:
+                    item = in_queue.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    continue
+            stage_stats.starved_time += time.perf_counter() - start
+            return item
+
+        def produce():
+            source_stats = stats[0]
+            try:
+                iterator = iter(source)
+                seq = 0
+                while not stop.is_set():
+                    start = time.perf_counter()
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        break
+                    source_stats.busy_time += time.perf_counter() - start
+                    source_stats.items += 1
+                    # Items carry their source position so that ordered stages can sort them back
+                    put(queues[0], (seq, item), source_stats, slots[0])
+                    seq += 1
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                put(queues[0], _END, source_stats)
+
+        def work(index):
+            name, func, workers = self._stages[index]
+            # Each worker counts on its own, the counters are added up when it exits
+            stage_stats = StageStats(name, self.queue_size, workers)
+            in_slots = slots[index - 1] if index > 0 else None
+            last = index + 1 == len(queues)
+            out_queue = None if last else queues[index + 1]
+            out_slots = None if last else slots[index + 1]
+            # Items that arrived ahead of their turn, by source position (single worker only)
+            pending = {}
+            next_seq = 0
+
+            def process(seq, item):
+                if in_slots is not None:
+                    in_slots.release()
+                start = time.perf_counter()
+                result = func(item)
+                stage_stats.busy_time += time.perf_counter() - start
+                stage_stats.items += 1
+                if out_queue is not None:
+                    put(out_queue, (seq, result), stage_stats, out_slots)
+                elif workers > 1:
+                    slots[index].release()
+
+            try:
+                while True:
+                    item = get(queues[index], stage_stats)
+                    if item is _END:
+                        if workers > 1:
+                            # Pass the marker on to the other workers of the stage
+                            put(queues[index], _END, stage_stats)
+                        break
+                    if workers > 1:
+                        process(*item)
+                        continue
+                    pending[item[0]] = item[1]
+                    while next_seq in pending:
+                        process(next_seq, pending.pop(next_seq))
+                        next_seq += 1
+            except BaseException as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                with stats_lock:
+                    stats[index + 1].merge(stage_stats)
+                    remaining_workers[index] -= 1
+                    last_worker = remaining_workers[index] == 0
+                if out_queue is not None and last_worker:
+                    put(out_queue, _END, stage_stats)
+
+        threads = [threading.Thread(target=produce, name=f"pipeline-{source_name}", daemon=True)]
+        for index, (name, _, workers) in enumerate(self._stages):
+            for worker in range(workers):
+                thread_name = f"pipeline-{name}" if workers == 1 else f"pipeline-{name}-{worker}"
+                threads.append(threading.Thread(target=work, args=(index,), name=thread_name, daemon=True))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+        return stats
+
+
+def format_stats(stats):
+    """
+    Format pipeline statistics as a text table, one line per stage.
+
+    The stage with the highest busy time per worker is the bottleneck; stages in front
+    of it show full input queues and blocked time, stages after it show starved time.
+    The times of a multi-worker stage are summed over its workers.
+
+    Args:
+        stats (list): StageStats returned by Pipeline.run.
+
+    Returns:
+        str: Formatted table.
+    """
+    lines = ['{:<10} {:>7} {:>11} {:>9} {:>9} {:>10} {:>10}'.format(
+        'stage', 'items', 'mean depth', 'max depth', 'busy s', 'starved s', 'blocked s')]
+    for stage in stats:
+        lines.append('{:<10} {:>7} {:>11.2f} {:>9} {:>9.2f} {:>10.2f} {:>10.2f}'.format(
+            stage.name if stage.workers == 1 else f"{stage.name} x{stage.workers}", stage.items, stage.mean_depth, '{}/{}'.format(stage.max_depth, stage.queue_size),
+            stage.busy_time, stage.starved_time, stage.blocked_time))
+    return '\n'.join(lines)
@@ -0,0 +1,161 @@
+import itertools
+import re
+import string
+
+# Mapping dictionaries for character conversion
+dict_char_to_int = {'O': '0',
+                    'I': '1',
+                    'J': '3',
+                    'A': '4',
+                    'G': '6',
+                    'S': '5'}
+
+dict_int_to_char = {'0': 'O',
+                    '1': 'I',
+                    '3': 'J',
+                    '4': 'A',
+                    '6': 'G',
+                    '5': 'S'}
+
+# Layout characters: a letter, a digit, or a letter or digit kept as read
+LETTER = 'A'
+DIGIT = '0'
+ANY = '*'
+
+
+def clean_plate_text(text):
+    """Upper-case OCR text and remove its whitespace."""
+    return ''.join(text.split()).upper()
+
+
+class PlateFormat:
+    """
+    License plate layouts of one region, compiled for fast validation and normalization.
+
+    A layout is a string with one character per plate position: 'A' for a letter, '0'
+    for a digit and '*' for either. OCR often confuses letters and digits, so a letter
+    position also accepts the digits in letter_map (and a digit position the letters in
+    digit_map), which normalization converts to the character expected there.
+
+    Every layout is compiled into a regular expression with one group per run of
+    positions of the same kind and a translation table per group, so a candidate is
+    validated and normalized in a single regex match.
+    """
+
+    def __init__(self, name, layouts, letter_map=dict_int_to_char, digit_map=dict_char_to_int):
+        """
+        Args:
+            name (str): Region name.
+            layouts (list): Plate layouts, e.g. ['AA00AAA']; the first matching layout wins.
+            letter_map (dict): Digits accepted at letter positions -> letter they stand for.
+            digit_map (dict): Letters accepted at digit positions -> digit they stand for.
+        """
+        self.name = name
+        self.layouts = list(layouts)
+        self.letter_map = dict(letter_map)
+        self.digit_map = dict(digit_map)
+
+        classes = {
+            LETTER: '[' + string.ascii_uppercase + ''.join(sorted(self.letter_map)) + ']',
+            DIGIT: '[' + string.digits + ''.join(sorted(self.digit_map)) + ']',
+            ANY: '[' + string.ascii_uppercase + string.digits + ']'
+        }
+        tables = {
+            LETTER: str.maketrans(self.letter_map),
+            DIGIT: str.maketrans(self.digit_map),
+            ANY: None
+        }
+
+        # One group per run of same-kind positions, numbered across all layouts
+        alternatives = []
+        self._layout_groups = []
+        group_number = 1
+        for layout in self.layouts:
+            groups = []
+            pattern = ''
+            for kind, run in itertools.groupby(layout):
+                if kind not in classes:
+                    raise ValueError(f"Invalid character {kind!r} in plate layout {layout!r}")
+                pattern += '({}{{{}}})'.format(classes[kind], len(list(run)))
+                groups.append((group_number, tables[kind]))
+                group_number += 1
+            alternatives.append(pattern)
+            self._layout_groups.append(groups)
+
+        self._regex = re.compile('(?:' + '|'.join(alternatives) + ')')
+
+    def _normalize_match(self, match):
+        for groups in self._layout_groups:
+            if match.group(groups[0][0]) is not None:
+                return ''.join(match.group(number).translate(table) if table else match.group(number)
+                               for number, table in groups)
+        return None
+
+    def complies(self, text):
+        """Check if cleaned text matches one of the layouts."""
+        return self._regex.fullmatch(text) is not None
+
+    def normalize(self, text):
+        """
+        Validate and normalize one cleaned candidate.
+
+        Returns:
+            str: Candidate with confused characters converted, or None if it matches no layout.
+        """
+        match = self._regex.fullmatch(text)
+        return self._normalize_match(match) if match else None
+
+    def normalize_batch(self, texts):
+        """
+        Validate and normalize many cleaned candidates.
+
+        Args:
+            texts (list): Cleaned candidates (see clean_plate_text).
+
+        Returns:
+            list: Normalized text, or None, for each candidate in order.
+        """
+        normalize_match = self._normalize_match
+        return [normalize_match(match) if match else None for match in map(self._regex.fullmatch, texts)]
+
+
+# Plate formats by region name
+PLATE_FORMATS = {}
+
+DEFAULT_PLATE_FORMAT = 'uk'
+
+
+def register_plate_format(plate_format):
+    """Add a plate format to PLATE_FORMATS, replacing any format with the same name."""
+    PLATE_FORMATS[plate_format.name] = plate_format
+    return plate_format
+
+
+register_plate_format(PlateFormat('uk', ['AA00AAA']))
+register_plate_format(PlateFormat('fr', ['AA000AA']))
+register_plate_format(PlateFormat('it', ['AA000AA']))
+register_plate_format(PlateFormat('es', ['0000AAA']))
+register_plate_format(PlateFormat('nl', ['00AAA0', '0AAA00', 'AA000A', 'A000AA', 'AAA00A', 'A00AAA', '0AA000', '000AA0']))
+register_plate_format(PlateFormat('us-ca', ['0AAA000']))
+
+
+def get_plate_format(plate_format=None):
+    """
+    Resolve a plate format given by name.
+
+    Args:
+        plate_format (str or PlateFormat, optional): Region name in PLATE_FORMATS, a
+            PlateFormat, or None for the default format.
+
+    Returns:
+        PlateFormat: The plate format.
+
+    Raises:
+        ValueError: If no format is registered under the name.
+    """
+    if isinstance(plate_format, PlateFormat):
+        return plate_format
+    name = plate_format or DEFAULT_PLATE_FORMAT
+    if name not in PLATE_FORMATS:
+        raise ValueError(f"Unknown plate format: {name} (expected one of {', '.join(sorted(PLATE_FORMATS))})")
+    return PLATE_FORMATS[name]
@@ -1,6 +1,6 @@
-import sqlite3
 import os
-from database_utils import import_vehicles_from_csv
+from database_pool import remove_database, transaction
+from database_utils import import_vehicles_from_csv, initialize_database
 
 DB_FILE = 'stolen_vehicles.db'
 CSV_FILE = 'stolen_vehicles.csv'
@@ -9,49 +9,48 @@ def reset_database():
     """Reset the database by dropping and recreating tables."""
     print("Resetting the stolen vehicles database...")
     
-    # Remove old database file if it exists
-    if os.path.exists(DB_FILE):
-        os.remove(DB_FILE)
+    # Remove old database file (and its WAL files) if it exists
+    if remove_database(DB_FILE):
         print(f"Removed existing database file: {DB_FILE}")
     
-    # Create a new database connection
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+    with transaction(DB_FILE) as conn:
+        cursor = conn.cursor()
+        
+        # Create stolen_vehicles table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stolen_vehicles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            license_plate TEXT UNIQUE,
+            make TEXT,
+            model TEXT,
+            year TEXT,
+            color TEXT,
+            description TEXT,
+            date_reported TEXT,
+            status TEXT DEFAULT 'ACTIVE'
+        )
+        ''')
     
-    # Create stolen_vehicles table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS stolen_vehicles (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        license_plate TEXT UNIQUE,
-        make TEXT,
-        model TEXT,
-        year TEXT,
-        color TEXT,
-        description TEXT,
-        date_reported TEXT,
-        status TEXT DEFAULT 'ACTIVE'
-    )
-    ''')
+        # Create detections table
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS detections (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            license_plate TEXT,
+            vehicle_id INTEGER,
+            frame_number INTEGER,
+            timestamp TEXT,
+            confidence REAL,
+            video_path TEXT,
+            image_path TEXT,
+            job_id TEXT,
+            user_id TEXT,
+            FOREIGN KEY (vehicle_id) REFERENCES stolen_vehicles (id)
+        )
+        ''')
     
-    # Create detections table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS detections (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        license_plate TEXT,
-        vehicle_id INTEGER,
-        frame_number INTEGER,
-        timestamp TEXT,
-        confidence REAL,
-        video_path TEXT,
-        image_path TEXT,
-        job_id TEXT,
-        user_id TEXT,
-        FOREIGN KEY (vehicle_id) REFERENCES stolen_vehicles (id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    # The tables are fresh, so the sample vehicles must not be added before the import;
+    # this also creates the change log read by the hotlist index
+    initialize_database(add_samples=False)
     
     print("Database reset complete. Tables recreated.")
     
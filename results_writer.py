@@ -0,0 +1,204 @@
+import os
+import time
+
+from detection_log import (DETECTION_COLUMNS, concat_columns, detection_rows, format_csv_row,
+                           format_interpolated_csv_row, format_jsonl_row, log_format, make_columns, save_detections)
+
+
+class ResultsWriter:
+    """
+    Append detection results to a file as frames finish instead of at the end of the run.
+
+    Rows are buffered and written every flush_rows rows or flush_interval seconds, always
+    as whole rows, so the output of a run that crashes is readable up to its last flush.
+    Subclasses define the file header and how the values of a row are formatted.
+    """
+
+    def __init__(self, output_path, flush_rows=500, flush_interval=5.0):
+        """
+        Args:
+            output_path (str): Path of the output file (overwritten).
+            flush_rows (int): Number of buffered rows that triggers a flush.
+            flush_interval (float): Seconds after which buffered rows are flushed.
+        """
+        self.output_path = output_path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self._buffer = []
+        self._last_flush = time.monotonic()
+        self._closed = False
+
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir, exist_ok=True)
+        self._open()
+
+    def _open(self):
+        self._file = open(self.output_path, 'w')
+        header = self.format_header()
+        if header:
+            self._file.write(header)
+            self._file.flush()
+
+    def _write_rows(self, rows):
+        self._file.write(''.join(rows))
+        self._file.flush()
+
+    def _finish(self):
+        self._file.close()
+
+    def format_header(self):
+        return ''
+
+    def format_values(self, frame_nmr, car_id, car_bbox, license_plate_bbox, license_plate_bbox_score, license_number,
+                      license_number_score):
+        raise NotImplementedError
+
+    def format_row(self, frame_nmr, car_id, result):
+        return self.format_values(*_row_values(frame_nmr, car_id, result))
+
+    def write_frame(self, frame_nmr, frame_results):
+        """
+        Add the results of one frame.
+
+        Args:
+            frame_nmr (int): Frame number.
+            frame_results (dict): car_id -> {'car': ..., 'license_plate': ...} as in process_video.
+        """
+        for car_id, result in frame_results.items():
+            if 'car' in result and 'license_plate' in result and 'text' in result['license_plate']:
+                self._buffer.append(self.format_row(frame_nmr, car_id, result))
+
+        self._maybe_flush()
+
+    def write_detections(self, detections):
+        """
+        Add the rows of a detection log.
+
+        Args:
+            detections (dict): Column name -> numpy array, see detection_log.make_columns.
+        """
+        self._buffer.extend(self.format_values(*row) for row in detection_rows(detections))
+        self._maybe_flush()
+
+    def _maybe_flush(self):
+        if len(self._buffer) >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows and flush them to the operating system."""
+        if self._buffer:
+            self._write_rows(self._buffer)
+            self.rows_written += len(self._buffer)
+            self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if not self._closed:
+            self.flush()
+            self._finish()
+            self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CSVResultsWriter(ResultsWriter):
+    """CSV output in the format read by add_missing_data.py and visualize.py."""
+
+    def format_header(self):
+        return ','.join(DETECTION_COLUMNS) + '\n'
+
+    def format_values(self, *values):
+        return format_csv_row(*values)
+
+
+class InterpolatedCSVResultsWriter(CSVResultsWriter):
+    """CSV output in the format written by add_missing_data.py, see detection_log.format_interpolated_csv_row."""
+
+    def _open(self):
+        self._file = open(self.output_path, 'w', newline='')
+        self._file.write(','.join(DETECTION_COLUMNS) + '\r\n')
+        self._file.flush()
+
+    def format_values(self, *values):
+        return format_interpolated_csv_row(*values)
+
+
+class JSONLResultsWriter(ResultsWriter):
+    """One JSON object per row, with numeric bounding boxes."""
+
+    def format_values(self, *values):
+        return format_jsonl_row(*values)
+
+
+class NPZResultsWriter(ResultsWriter):
+    """
+    Columnar NPZ detection log, see detection_log.py.
+
+    Flushed rows are packed into numeric column chunks, which take far less memory than
+    the per-frame results dictionaries, and the file is written when the writer is
+    closed. Unlike the row formats, nothing is readable if the run crashes.
+    """
+
+    output_format = 'npz'
+
+    def _open(self):
+        self._chunks = []
+
+    def _write_rows(self, rows):
+        self._chunks.append(make_columns(*zip(*rows)))
+
+    def _finish(self):
+        save_detections(concat_columns(self._chunks), self.output_path, self.output_format)
+        self._chunks = []
+
+    def format_values(self, *values):
+        return values
+
+
+class ParquetResultsWriter(NPZResultsWriter):
+    """Columnar Parquet detection log; needs pyarrow."""
+
+    output_format = 'parquet'
+
+
+def _row_values(frame_nmr, car_id, result):
+    license_plate = result['license_plate']
+    return (frame_nmr, car_id, result['car']['bbox'], license_plate['bbox'], license_plate['bbox_score'],
+            license_plate['text'], license_plate['text_score'])
+
+
+# Output formats by name
+RESULTS_WRITERS = {
+    'csv': CSVResultsWriter,
+    'interpolated_csv': InterpolatedCSVResultsWriter,
+    'jsonl': JSONLResultsWriter,
+    'npz': NPZResultsWriter,
+    'parquet': ParquetResultsWriter
+}
+
+
+def open_results_writer(output_path, output_format=None, flush_rows=500, flush_interval=5.0):
+    """
+    Create a results writer for the given format.
+
+    Args:
+        output_path (str): Path of the output file.
+        output_format (str, optional): Name of a format in RESULTS_WRITERS; inferred from the
+            file extension if not given (see detection_log.LOG_FORMATS).
+        flush_rows (int): Number of buffered rows that triggers a flush.
+        flush_interval (float): Seconds after which buffered rows are flushed.
+
+    Returns:
+        ResultsWriter: Open writer; close it (or use it as a context manager) when done.
+    """
+    if output_format is None:
+        output_format = log_format(output_path)
+    if output_format not in RESULTS_WRITERS:
+        raise ValueError(f"Unknown results format: {output_format} (expected one of {', '.join(RESULTS_WRITERS)})")
+    return RESULTS_WRITERS[output_format](output_path, flush_rows, flush_interval)
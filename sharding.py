@@ -0,0 +1,312 @@
+import math
+import multiprocessing
+import os
+
+import cv2
+
+import main
+from evidence_writer import EvidenceWriter, new_run_id
+from fuzzy_match import check_match_distance
+from results_writer import open_results_writer
+from track_ocr import TrackOCRCache
+from util import bbox_iou
+
+
+def plan_shards(total_frames, num_shards, overlap=8):
+    """
+    Split a video into contiguous frame ranges, one per worker.
+
+    Every shard after the first starts reading `overlap` frames before the range it
+    owns; those frames warm up its tracker and are used to stitch its tracks to the
+    previous shard.
+
+    Args:
+        total_frames (int): Number of frames in the video.
+        num_shards (int): Requested number of shards.
+        overlap (int): Number of frames shared by consecutive shards.
+
+    Returns:
+        list: Shard dictionaries with 'index', 'start', 'end' and 'read_start'. The last
+            shard has end None and reads to the end of the video.
+    """
+    num_shards = max(1, min(num_shards, total_frames // max(1, 2 * overlap) or 1))
+    frames_per_shard = int(math.ceil(total_frames / num_shards))
+
+    shards = []
+    for index in range(num_shards):
+        start = index * frames_per_shard
+        end = None if index == num_shards - 1 else (index + 1) * frames_per_shard
+        shards.append({
+            'index': index,
+            'start': start,
+            'end': end,
+            'read_start': max(0, start - overlap)
+        })
+    return shards
+
+
+def _process_shard(shard):
+    """Worker entry point: detect, track and read plates for one frame range of the video."""
+    import torch
+    from sort.sort import Sort
+
+    torch.set_num_threads(shard['threads'])
+
+    if shard['database_ready']:
+        # The parent created the schema and sample data, see process_video_sharded
+        from database_utils import mark_database_ready
+        mark_database_ready()
+
+    models = main.load_models()
+    if models is None:
+        raise RuntimeError("Could not load detection models")
+    coco_model, license_plate_detector = models
+
+    cap = cv2.VideoCapture(shard['video_path'])
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open video file: {shard['video_path']}")
+    cap.set(cv2.CAP_PROP_POS_FRAMES, shard['read_start'])
+    fps = cap.get(cv2.CAP_PROP_FPS)
+
+    evidence_writer = None
+    if shard['save_frames']:
+        evidence_writer = EvidenceWriter(shard['frames_output_dir'], mode=shard['evidence_mode'],
+                                         jpeg_quality=shard['evidence_quality'], max_size=shard['evidence_max_size'],
+                                         workers=shard['evidence_workers'], run_id=shard['run_id'])
+    recorder = main.DetectionRecorder(shard['video_path'], fps, alert_on_match=shard['alert_on_match'],
+                                      evidence_writer=evidence_writer, record_events=False,
+                                      match_distance=shard['match_distance'])
+    mot_tracker = Sort()
+    ocr_cache = TrackOCRCache(recheck_interval=shard['ocr_recheck_interval']) if shard['ocr_lock'] else None
+    max_frames = None if shard['end'] is None else shard['end'] - shard['read_start']
+    tail_start = None if shard['end'] is None else shard['end'] - shard['overlap']
+
+    # Track boxes of the frames shared with the previous (head) and next (tail) shard
+    head_tracks = {}
+    tail_tracks = {}
+    for frame_nmr, frame, track_ids, license_plates in main.detect_and_track(
+            cap, coco_model, license_plate_detector, mot_tracker, shard['batch_size'], shard['cascade'],
+            start_frame=shard['read_start'], max_frames=max_frames):
+        if frame_nmr < shard['start']:
+            head_tracks[frame_nmr] = track_ids.tolist()
+            continue
+        if tail_start is not None and frame_nmr >= tail_start:
+            tail_tracks[frame_nmr] = track_ids.tolist()
+        recorder.record_frame(frame_nmr, frame,
+                              main.read_plates(frame, track_ids, license_plates, frame_nmr, ocr_cache,
+                                               shard['ocr_batch_size'], shard['ocr_recognize_only'],
+                                               shard['plate_format']))
+    cap.release()
+    # The parent removes duplicate evidence images, so they must be written before it merges
+    if evidence_writer is not None:
+        evidence_writer.close()
+
+    return {
+        'index': shard['index'],
+        'results': recorder.results,
+        'detection_results': recorder.detection_results,
+        'head_tracks': head_tracks,
+        'tail_tracks': tail_tracks
+    }
+
+
+def stitch_track_ids(prev_tail_tracks, head_tracks, iou_threshold=0.5):
+    """
+    Match the tracks of a shard to the tracks of the previous shard over their shared frames.
+
+    Every pair of boxes with an IoU above the threshold in a shared frame is a vote; the
+    pairs with the most votes are matched first and each track is matched at most once.
+
+    Args:
+        prev_tail_tracks (dict): Frame number -> [x1, y1, x2, y2, car_id] tracks of the previous shard.
+        head_tracks (dict): Frame number -> [x1, y1, x2, y2, car_id] tracks of the current shard.
+        iou_threshold (float): Minimum IoU for two boxes to be the same vehicle.
+
+    Returns:
+        dict: Car id of the current shard -> car id of the previous shard.
+    """
+    votes = {}
+    for frame_nmr, tracks in head_tracks.items():
+        prev_tracks = prev_tail_tracks.get(frame_nmr, [])
+        for track in tracks:
+            best_iou, best_id = iou_threshold, None
+            for prev_track in prev_tracks:
+                iou = bbox_iou(track, prev_track)
+                if iou >= best_iou:
+                    best_iou, best_id = iou, prev_track[4]
+            if best_id is not None:
+                votes[(track[4], best_id)] = votes.get((track[4], best_id), 0) + 1
+
+    mapping = {}
+    matched_prev_ids = set()
+    for (car_id, prev_id), _ in sorted(votes.items(), key=lambda item: item[1], reverse=True):
+        if car_id not in mapping and prev_id not in matched_prev_ids:
+            mapping[car_id] = prev_id
+            matched_prev_ids.add(prev_id)
+    return mapping
+
+
+def merge_shards(shard_outputs, iou_threshold=0.5):
+    """
+    Merge per-shard results into one results dictionary with consistent car ids.
+
+    Args:
+        shard_outputs (list): Worker outputs, in shard order.
+        iou_threshold (float): Minimum IoU used when stitching tracks across shards.
+
+    Returns:
+        tuple: (results, detection_results) for the whole video. Stolen vehicle
+            detections keep only the first occurrence of each stolen plate.
+    """
+    results = {}
+    detection_results = []
+    detected_license_plates = set()
+    next_id = 1.0
+    prev_output, prev_global_ids = None, {}
+
+    for output in shard_outputs:
+        local_ids = set()
+        for frame_results in output['results'].values():
+            local_ids.update(frame_results.keys())
+        for tracks in list(output['head_tracks'].values()) + list(output['tail_tracks'].values()):
+            local_ids.update(track[4] for track in tracks)
+
+        # Tracks continuing from the previous shard keep its car id, new tracks get fresh ids
+        global_ids = {}
+        if prev_output is not None:
+            stitched = stitch_track_ids(prev_output['tail_tracks'], output['head_tracks'], iou_threshold)
+            for car_id, prev_id in stitched.items():
+                if prev_id in prev_global_ids:
+                    global_ids[car_id] = prev_global_ids[prev_id]
+        for car_id in sorted(local_ids):
+            if car_id not in global_ids:
+                global_ids[car_id] = next_id
+                next_id += 1
+
+        for frame_nmr, frame_results in output['results'].items():
+            results[frame_nmr] = {global_ids[car_id]: result for car_id, result in frame_results.items()}
+
+        for detection in output['detection_results']:
+            stolen_plate = detection['vehicle']['license_plate']
+            if stolen_plate in detected_license_plates:
+                # Already reported by an earlier shard, drop the duplicate evidence image
+                if detection['image_path'] and os.path.exists(detection['image_path']):
+                    os.remove(detection['image_path'])
+                continue
+            detected_license_plates.add(stolen_plate)
+            detection_results.append(detection)
+
+        prev_output, prev_global_ids = output, global_ids
+
+    return results, detection_results
+
+
+def process_video_sharded(video_path, output_path='./test.csv', user_id=None, job_id=None, save_detections=True,
+                          alert_on_match=False, save_frames=True, frames_output_dir='./output/frames',
+                          batch_size=1, cascade=False, shards=None, shard_overlap=8, ocr_lock=False,
+                          ocr_recheck_interval=30, ocr_batch_size=1, ocr_recognize_only=False, output_format=None,
+                          plate_format=None, match_distance=0.0, evidence_mode='frame', evidence_quality=95,
+                          evidence_max_size=None, evidence_workers=2):
+    """
+    Process one video in parallel by splitting it into frame ranges handled by separate processes
+
+    Each worker seeks straight to the start of its range, loads its own models and runs
+    detection, tracking and OCR on its frames. The shards are then merged, stitching
+    tracks that cross shard boundaries by box IoU over the overlapping frames, and the
+    stolen vehicle detection events are recorded once per plate.
+
+    Args:
+        video_path (str): Path to the video file
+        output_path (str): Path to save the output CSV
+        user_id (int, optional): ID of the user processing the video
+        job_id (int, optional): ID of the job processing the video
+        save_detections (bool): Whether to save detection data to CSV
+        alert_on_match (bool): Whether to print alerts when stolen vehicles are found
+        save_frames (bool): Whether to save frames with detected stolen vehicles
+        frames_output_dir (str): Directory to save detection frames
+        batch_size (int): Number of frames run through the YOLO models per call
+        cascade (bool): Detect plates only inside tracked vehicle boxes
+        shards (int, optional): Number of worker processes (default: one per CPU core)
+        shard_overlap (int): Number of frames shared by consecutive shards for track stitching
+        ocr_lock (bool): Skip OCR on tracks whose plate reads already agree
+        ocr_recheck_interval (int): Frames between OCR re-checks of a locked track
+        ocr_batch_size (int): Maximum number of plate crops of a frame recognized per OCR call
+        ocr_recognize_only (bool): Skip OCR text detection on plate crops
+        output_format (str, optional): Output format, 'csv', 'jsonl', 'npz' or 'parquet' (default: from the file extension)
+        plate_format (str, optional): Plate format of the camera's region (default: 'uk')
+        match_distance (float): Also report stolen plates within this edit distance of a read (default: 0)
+        evidence_mode (str): Evidence image of a stolen vehicle, 'frame', 'vehicle' or 'plate' (default: 'frame')
+        evidence_quality (int): JPEG quality of the evidence images (default: 95)
+        evidence_max_size (int, optional): Longest side of the evidence images in pixels (default: full resolution)
+        evidence_workers (int): Threads writing evidence images in each worker process (default: 2)
+
+    Returns:
+        list: List of detection dictionaries for stolen vehicles
+    """
+    # Fail here rather than in every worker process
+    check_match_distance(match_distance)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        print(f"Could not open video file: {video_path}")
+        return []
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    if save_frames and not os.path.exists(frames_output_dir):
+        os.makedirs(frames_output_dir, exist_ok=True)
+
+    # Initialize the database once here, so the workers do not race to create it
+    if main.HAVE_DB_UTILS:
+        from database_utils import ensure_database
+        ensure_database()
+
+    # One run id for all shards, so the evidence images of the run share it
+    run_id = new_run_id(job_id)
+
+    cpu_count = os.cpu_count() or 1
+    plan = plan_shards(total_frames, shards or cpu_count, shard_overlap)
+    # Split the cores between the workers so torch does not oversubscribe the CPU
+    threads = max(1, cpu_count // len(plan))
+    for shard in plan:
+        shard.update({
+            'video_path': video_path,
+            'overlap': shard_overlap,
+            'threads': threads,
+            'batch_size': batch_size,
+            'cascade': cascade,
+            'ocr_lock': ocr_lock,
+            'ocr_recheck_interval': ocr_recheck_interval,
+            'ocr_batch_size': ocr_batch_size,
+            'ocr_recognize_only': ocr_recognize_only,
+            'plate_format': plate_format,
+            'match_distance': match_distance,
+            'alert_on_match': alert_on_match,
+            'save_frames': save_frames,
+            'frames_output_dir': frames_output_dir,
+            'evidence_mode': evidence_mode,
+            'evidence_quality': evidence_quality,
+            'evidence_max_size': evidence_max_size,
+            'evidence_workers': evidence_workers,
+            'database_ready': main.HAVE_DB_UTILS,
+            'run_id': run_id
+        })
+
+    print(f"Processing {total_frames} frames in {len(plan)} shards with {threads} threads each")
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(len(plan)) as pool:
+        shard_outputs = pool.map(_process_shard, plan, chunksize=1)
+
+    results, detection_results = merge_shards(shard_outputs)
+
+    # Events are recorded here rather than in the workers so that each plate is recorded once
+    recorder = main.DetectionRecorder(video_path, fps, user_id=user_id, job_id=job_id)
+    recorder.record_event_batch(detection_results)
+
+    if save_detections:
+        with open_results_writer(output_path, output_format) as results_writer:
+            for frame_nmr in sorted(results):
+                results_writer.write_frame(frame_nmr, results[frame_nmr])
+
+    return detection_results
@@ -0,0 +1,43 @@
+import os
+import sys
+import tempfile
+from contextlib import redirect_stdout
+
+from add_missing_data import process_csv
+
+# Files next to this script: the sample detection log and the output of the original
+# per-car interpolation script for it
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+INPUT_CSV = os.path.join(TEST_DIR, 'test.csv')
+BASELINE_CSV = os.path.join(TEST_DIR, 'test_interpolated_baseline.csv')
+
+def _interpolate(input_file, stream):
+    with tempfile.TemporaryDirectory() as output_dir:
+        output_file = os.path.join(output_dir, 'interpolated.csv')
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            process_csv(input_file, output_file, stream=stream)
+        with open(output_file, 'rb') as file:
+            return file.read()
+
+def test_interpolation(input_file=INPUT_CSV, baseline_file=BASELINE_CSV):
+    """
+    Check that add_missing_data.py writes the same CSV text as the original script.
+    
+    The whole-file output must match the baseline byte for byte. The --stream output is
+    in frame order, so it must have the same lines in any order.
+    """
+    with open(baseline_file, 'rb') as file:
+        baseline = file.read()
+    
+    output = _interpolate(input_file, stream=False)
+    assert output == baseline, f"Interpolated CSV text differs from {baseline_file}"
+    print(f"Interpolated CSV matches {baseline_file} ({len(baseline.splitlines()) - 1} rows)")
+    
+    streamed = _interpolate(input_file, stream=True)
+    assert sorted(streamed.splitlines()) == sorted(baseline.splitlines()), \
+        f"Streamed CSV lines differ from {baseline_file}"
+    print(f"Streamed CSV has the same lines as {baseline_file}")
+
+if __name__ == "__main__":
+    # Usage: python test_interpolation.py [input_csv baseline_csv]
+    test_interpolation(*sys.argv[1:3])
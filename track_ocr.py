@@ -0,0 +1,113 @@
+class TrackPlateState:
+    """Confidence-weighted plate reads of one tracked vehicle."""
+
+    def __init__(self):
+        self.weights = {}
+        self.counts = {}
+        self.reads = 0
+        self.last_ocr_frame = None
+        self.last_ocr_area = None
+        self.last_seen = None
+
+    def add_read(self, text, score):
+        self.reads += 1
+        if text is not None:
+            self.weights[text] = self.weights.get(text, 0.0) + score
+            self.counts[text] = self.counts.get(text, 0) + 1
+
+    def leader(self):
+        if not self.weights:
+            return None, 0.0
+        text = max(self.weights, key=self.weights.get)
+        return text, self.weights[text]
+
+
+class TrackOCRCache:
+    """
+    Per-track plate recognition state used to skip OCR on plates that are already known.
+
+    Every OCR result of a car_id is added to a confidence-weighted vote. Once enough
+    reads agree the track is locked: OCR only runs again every recheck_interval frames
+    or when the plate box area changes by more than area_change (the car moved closer
+    or further away), and the other frames are filled from the consensus.
+    """
+
+    def __init__(self, min_reads=3, lock_ratio=0.6, recheck_interval=30, area_change=1.5, max_idle=300):
+        """
+        Args:
+            min_reads (int): Minimum number of reads of the leading text before locking.
+            lock_ratio (float): Minimum share of the total read weight held by the leading text.
+            recheck_interval (int): Frames between OCR re-checks of a locked track.
+            area_change (float): Plate box area ratio (either way) that triggers a re-check.
+            max_idle (int): Frames after which the state of an unseen track is dropped.
+        """
+        self.min_reads = min_reads
+        self.lock_ratio = lock_ratio
+        self.recheck_interval = recheck_interval
+        self.area_change = area_change
+        self.max_idle = max_idle
+        self.tracks = {}
+        self.ocr_calls = 0
+        self.skipped_calls = 0
+
+    def is_locked(self, car_id):
+        state = self.tracks.get(car_id)
+        if state is None:
+            return False
+        text, weight = state.leader()
+        total = sum(state.weights.values())
+        return text is not None and state.counts[text] >= self.min_reads and weight >= self.lock_ratio * total
+
+    def consensus(self, car_id):
+        """
+        Return the consensus text of a track and the mean confidence of the reads supporting it.
+
+        Returns:
+            tuple: (text, score), or (None, None) if the track has no valid read yet.
+        """
+        state = self.tracks.get(car_id)
+        if state is None:
+            return None, None
+        text, weight = state.leader()
+        if text is None:
+            return None, None
+        return text, weight / state.counts[text]
+
+    def should_read(self, car_id, frame_nmr, plate_bbox):
+        """Return True if OCR has to run for this plate, False if the consensus can be used."""
+        state = self.tracks.setdefault(car_id, TrackPlateState())
+        state.last_seen = frame_nmr
+        if not self.is_locked(car_id):
+            return True
+
+        if frame_nmr - state.last_ocr_frame >= self.recheck_interval:
+            return True
+        area = _bbox_area(plate_bbox)
+        if state.last_ocr_area and area > 0:
+            ratio = area / state.last_ocr_area
+            if ratio >= self.area_change or ratio <= 1.0 / self.area_change:
+                return True
+
+        self.skipped_calls += 1
+        return False
+
+    def add_read(self, car_id, frame_nmr, plate_bbox, text, score):
+        """Add an OCR result of a track to its consensus."""
+        state = self.tracks.setdefault(car_id, TrackPlateState())
+        state.add_read(text, score)
+        state.last_ocr_frame = frame_nmr
+        state.last_ocr_area = _bbox_area(plate_bbox)
+        state.last_seen = frame_nmr
+        self.ocr_calls += 1
+
+    def forget_inactive(self, frame_nmr):
+        """Drop the state of tracks that have not been seen for max_idle frames."""
+        expired = [car_id for car_id, state in self.tracks.items()
+                   if state.last_seen is not None and frame_nmr - state.last_seen > self.max_idle]
+        for car_id in expired:
+            del self.tracks[car_id]
+
+
+def _bbox_area(bbox):
+    x1, y1, x2, y2 = bbox[:4]
+    return max(0.0, x2 - x1) * max(0.0, y2 - y1)
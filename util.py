@@ -1,23 +1,33 @@
-import string
-import easyocr
+import threading
+import cv2
+import numpy as np
 
-# Initialize the OCR reader
-reader = easyocr.Reader(['en'], gpu=False)
+# dict_char_to_int and dict_int_to_char now live in plate_formats.py and are kept importable from here
+from plate_formats import clean_plate_text, dict_char_to_int, dict_int_to_char, get_plate_format
+from results_writer import CSVResultsWriter
 
-# Mapping dictionaries for character conversion
-dict_char_to_int = {'O': '0',
-                    'I': '1',
-                    'J': '3',
-                    'A': '4',
-                    'G': '6',
-                    'S': '5'}
+# OCR reader, created on first use by get_reader (loading it imports torch and the model weights)
+_reader = None
+_reader_lock = threading.Lock()
 
-dict_int_to_char = {'0': 'O',
-                    '1': 'I',
-                    '3': 'J',
-                    '4': 'A',
-                    '6': 'G',
-                    '5': 'S'}
+# Fraction of a plate crop trimmed on each side for the borderless candidate text box
+PLATE_BORDER_INSET = 0.08
+
+
+def get_reader():
+    """
+    Return the shared EasyOCR reader, creating it on first use.
+
+    Returns:
+        easyocr.Reader: English OCR reader running on the CPU.
+    """
+    global _reader
+    if _reader is None:
+        with _reader_lock:
+            if _reader is None:
+                import easyocr
+                _reader = easyocr.Reader(['en'], gpu=False)
+    return _reader
 
 
 def write_csv(results, output_path):
@@ -28,130 +38,327 @@ def write_csv(results, output_path):
         results (dict): Dictionary containing the results.
         output_path (str): Path to the output CSV file.
     """
-    with open(output_path, 'w') as f:
-        f.write('{},{},{},{},{},{},{}\n'.format('frame_nmr', 'car_id', 'car_bbox',
-                                                'license_plate_bbox', 'license_plate_bbox_score', 'license_number',
-                                                'license_number_score'))
-
+    with CSVResultsWriter(output_path) as writer:
         for frame_nmr in results.keys():
-            for car_id in results[frame_nmr].keys():
-                print(results[frame_nmr][car_id])
-                if 'car' in results[frame_nmr][car_id].keys() and \
-                   'license_plate' in results[frame_nmr][car_id].keys() and \
-                   'text' in results[frame_nmr][car_id]['license_plate'].keys():
-                    f.write('{},{},{},{},{},{},{}\n'.format(frame_nmr,
-                                                            car_id,
-                                                            '[{} {} {} {}]'.format(
-                                                                results[frame_nmr][car_id]['car']['bbox'][0],
-                                                                results[frame_nmr][car_id]['car']['bbox'][1],
-                                                                results[frame_nmr][car_id]['car']['bbox'][2],
-                                                                results[frame_nmr][car_id]['car']['bbox'][3]),
-                                                            '[{} {} {} {}]'.format(
-                                                                results[frame_nmr][car_id]['license_plate']['bbox'][0],
-                                                                results[frame_nmr][car_id]['license_plate']['bbox'][1],
-                                                                results[frame_nmr][car_id]['license_plate']['bbox'][2],
-                                                                results[frame_nmr][car_id]['license_plate']['bbox'][3]),
-                                                            results[frame_nmr][car_id]['license_plate']['bbox_score'],
-                                                            results[frame_nmr][car_id]['license_plate']['text'],
-                                                            results[frame_nmr][car_id]['license_plate']['text_score'])
-                            )
-        f.close()
-
-
-def license_complies_format(text):
+            writer.write_frame(frame_nmr, results[frame_nmr])
+
+
+def license_complies_format(text, plate_format=None):
     """
     Check if the license plate text complies with the required format.
 
     Args:
         text (str): License plate text.
+        plate_format (str or PlateFormat, optional): Plate format, see plate_formats.py (default: UK).
 
     Returns:
         bool: True if the license plate complies with the format, False otherwise.
     """
-    if len(text) != 7:
-        return False
-
-    if (text[0] in string.ascii_uppercase or text[0] in dict_int_to_char.keys()) and \
-       (text[1] in string.ascii_uppercase or text[1] in dict_int_to_char.keys()) and \
-       (text[2] in ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9'] or text[2] in dict_char_to_int.keys()) and \
-       (text[3] in ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9'] or text[3] in dict_char_to_int.keys()) and \
-       (text[4] in string.ascii_uppercase or text[4] in dict_int_to_char.keys()) and \
-       (text[5] in string.ascii_uppercase or text[5] in dict_int_to_char.keys()) and \
-       (text[6] in string.ascii_uppercase or text[6] in dict_int_to_char.keys()):
-        return True
-    else:
-        return False
+    return get_plate_format(plate_format).complies(text)
 
 
-def format_license(text):
+def format_license(text, plate_format=None):
     """
     Format the license plate text by converting characters using the mapping dictionaries.
 
     Args:
         text (str): License plate text.
+        plate_format (str or PlateFormat, optional): Plate format, see plate_formats.py (default: UK).
+
+    Returns:
+        str: Formatted license plate text, or None if it does not comply with the format.
+    """
+    return get_plate_format(plate_format).normalize(text)
+
+
+def parse_ocr_detections(detections, plate_format=None):
+    """
+    Pick the first OCR detection that complies with the license plate format.
+
+    Args:
+        detections (list): EasyOCR (bbox, text, score) detections.
+        plate_format (str or PlateFormat, optional): Plate format, see plate_formats.py (default: UK).
+
+    Returns:
+        tuple: Tuple containing the formatted license plate text and its confidence score.
+    """
+    return parse_ocr_detections_batch([detections], plate_format)[0]
+
+
+def parse_ocr_detections_batch(detections_list, plate_format=None):
+    """
+    Pick the first complying OCR detection of several crops, validating all texts at once.
+
+    Args:
+        detections_list (list): EasyOCR (bbox, text, score) detections of each crop.
+        plate_format (str or PlateFormat, optional): Plate format, see plate_formats.py (default: UK).
+
+    Returns:
+        list: (text, score) tuples in the order of the crops, (None, None) for unreadable plates.
+    """
+    texts = [clean_plate_text(text) for detections in detections_list for _, text, _ in detections]
+    normalized = iter(get_plate_format(plate_format).normalize_batch(texts))
+
+    plates = []
+    for detections in detections_list:
+        plate = (None, None)
+        for (_, _, score), text in zip(detections, normalized):
+            if text is not None and plate[0] is None:
+                plate = (text, score)
+        plates.append(plate)
+    return plates
+
+
+def threshold_license_plate_crop(license_plate_crop):
+    """
+    Convert a BGR license plate crop to the binary image passed to the OCR reader.
+
+    Args:
+        license_plate_crop (numpy.ndarray): BGR crop of the license plate.
+
+    Returns:
+        numpy.ndarray: Thresholded grayscale crop with light text on a dark background.
+    """
+    license_plate_crop_gray = cv2.cvtColor(license_plate_crop, cv2.COLOR_BGR2GRAY)
+    _, license_plate_crop_thresh = cv2.threshold(license_plate_crop_gray, 64, 255, cv2.THRESH_BINARY_INV)
+    return license_plate_crop_thresh
+
+
+def plate_text_boxes(width, height, y_offset=0):
+    """
+    Candidate text regions of a license plate crop for recognition without text detection.
+
+    The whole crop comes first, followed by the crop without its outer border, where the
+    plate frame and screws often sit.
+
+    Args:
+        width (int): Crop width.
+        height (int): Crop height.
+        y_offset (int): Vertical position of the crop in the image passed to the recognizer.
 
     Returns:
-        str: Formatted license plate text.
+        list: [x_min, x_max, y_min, y_max] boxes in EasyOCR horizontal_list format.
     """
-    license_plate_ = ''
-    mapping = {0: dict_int_to_char, 1: dict_int_to_char, 4: dict_int_to_char, 5: dict_int_to_char, 6: dict_int_to_char,
-               2: dict_char_to_int, 3: dict_char_to_int}
-    for j in [0, 1, 2, 3, 4, 5, 6]:
-        if text[j] in mapping[j].keys():
-            license_plate_ += mapping[j][text[j]]
-        else:
-            license_plate_ += text[j]
+    inset_x = int(width * PLATE_BORDER_INSET)
+    inset_y = int(height * PLATE_BORDER_INSET)
+    return [[0, width, y_offset, y_offset + height],
+            [inset_x, width - inset_x, y_offset + inset_y, y_offset + height - inset_y]]
 
-    return license_plate_
 
+def recognize_license_plate(license_plate_crop, plate_format=None):
+    """
+    Read the license plate text with the recognizer only, treating the crop as the text region.
 
-def read_license_plate(license_plate_crop):
+    Args:
+        license_plate_crop (numpy.ndarray): Thresholded grayscale license plate crop.
+        plate_format (str or PlateFormat, optional): Plate format, see plate_formats.py (default: UK).
+
+    Returns:
+        tuple: Tuple containing the formatted license plate text and its confidence score.
+    """
+    height, width = license_plate_crop.shape[:2]
+    boxes = plate_text_boxes(width, height)
+    detections = get_reader().recognize(license_plate_crop, horizontal_list=boxes, free_list=[], batch_size=len(boxes))
+
+    return parse_ocr_detections(detections, plate_format)
+
+
+def read_license_plate(license_plate_crop, recognize_only=False, plate_format=None):
     """
     Read the license plate text from the given cropped image.
 
     Args:
         license_plate_crop (PIL.Image.Image): Cropped image containing the license plate.
+        recognize_only (bool): Skip text detection and run the recognizer on the whole crop,
+            falling back to the full readtext path if the result does not match the plate format.
+        plate_format (str or PlateFormat, optional): Plate format, see plate_formats.py (default: UK).
 
     Returns:
         tuple: Tuple containing the formatted license plate text and its confidence score.
     """
+    if recognize_only:
+        text, score = recognize_license_plate(license_plate_crop, plate_format)
+        if text is not None:
+            return text, score
+
+    detections = get_reader().readtext(license_plate_crop)
+
+    return parse_ocr_detections(detections, plate_format)
+
+
+def read_license_plates(license_plate_crops, batch_size=8, recognize_only=False, plate_format=None):
+    """
+    Read the text of several license plate crops with batched OCR calls.
+
+    With readtext, crops are padded with background to a common size and read up to
+    batch_size at a time. With recognize_only, up to batch_size crops are stacked into
+    one image, each at its own y offset, and the candidate text boxes of all of them go
+    through one recognize() call, which runs them through the recognizer network as a
+    single batch; crops whose result does not match the plate format are read again with
+    readtext.
+    A batch_size of 1 reads every crop separately with read_license_plate.
+
+    Args:
+        license_plate_crops (list): Thresholded grayscale license plate crops.
+        batch_size (int): Maximum number of crops per OCR call.
+        recognize_only (bool): Skip text detection, see read_license_plate.
+        plate_format (str or PlateFormat, optional): Plate format, see plate_formats.py (default: UK).
+
+    Returns:
+        list: (text, score) tuples in the order of the crops, (None, None) for unreadable plates.
+    """
+    if batch_size <= 1:
+        return [read_license_plate(crop, recognize_only, plate_format) for crop in license_plate_crops]
 
-    detections = reader.readtext(license_plate_crop)
+    plates = []
+    for start in range(0, len(license_plate_crops), batch_size):
+        crops = license_plate_crops[start:start + batch_size]
+        if len(crops) == 1:
+            plates.append(read_license_plate(crops[0], recognize_only, plate_format))
+            continue
 
+        if recognize_only:
+            plates.extend(_recognize_stacked(crops, plate_format))
+            continue
+
+        height = max(crop.shape[0] for crop in crops)
+        width = max(crop.shape[1] for crop in crops)
+        padded = [np.pad(crop, ((0, height - crop.shape[0]), (0, width - crop.shape[1])) + ((0, 0),) * (crop.ndim - 2))
+                  for crop in crops]
+
+        plates.extend(parse_ocr_detections_batch(get_reader().readtext_batched(padded, batch_size=len(padded)),
+                                                 plate_format))
+
+    return plates
+
+
+def _recognize_stacked(crops, plate_format=None):
+    width = max(crop.shape[1] for crop in crops)
+    offsets = np.cumsum([0] + [crop.shape[0] for crop in crops])
+    stacked = np.vstack([np.pad(crop, ((0, 0), (0, width - crop.shape[1]))) for crop in crops])
+
+    boxes = []
+    for crop, y_offset in zip(crops, offsets):
+        boxes.extend(plate_text_boxes(crop.shape[1], crop.shape[0], int(y_offset)))
+    detections = get_reader().recognize(stacked, horizontal_list=boxes, free_list=[], batch_size=len(boxes))
+
+    # Map every recognized box back to the crop it was cut from
+    crop_detections = [[] for _ in crops]
     for detection in detections:
-        bbox, text, score = detection
+        y_min = min(point[1] for point in detection[0])
+        crop_indx = int(np.searchsorted(offsets, y_min, side='right')) - 1
+        crop_detections[crop_indx].append(detection)
 
-        text = text.upper().replace(' ', '')
+    plates = []
+    for crop, (text, score) in zip(crops, parse_ocr_detections_batch(crop_detections, plate_format)):
+        if text is None:
+            text, score = parse_ocr_detections(get_reader().readtext(crop), plate_format)
+        plates.append((text, score))
+    return plates
 
-        if license_complies_format(text):
-            return format_license(text), score
 
-    return None, None
+def bbox_iou(bbox_a, bbox_b):
+    """
+    Compute the intersection over union of two bounding boxes.
 
+    Args:
+        bbox_a (list): Coordinates (x1, y1, x2, y2) of the first box.
+        bbox_b (list): Coordinates (x1, y1, x2, y2) of the second box.
 
-def get_car(license_plate, vehicle_track_ids):
+    Returns:
+        float: Intersection over union, between 0 and 1.
     """
-    Retrieve the vehicle coordinates and ID based on the license plate coordinates.
+    xa1, ya1, xa2, ya2 = bbox_a[:4]
+    xb1, yb1, xb2, yb2 = bbox_b[:4]
+
+    inter_w = min(xa2, xb2) - max(xa1, xb1)
+    inter_h = min(ya2, yb2) - max(ya1, yb1)
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+
+    intersection = inter_w * inter_h
+    union = (xa2 - xa1) * (ya2 - ya1) + (xb2 - xb1) * (yb2 - yb1) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def bbox_iou_matrix(boxes_a, boxes_b):
+    """
+    Compute the intersection over union of every pair of boxes of two sets.
 
     Args:
-        license_plate (tuple): Tuple containing the coordinates of the license plate (x1, y1, x2, y2, score, class_id).
-        vehicle_track_ids (list): List of vehicle track IDs and their corresponding coordinates.
+        boxes_a (numpy.ndarray): (N, 4+) array with (x1, y1, x2, y2) in the first columns.
+        boxes_b (numpy.ndarray): (M, 4+) array with (x1, y1, x2, y2) in the first columns.
 
     Returns:
-        tuple: Tuple containing the vehicle coordinates (x1, y1, x2, y2) and ID.
+        numpy.ndarray: (N, M) array of IoU values, between 0 and 1.
     """
-    x1, y1, x2, y2, score, class_id = license_plate
+    a = boxes_a[:, None, :4]
+    b = boxes_b[None, :, :4]
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = inter_w * inter_h
+    union = ((a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1]) +
+             (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1]) - intersection)
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
 
-    foundIt = False
-    for j in range(len(vehicle_track_ids)):
-        xcar1, ycar1, xcar2, ycar2, car_id = vehicle_track_ids[j]
 
-        if x1 > xcar1 and y1 > ycar1 and x2 < xcar2 and y2 < ycar2:
-            car_indx = j
-            foundIt = True
-            break
+def assign_plates_to_cars(license_plates, vehicle_track_ids):
+    """
+    Assign each license plate of a frame to the vehicle that best contains it.
 
-    if foundIt:
-        return vehicle_track_ids[car_indx]
+    A plate can only go to a vehicle whose box strictly contains it. Among those, the
+    plates and vehicles are matched one to one so that the total IoU is maximal, which
+    gives each plate the tightest fitting vehicle and never gives two plates one car.
+
+    Args:
+        license_plates (list): License plate detections (x1, y1, x2, y2, score, class_id).
+        vehicle_track_ids (numpy.ndarray): Vehicle tracks (x1, y1, x2, y2, car_id).
+
+    Returns:
+        list: For each license plate, the (x1, y1, x2, y2, car_id) of its vehicle, or
+            (-1, -1, -1, -1, -1) if it has none.
+    """
+    assignments = [(-1, -1, -1, -1, -1)] * len(license_plates)
+    if len(license_plates) == 0 or len(vehicle_track_ids) == 0:
+        return assignments
+
+    plates = np.asarray(license_plates, dtype=np.float64).reshape(len(license_plates), -1)
+    tracks = np.asarray(vehicle_track_ids, dtype=np.float64).reshape(len(vehicle_track_ids), -1)
+
+    p = plates[:, None, :4]
+    t = tracks[None, :, :4]
+    contained = (p[..., 0] > t[..., 0]) & (p[..., 1] > t[..., 1]) & (p[..., 2] < t[..., 2]) & (p[..., 3] < t[..., 3])
+    plate_rows = np.flatnonzero(contained.any(axis=1))
+    if len(plate_rows) == 0:
+        return assignments
+
+    # Contained pairs score their IoU (the plate to car area ratio), all others score -1
+    scores = np.where(contained, bbox_iou_matrix(plates, tracks), -1.0)[plate_rows]
+    if len(plate_rows) == 1:
+        # A single plate simply takes its best vehicle
+        matches = [(0, int(np.argmax(scores[0])))]
+    else:
+        # scipy is imported here so that importing util stays cheap
+        from scipy.optimize import linear_sum_assignment
+        matches = zip(*linear_sum_assignment(scores, maximize=True))
 
-    return -1, -1, -1, -1, -1
+    for row, track_row in matches:
+        if scores[row, track_row] >= 0:
+            assignments[plate_rows[row]] = vehicle_track_ids[track_row]
+    return assignments
+
+
+def get_car(license_plate, vehicle_track_ids):
+    """
+    Retrieve the vehicle coordinates and ID based on the license plate coordinates.
+
+    Args:
+        license_plate (tuple): Tuple containing the coordinates of the license plate (x1, y1, x2, y2, score, class_id).
+        vehicle_track_ids (list): List of vehicle track IDs and their corresponding coordinates.
+
+    Returns:
+        tuple: Tuple containing the vehicle coordinates (x1, y1, x2, y2) and ID, of the
+            tightest vehicle containing the plate. Use assign_plates_to_cars for all plates
+            of a frame at once.
+    """
+    return assign_plates_to_cars([license_plate], vehicle_track_ids)[0]
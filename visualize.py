@@ -1,11 +1,11 @@
-import ast
-
 import cv2
 import numpy as np
-import pandas as pd
 import argparse
 import os
 
+from detection_log import load_detections
+from pipeline import Pipeline, format_stats
+
 # Import database utilities for stolen vehicle checking
 try:
     from database_utils import check_license_plate_in_database
@@ -34,20 +34,269 @@ def draw_border(img, top_left, bottom_right, color=(0, 255, 0), thickness=10, li
     return img
 
 
+# Layout of the plate thumbnail and text drawn above each car, in pixels
+THUMBNAIL_HEIGHT = 200
+VERTICAL_PADDING = 50
+TEXT_BACKGROUND_HEIGHT = 130
+FONT_SCALE = 2.0
+FONT_THICKNESS = 6
+
+
+def best_plate_rows(detections):
+    """
+    Return the row of each car with its highest plate score (the first one on ties).
+
+    Args:
+        detections (dict): Detection log columns, see detection_log.make_columns.
+
+    Returns:
+        dict: car_id -> row index.
+    """
+    car_ids = detections['car_id'].astype(int)
+    rows = np.arange(len(car_ids))
+    order = np.lexsort((rows, -detections['license_number_score'], car_ids))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = car_ids[order][1:] != car_ids[order][:-1]
+    best = order[first]
+    return dict(zip(car_ids[best].tolist(), best.tolist()))
+
+
+def license_plate_thumbnail(frame, license_plate_bbox):
+    """Cut a license plate out of a frame, resized to THUMBNAIL_HEIGHT pixels high."""
+    x1, y1, x2, y2 = license_plate_bbox
+    license_crop = frame[int(y1):int(y2), int(x1):int(x2), :]
+    return cv2.resize(license_crop, (int((x2 - x1) * THUMBNAIL_HEIGHT / (y2 - y1)), THUMBNAIL_HEIGHT))
+
+
+def harvest_plate_thumbnails(cap, detections, best_rows):
+    """
+    Cut the plate thumbnail of each car out of its best frame, in one forward pass over the video.
+
+    The frames are visited in order from the start: frames nobody needs are skipped with
+    grab(), which does not convert them to images, and the pass stops after the last
+    needed frame. Unlike a seek per car, no frame is decoded twice.
+
+    Args:
+        cap (cv2.VideoCapture): Opened video, rewound to its first frame.
+        detections (dict): Detection log columns, see detection_log.make_columns.
+        best_rows (dict): car_id -> row of the plate to cut out, see best_plate_rows.
+
+    Returns:
+        dict: car_id -> thumbnail image, see license_plate_thumbnail.
+
+    Raises:
+        ValueError: If the video ends before a needed frame.
+    """
+    cars_by_frame = {}
+    for car_id, row in best_rows.items():
+        cars_by_frame.setdefault(int(detections['frame_nmr'][row]), []).append((car_id, row))
+
+    thumbnails = {}
+    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+    frame_nmr = 0
+    for target_frame in sorted(cars_by_frame):
+        while frame_nmr < target_frame and cap.grab():
+            frame_nmr += 1
+        ret, frame = cap.read() if frame_nmr == target_frame else (False, None)
+        if not ret:
+            raise ValueError(f"Could not read frame {target_frame} of the video")
+        frame_nmr += 1
+        for car_id, row in cars_by_frame[target_frame]:
+            thumbnails[car_id] = license_plate_thumbnail(frame, detections['license_plate_bbox'][row])
+    return thumbnails
+
+
+class FrameOverlays:
+    """
+    Overlay data of a detection log, parsed once and grouped by frame.
+
+    The rows are sorted by frame and every coordinate used for drawing is converted to
+    an integer up front, including the position of each car's plate thumbnail and text.
+    The rows of a frame are a slice found in an offset table, so looking up a frame
+    takes constant time however long the log is.
+    """
+
+    def __init__(self, detections, license_plate):
+        """
+        Args:
+            detections (dict): Detection log columns, see detection_log.make_columns.
+            license_plate (dict): car_id -> {'license_crop': thumbnail image,
+                'license_plate_number': text} for every car of the log.
+        """
+        order = np.argsort(detections['frame_nmr'], kind='stable')
+        self.frame_nmrs = frame_nmrs = detections['frame_nmr'][order].astype(np.int64)
+        self.car_ids = detections['car_id'][order].astype(int)
+        car_bboxes = detections['car_bbox'][order]
+        self.car_bboxes = car_bboxes.astype(int)
+        self.license_plate_bboxes = detections['license_plate_bbox'][order].astype(int)
+
+        # Offset table: the rows of frame f are offsets[f - first_frame]:offsets[f - first_frame + 1]
+        self.first_frame = int(frame_nmrs[0]) if len(frame_nmrs) else 0
+        last_frame = int(frame_nmrs[-1]) if len(frame_nmrs) else -1
+        self.offsets = np.searchsorted(frame_nmrs, np.arange(self.first_frame, last_frame + 2))
+
+        # Thumbnail width and text size of each car, the thumbnail and text are centred over the car box
+        cars, car_index = np.unique(self.car_ids, return_inverse=True)
+        thumbnail_widths = np.zeros(len(cars))
+        text_widths = np.zeros(len(cars))
+        self.text_heights = {}
+        for i, car_id in enumerate(cars.tolist()):
+            (text_width, text_height), _ = cv2.getTextSize(license_plate[car_id]['license_plate_number'],
+                                                           cv2.FONT_HERSHEY_SIMPLEX, FONT_SCALE, FONT_THICKNESS)
+            thumbnail_widths[i] = license_plate[car_id]['license_crop'].shape[1]
+            text_widths[i] = text_width
+            self.text_heights[car_id] = text_height
+        centres = car_bboxes[:, 0] + car_bboxes[:, 2]
+        self.thumbnail_x1 = ((centres - thumbnail_widths[car_index]) / 2).astype(int)
+        self.thumbnail_x2 = ((centres + thumbnail_widths[car_index]) / 2).astype(int)
+        self.text_x = ((centres - text_widths[car_index]) / 2).astype(int)
+
+    def rows(self, frame_nmr):
+        """Return the slice of the rows of a frame."""
+        index = frame_nmr - self.first_frame
+        if index < 0 or index >= len(self.offsets) - 1:
+            return slice(0, 0)
+        return slice(self.offsets[index], self.offsets[index + 1])
+
+
+def draw_overlays(frame, overlays, rows, license_plate, stolen_vehicles):
+    """
+    Draw the car and plate boxes, plate thumbnails and plate texts of some rows on a frame.
+
+    Args:
+        frame (numpy.ndarray): Frame drawn on in place.
+        overlays (FrameOverlays): Overlay data of the log.
+        rows (slice or array): Rows of the frame, see FrameOverlays.rows.
+        license_plate (dict): car_id -> thumbnail and text, see FrameOverlays.
+        stolen_vehicles (dict): car_id -> vehicle information of the stolen cars.
+
+    Returns:
+        numpy.ndarray: The frame.
+    """
+    car_ids = overlays.car_ids[rows].tolist()
+    car_bboxes = overlays.car_bboxes[rows].tolist()
+    license_plate_bboxes = overlays.license_plate_bboxes[rows].tolist()
+    thumbnail_x1 = overlays.thumbnail_x1[rows].tolist()
+    thumbnail_x2 = overlays.thumbnail_x2[rows].tolist()
+    text_x = overlays.text_x[rows].tolist()
+    for i, car_id in enumerate(car_ids):
+        # Check if this car is a stolen vehicle
+        is_stolen = car_id in stolen_vehicles
+
+        # Set colors based on whether the vehicle is stolen
+        border_color = (0, 0, 255) if is_stolen else (0, 255, 0)  # Red for stolen, Green for normal
+        rect_color = (0, 0, 255) if is_stolen else (0, 0, 255)    # Red for stolen plate, Blue for normal
+
+        # draw car boundary (use original thickness parameters)
+        car_x1, car_y1, car_x2, car_y2 = car_bboxes[i]
+        draw_border(frame, (car_x1, car_y1), (car_x2, car_y2), border_color, 10,
+                    line_length_x=200, line_length_y=200)
+
+        # draw license plate (use original thickness)
+        x1, y1, x2, y2 = license_plate_bboxes[i]
+        cv2.rectangle(frame, (x1, y1), (x2, y2), rect_color, 12)
+
+        # crop license plate
+        license_crop = license_plate[car_id]['license_crop']
+
+        H, W, _ = license_crop.shape
+
+        try:
+            # Place license plate image above car with reduced spacing
+            thumbnail_y2 = car_y1 - VERTICAL_PADDING
+            frame[thumbnail_y2 - H:thumbnail_y2, thumbnail_x1[i]:thumbnail_x2[i], :] = license_crop
+
+            # Background color for license text - light red for stolen, white for normal
+            bg_color = (220, 220, 255) if is_stolen else (255, 255, 255)
+            # Place text background above the thumbnail
+            frame[thumbnail_y2 - H - TEXT_BACKGROUND_HEIGHT:thumbnail_y2 - H,
+                  thumbnail_x1[i]:thumbnail_x2[i], :] = bg_color
+
+            # Text color - black for all text, centred in the background
+            text_y_position = (thumbnail_y2 - H - TEXT_BACKGROUND_HEIGHT // 2
+                               + overlays.text_heights[car_id] // 2)
+            cv2.putText(frame,
+                        license_plate[car_id]['license_plate_number'],
+                        (text_x[i], text_y_position),
+                        cv2.FONT_HERSHEY_SIMPLEX,
+                        FONT_SCALE,
+                        (0, 0, 0),
+                        FONT_THICKNESS)
+
+            # Add "STOLEN" label for stolen vehicles (with small font size)
+            if is_stolen:
+                cv2.putText(frame,
+                            "STOLEN",
+                            (car_x1, car_y1 - 10),
+                            cv2.FONT_HERSHEY_SIMPLEX,
+                            1.0,  # Smaller font size
+                            (0, 0, 255),  # Red
+                            2)  # Thinner text
+
+        except:
+            pass
+
+    return frame
+
+
+def print_stolen_alert(frame_nmr, car_id, license_text, vehicle_info, fps):
+    # Calculate timestamp within the video
+    frame_timestamp = frame_nmr / fps if fps > 0 else 0
+    hours, remainder = divmod(frame_timestamp, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    timecode = f"{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}"
+
+    # Print alert
+    print(f"\n⚠️ STOLEN VEHICLE DETECTED ⚠️")
+    print(f"Frame #{frame_nmr}, Vehicle #{car_id}, Timecode: {timecode}")
+    print(f"License: {license_text}")
+    print(f"Vehicle Info: {vehicle_info.get('year', 'N/A')} " +
+          f"{vehicle_info.get('make', 'N/A')} " +
+          f"{vehicle_info.get('model', 'N/A')} " +
+          f"({vehicle_info.get('color', 'N/A')})")
+    print(f"Description: {vehicle_info.get('description', 'N/A')}")
+    print("-" * 50)
+
+
+def read_frames(cap):
+    """Yield (frame_nmr, frame) for the remaining frames of an opened video."""
+    frame_nmr = 0
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            return
+        yield frame_nmr, frame
+        frame_nmr += 1
+
+
+def default_render_workers():
+    """Number of overlay drawing threads, leaving a core each to decoding and encoding."""
+    return max(1, (os.cpu_count() or 1) - 2)
+
+
 def visualize(input_csv='./output/test_interpolated.csv', video_path='sample2.mp4', output_path='./out.mp4', 
-              display_preview=False, save_video=True, check_stolen=True):
+              display_preview=False, save_video=True, check_stolen=True, render_workers=None,
+              show_stats=False):
     """
     Visualize license plate detection results
     
+    Unless render_workers is 0 or the preview is shown, the frames are decoded, drawn and
+    encoded concurrently: a decoder thread feeds a pool of drawing threads, which may
+    finish frames in any order, and a single encoder thread writes them back in frame
+    order. The output is the same as with render_workers=0.
+    
     Args:
-        input_csv (str): Path to the interpolated CSV file
+        input_csv (str): Path to the interpolated detection log (.csv, .jsonl, .npz or .parquet)
         video_path (str): Path to the original video file
         output_path (str): Path to save the output video
         display_preview (bool): Whether to display a preview window
         save_video (bool): Whether to save the output video
         check_stolen (bool): Whether to check for stolen vehicles
+        render_workers (int, optional): Number of overlay drawing threads, 0 to decode, draw
+            and encode on the calling thread (default: number of CPUs minus 2, at least 1)
+        show_stats (bool): Print the per-stage timing table of the rendering pipeline
     """
-    results = pd.read_csv(input_csv)
+    results = load_detections(input_csv)
 
     # load video
     cap = cv2.VideoCapture(video_path)
@@ -68,10 +317,9 @@ def visualize(input_csv='./output/test_interpolated.csv', video_path='sample2.mp
     
     # Process license plates for each car
     license_plate = {}
-    for car_id in np.unique(results['car_id']):
-        max_ = np.amax(results[results['car_id'] == car_id]['license_number_score'])
-        license_text = results[(results['car_id'] == car_id) & 
-                              (results['license_number_score'] == max_)]['license_number'].iloc[0]
+    best_rows = best_plate_rows(results)
+    for car_id, best_row in best_rows.items():
+        license_text = str(results['license_number'][best_row])
         
         license_plate[car_id] = {
             'license_crop': None,
@@ -83,127 +331,55 @@ def visualize(input_csv='./output/test_interpolated.csv', video_path='sample2.mp
             vehicle_info = check_license_plate_in_database(license_text)
             if vehicle_info:
                 stolen_vehicles[car_id] = vehicle_info
-        
-        # Get the license plate crop
-        cap.set(cv2.CAP_PROP_POS_FRAMES, results[(results['car_id'] == car_id) &
-                                               (results['license_number_score'] == max_)]['frame_nmr'].iloc[0])
-        ret, frame = cap.read()
-
-        x1, y1, x2, y2 = ast.literal_eval(results[(results['car_id'] == car_id) &
-                                               (results['license_number_score'] == max_)]['license_plate_bbox'].iloc[0].replace('[ ', '[').replace('   ', ' ').replace('  ', ' ').replace(' ', ','))
-
-        license_crop = frame[int(y1):int(y2), int(x1):int(x2), :]
-        # Reduce the size of the license plate image to 200px height (half of original)
-        license_crop = cv2.resize(license_crop, (int((x2 - x1) * 200 / (y2 - y1)), 200))
 
+    # Get the license plate crops in one pass over the video
+    for car_id, license_crop in harvest_plate_thumbnails(cap, results, best_rows).items():
         license_plate[car_id]['license_crop'] = license_crop
 
+    # Boxes and thumbnail positions of every row, grouped by frame
+    overlays = FrameOverlays(results, license_plate)
 
-    frame_nmr = -1
+    def print_new_alerts(frame_nmr, rows):
+        # Print alerts for stolen vehicles (only once per vehicle per visualization)
+        for car_id in overlays.car_ids[rows].tolist():
+            license_text = license_plate[car_id]['license_plate_number']
+            if car_id in stolen_vehicles and license_text not in detected_plates and license_text != '0':
+                detected_plates.add(license_text)
+                print_stolen_alert(frame_nmr, car_id, license_text, stolen_vehicles[car_id], fps)
 
     cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
 
-    # read frames
-    ret = True
-    while ret:
-        ret, frame = cap.read()
-        frame_nmr += 1
-        if ret:
-            df_ = results[results['frame_nmr'] == frame_nmr]
-            for row_indx in range(len(df_)):
-                car_id = int(float(df_.iloc[row_indx]['car_id']))
-                
-                # Check if this car is a stolen vehicle
-                is_stolen = car_id in stolen_vehicles
-                
-                # Set colors based on whether the vehicle is stolen
-                border_color = (0, 0, 255) if is_stolen else (0, 255, 0)  # Red for stolen, Green for normal
-                rect_color = (0, 0, 255) if is_stolen else (0, 0, 255)    # Red for stolen plate, Blue for normal
-                
-                # draw car boundary (use original thickness parameters)
-                car_x1, car_y1, car_x2, car_y2 = ast.literal_eval(df_.iloc[row_indx]['car_bbox'].replace('[ ', '[').replace('   ', ' ').replace('  ', ' ').replace(' ', ','))
-                draw_border(frame, (int(car_x1), int(car_y1)), (int(car_x2), int(car_y2)), border_color, 10,
-                            line_length_x=200, line_length_y=200)
-
-                # draw license plate (use original thickness)
-                x1, y1, x2, y2 = ast.literal_eval(df_.iloc[row_indx]['license_plate_bbox'].replace('[ ', '[').replace('   ', ' ').replace('  ', ' ').replace(' ', ','))
-                cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), rect_color, 12)
-
-                # Print alerts for stolen vehicles (only once per vehicle per visualization)
-                license_text = license_plate[car_id]['license_plate_number']
-                if is_stolen and license_text not in detected_plates and license_text != '0':
-                    detected_plates.add(license_text)
-                    vehicle_info = stolen_vehicles[car_id]
-                    
-                    # Calculate timestamp within the video
-                    frame_timestamp = frame_nmr / fps if fps > 0 else 0
-                    hours, remainder = divmod(frame_timestamp, 3600)
-                    minutes, seconds = divmod(remainder, 60)
-                    timecode = f"{int(hours):02d}:{int(minutes):02d}:{int(seconds):02d}"
-                    
-                    # Print alert
-                    print(f"\n⚠️ STOLEN VEHICLE DETECTED ⚠️")
-                    print(f"Frame #{frame_nmr}, Vehicle #{car_id}, Timecode: {timecode}")
-                    print(f"License: {license_text}")
-                    print(f"Vehicle Info: {vehicle_info.get('year', 'N/A')} " +
-                          f"{vehicle_info.get('make', 'N/A')} " +
-                          f"{vehicle_info.get('model', 'N/A')} " +
-                          f"({vehicle_info.get('color', 'N/A')})")
-                    print(f"Description: {vehicle_info.get('description', 'N/A')}")
-                    print("-" * 50)
-
-                # crop license plate
-                license_crop = license_plate[car_id]['license_crop']
-
-                H, W, _ = license_crop.shape
-
-                try:
-                    # Calculate vertical position to avoid overlap - reduced padding
-                    vertical_padding = 50
-                    # Place license plate image above car with reduced spacing
-                    frame[int(car_y1) - H - vertical_padding:int(car_y1) - vertical_padding,
-                          int((car_x2 + car_x1 - W) / 2):int((car_x2 + car_x1 + W) / 2), :] = license_crop
-
-                    # Background color for license text - light red for stolen, white for normal
-                    bg_color = (220, 220, 255) if is_stolen else (255, 255, 255)
-                    # Place text background with reduced height (130px instead of 300px)
-                    bg_height = 130
-                    frame[int(car_y1) - H - vertical_padding - bg_height:int(car_y1) - H - vertical_padding,
-                          int((car_x2 + car_x1 - W) / 2):int((car_x2 + car_x1 + W) / 2), :] = bg_color
-
-                    # Reduce text size
-                    font_scale = 2.0  # Reduced from 4.3
-                    thickness = 6     # Reduced from 17
-                    (text_width, text_height), _ = cv2.getTextSize(
-                        license_plate[car_id]['license_plate_number'],
-                        cv2.FONT_HERSHEY_SIMPLEX,
-                        font_scale,
-                        thickness)
-
-                    # Text color - black for all text
-                    text_color = (0, 0, 0)
-                    # Adjust text position to center it in the background
-                    text_y_position = int(car_y1) - H - vertical_padding - bg_height//2 + text_height//2
-                    cv2.putText(frame,
-                                license_plate[car_id]['license_plate_number'],
-                                (int((car_x2 + car_x1 - text_width) / 2), text_y_position),
-                                cv2.FONT_HERSHEY_SIMPLEX,
-                                font_scale,
-                                text_color,
-                                thickness)
-
-                    # Add "STOLEN" label for stolen vehicles (with small font size)
-                    if is_stolen:
-                        cv2.putText(frame,
-                                    "STOLEN",
-                                    (int(car_x1), int(car_y1) - 10),
-                                    cv2.FONT_HERSHEY_SIMPLEX,
-                                    1.0,  # Smaller font size
-                                    (0, 0, 255),  # Red
-                                    2)  # Thinner text
-
-                except:
-                    pass
+    if render_workers is None:
+        render_workers = default_render_workers()
+
+    # The preview window has to be updated from this thread
+    if render_workers > 0 and not display_preview:
+        def draw_stage(item):
+            frame_nmr, frame = item
+            rows = overlays.rows(frame_nmr)
+            draw_overlays(frame, overlays, rows, license_plate, stolen_vehicles)
+            return frame_nmr, frame, rows
+
+        def encode_stage(item):
+            # Runs on a single thread in frame order, so the alerts are printed in order too
+            frame_nmr, frame, rows = item
+            print_new_alerts(frame_nmr, rows)
+            if save_video:
+                out.write(frame)
+
+        # Enough frames queued in front of the drawing threads to keep all of them busy
+        pipeline = Pipeline(queue_size=2 * render_workers)
+        pipeline.add_stage('draw', draw_stage, workers=render_workers).add_stage('encode', encode_stage)
+        stats = pipeline.run(read_frames(cap))
+        if show_stats:
+            print(format_stats(stats))
+    else:
+        # read frames
+        for frame_nmr, frame in read_frames(cap):
+            rows = overlays.rows(frame_nmr)
+            print_new_alerts(frame_nmr, rows)
+
+            draw_overlays(frame, overlays, rows, license_plate, stolen_vehicles)
 
             if save_video:
                 out.write(frame)
@@ -240,12 +416,15 @@ def visualize(input_csv='./output/test_interpolated.csv', video_path='sample2.mp
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Visualize license plate detection results')
-    parser.add_argument('--input-csv', type=str, default='./output/test_interpolated.csv', help='Path to interpolated CSV file')
+    parser.add_argument('--input-csv', type=str, default='./output/test_interpolated.csv', help='Path to interpolated detection log (.csv, .jsonl, .npz or .parquet)')
     parser.add_argument('--video', type=str, default='sample2.mp4', help='Path to original video file')
     parser.add_argument('--output', type=str, default='./out.mp4', help='Path to save output video')
     parser.add_argument('--preview', action='store_true', help='Display preview window')
     parser.add_argument('--no-save', action='store_true', help='Disable saving output video')
     parser.add_argument('--no-stolen-check', action='store_true', help='Disable stolen vehicle checking')
+    parser.add_argument('--render-workers', type=int, default=None,
+                        help='Overlay drawing threads, 0 to render on a single thread (default: number of CPUs minus 2)')
+    parser.add_argument('--stats', action='store_true', help='Print per-stage timings of the rendering pipeline')
     args = parser.parse_args()
     
     visualize(
@@ -254,5 +433,7 @@ if __name__ == "__main__":
         output_path=args.output,
         display_preview=args.preview,
         save_video=not args.no_save,
-        check_stolen=not args.no_stolen_check
+        check_stolen=not args.no_stolen_check,
+        render_workers=args.render_workers,
+        show_stats=args.stats
     )